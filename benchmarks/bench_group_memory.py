@@ -0,0 +1,43 @@
+"""Memory per series of a group: keys, lookups and rendered text
+
+Run from repository root: python -m benchmarks.bench_group_memory
+"""
+import gc
+import tracemalloc
+
+from epimetheus.metrics import DEFAULT_BUCKETS, Counter, Group, Histogram
+from epimetheus.sample import SampleKey
+
+SERIES = 10_000
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+CODES = (200, 301, 404, 500)
+
+
+def group_size(mcls, **kwargs):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    g = Group(key=SampleKey('requests'), mcls=mcls, kwargs=kwargs)
+    for i in range(SERIES):
+        g.with_labels(
+            method=METHODS[i % len(METHODS)],
+            code=CODES[i // len(METHODS) % len(CODES)],
+            path=f'/items/{i}',
+        )
+    g.render()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size / SERIES
+
+
+def main():
+    for name, mcls, kwargs in (
+        ('Counter', Counter, {'use_clock': False}),
+        ('Histogram', Histogram, {'buckets': DEFAULT_BUCKETS}),
+    ):
+        size = group_size(mcls, **kwargs)
+        print(f'{name:<10} {size:>8.0f} bytes per series')
+
+
+if __name__ == '__main__':
+    main()
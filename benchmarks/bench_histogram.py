@@ -0,0 +1,71 @@
+"""Histogram.observe cost versus bucket count, observe_many versus loop
+
+Run from repository root: python -m benchmarks.bench_histogram
+"""
+import random
+import timeit
+
+from epimetheus.metrics import Histogram, exponential_buckets, numpy
+
+BUCKET_COUNTS = (5, 10, 20, 40, 60, 120)
+NUMBER = 200_000
+
+
+def linear_scan_observe(h, value):
+    # previous implementation, kept for comparison
+    for index, upper in enumerate(h.buckets):
+        if value <= upper:
+            h._bcounts[index] += 1
+            break
+    else:
+        h._bcounts[-1] += 1
+    h._sum += value
+    h._count += 1
+
+
+def bench(count):
+    h = Histogram(buckets=exponential_buckets(0.001, 1.25, count))
+    values = [random.uniform(0, h.buckets[-1] * 1.1) for _ in range(1024)]
+    it = iter(values * (NUMBER // len(values) + 1))
+
+    bisect_t = timeit.timeit(lambda: h.observe(next(it)), number=NUMBER)
+    it = iter(values * (NUMBER // len(values) + 1))
+    scan_t = timeit.timeit(
+        lambda: linear_scan_observe(h, next(it)), number=NUMBER)
+    return bisect_t / NUMBER * 1e9, scan_t / NUMBER * 1e9
+
+
+def bench_many(batch):
+    h = Histogram(buckets=exponential_buckets(0.001, 1.25, 40))
+    values = [random.expovariate(10) for _ in range(batch)]
+    number = max(1, NUMBER // batch)
+
+    def loop():
+        for v in values:
+            h.observe(v)
+
+    loop_t = timeit.timeit(loop, number=number)
+    many_t = timeit.timeit(lambda: h.observe_many(values), number=number)
+    result = [loop_t / number * 1e6, many_t / number * 1e6]
+    if numpy is not None:
+        arr = numpy.array(values)
+        ndarray_t = timeit.timeit(lambda: h.observe_many(arr), number=number)
+        result.append(ndarray_t / number * 1e6)
+    return result
+
+
+def main():
+    print(f'{"buckets":>8} {"bisect ns":>10} {"scan ns":>10}')
+    for count in BUCKET_COUNTS:
+        bisect_ns, scan_ns = bench(count)
+        print(f'{count:>8} {bisect_ns:>10.1f} {scan_ns:>10.1f}')
+
+    print()
+    print(f'{"batch":>8} {"loop us":>10} {"many us":>10} {"ndarray us":>11}')
+    for batch in (10, 100, 1000, 10000, 100000):
+        print(f'{batch:>8}' + ''.join(
+            f' {t:>10.1f}' for t in bench_many(batch)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Memory per histogram series: regular children versus columnar block
+
+Run from repository root: python -m benchmarks.bench_histogram_memory
+"""
+import random
+import sys
+
+from epimetheus.columnar import ColumnarHistogram, HistogramBlock
+from epimetheus.metrics import Histogram, exponential_buckets
+
+SERIES = 10_000
+BUCKETS = exponential_buckets(0.001, 1.4, 40)
+OBSERVATIONS = 1000
+
+
+def fill(children):
+    rnd = random.Random(1)
+    values = [rnd.expovariate(10) for _ in range(OBSERVATIONS)]
+    for m in children:
+        for v in values:
+            m.observe(v)
+    return children
+
+
+def regular_size():
+    children = fill([Histogram(buckets=BUCKETS) for _ in range(SERIES)])
+    total = 0
+    for m in children:
+        total += sys.getsizeof(m) + sys.getsizeof(m.__dict__)
+        total += sys.getsizeof(m._bcounts) + sys.getsizeof(m._sum)
+        # small ints are shared by interpreter
+        total += sum(sys.getsizeof(c) for c in m._bcounts if c > 256)
+    return total / SERIES
+
+
+def columnar_size():
+    block = HistogramBlock(BUCKETS)
+    children = fill([
+        ColumnarHistogram(block, block.add_row()) for _ in range(SERIES)])
+    total = sum(sys.getsizeof(m) for m in children)
+    total += sys.getsizeof(block.counts) + sys.getsizeof(block.sums)
+    total += sys.getsizeof(block.dirty) + sys.getsizeof(block.created)
+    return total / SERIES
+
+
+def main():
+    print(
+        f'{len(BUCKETS)} buckets, '
+        f'{OBSERVATIONS} observations per series')
+    for name, size in (
+        ('Histogram', regular_size),
+        ('ColumnarHistogram', columnar_size),
+    ):
+        print(f'{name:<20} {size():>8.0f} bytes per series')
+
+
+if __name__ == '__main__':
+    main()
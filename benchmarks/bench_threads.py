@@ -0,0 +1,66 @@
+"""Counter and histogram update throughput under thread contention
+
+Run from repository root: python -m benchmarks.bench_threads
+"""
+import time
+from threading import Barrier, Thread
+
+from epimetheus.metrics import Counter, Histogram
+from epimetheus.threadsafe import LockedGauge, ShardedCounter, ShardedHistogram
+
+THREAD_COUNTS = (1, 2, 4, 8, 16, 32)
+TOTAL_UPDATES = 400_000
+
+
+def run(update, threads):
+    per_thread = TOTAL_UPDATES // threads
+    barrier = Barrier(threads + 1)
+
+    def target():
+        barrier.wait()
+        for _ in range(per_thread):
+            update()
+
+    ts = [Thread(target=target) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return per_thread * threads / elapsed
+
+
+def cases():
+    c = Counter(use_clock=False)
+    yield 'Counter (unsafe)', c.inc, lambda: c._count
+    sc = ShardedCounter(use_clock=False)
+    yield 'ShardedCounter', sc.inc, lambda: next(sc.sample_values()).value
+    g = LockedGauge(use_clock=False)
+    yield 'LockedGauge', g.inc, lambda: next(g.sample_values()).value
+    h = Histogram()
+    yield 'Histogram (unsafe)', lambda: h.observe(0.3), lambda: h._count
+    sh = ShardedHistogram()
+    yield (
+        'ShardedHistogram', lambda: sh.observe(0.3),
+        lambda: list(sh.sample_values())[-1].value)
+
+
+def main():
+    print(f'{"":<20}' + ''.join(f'{n:>10}' for n in THREAD_COUNTS))
+    for name, update, _ in cases():
+        rates = [run(update, n) for n in THREAD_COUNTS]
+        print(f'{name:<20}' + ''.join(f'{r / 1e6:>9.2f}M' for r in rates))
+    print('updates per second, total across threads')
+
+    print()
+    print('lost updates at 32 threads:')
+    for name, update, read in cases():
+        per_thread = TOTAL_UPDATES // 32
+        run(update, 32)
+        print(f'{name:<20}{per_thread * 32 - read():>10}')
+
+
+if __name__ == '__main__':
+    main()
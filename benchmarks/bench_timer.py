@@ -0,0 +1,65 @@
+"""Overhead of timing helpers per timed call
+
+Run from repository root: python -m benchmarks.bench_timer
+"""
+import asyncio
+import time
+import timeit
+
+from epimetheus.metrics import Gauge, Histogram
+
+NUMBER = 200_000
+REPEAT = 5
+
+
+def work():
+    pass
+
+
+def best(func, number=NUMBER):
+    return min(timeit.repeat(func, number=number, repeat=REPEAT))
+
+
+def main():
+    h = Histogram()
+
+    def manual():
+        start = time.time()
+        work()
+        h.observe(time.time() - start)
+
+    def with_block():
+        with h.time():
+            work()
+
+    decorated = h.time()(work)
+
+    g = Gauge(use_clock=False)
+    tracked = g.track_inprogress()(work)
+
+    async def async_work():
+        pass
+
+    async_decorated = h.time()(async_work)
+
+    async def run_async(func):
+        for _ in range(NUMBER):
+            await func()
+
+    results = [
+        ('bare call', best(work)),
+        ('time.time() by hand', best(manual)),
+        ('with time()', best(with_block)),
+        ('@time()', best(decorated)),
+        ('@track_inprogress()', best(tracked)),
+        ('async bare call', best(
+            lambda: asyncio.run(run_async(async_work)), number=1)),
+        ('async @time()', best(
+            lambda: asyncio.run(run_async(async_decorated)), number=1)),
+    ]
+    for name, t in results:
+        print(f'{name:>20} {t / NUMBER * 1e9:>8.1f} ns')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""Benchmark suite with saved baseline to catch regressions
+
+Run from repository root:
+
+    python -m benchmarks.suite                  # print results
+    python -m benchmarks.suite --compare        # compare with baseline
+    python -m benchmarks.suite --save           # overwrite baseline
+    python -m benchmarks.suite -k expose        # only matching benchmarks
+
+Timings are best of several repeats, per operation.
+Comparison exits with status 1 if any result is worse than baseline
+by more than --threshold. Baseline is machine specific, save it again
+before comparing on other hardware.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from itertools import cycle, islice
+
+from epimetheus import metrics, openmetrics
+from epimetheus.metrics import (
+    Counter, Gauge, Group, Histogram, NativeHistogram, Summary)
+from epimetheus.quantile import ckms
+from epimetheus.registry import Registry
+from epimetheus.sample import SampleKey
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+REPEAT = 5
+NUMBER = 100_000
+SERIES_COUNTS = (1_000, 10_000, 100_000)
+WINDOW_SIZES = (1_000, 10_000, 100_000)
+
+# name -> function giving {metric: value}, lower values are better,
+# except for rates, with names ending with "/s"
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def best_ns(func, number=NUMBER):
+    """
+    Best time of a call, in nanoseconds.
+    number=None picks call count to take at least 0.2s per repeat.
+    """
+    if number is None:
+        number = timeit.Timer(func).autorange()[0]
+    times = timeit.repeat(func, number=number, repeat=REPEAT)
+    return min(times) / number * 1e9
+
+
+def values(count=1024):
+    rnd = random.Random(1)
+    return [rnd.lognormvariate(-3, 1) for _ in range(count)]
+
+
+@benchmark('counter.inc')
+def bench_counter_inc():
+    result = {}
+    for mode in metrics.TIMESTAMP_MODES:
+        c = Counter(timestamps=mode)
+        result[f'{mode} ns'] = best_ns(c.inc)
+    result['no clock ns'] = best_ns(Counter(use_clock=False).inc)
+    return result
+
+
+@benchmark('gauge.set')
+def bench_gauge_set():
+    g = Gauge()
+    return {'ns': best_ns(lambda: g.set(1))}
+
+
+@benchmark('observe')
+def bench_observe():
+    next_value = cycle(values()).__next__
+    result = {}
+    for name, m in (
+        ('histogram', Histogram()),
+        ('histogram 60 buckets', Histogram(
+            buckets=metrics.exponential_buckets(0.0001, 1.25, 60))),
+        ('native histogram', NativeHistogram()),
+        ('summary', Summary(buckets=[0.5, 0.9, 0.99], age_buckets=5)),
+        ('summary ckms', Summary(
+            buckets=[0.5, 0.9, 0.99], estimator=ckms(0.01))),
+    ):
+        # value lookup cost is included, same for all metrics
+        observe = m.observe
+        result[f'{name} ns'] = best_ns(lambda: observe(next_value()))
+    return result
+
+
+def labelled_group(mcls=Counter):
+    return Group(key=SampleKey('requests_total'), mcls=mcls)
+
+
+@benchmark('with_labels')
+def bench_with_labels():
+    g = labelled_group()
+    g.with_labels(method='GET', code=200)
+    hit = best_ns(lambda: g.with_labels(method='GET', code=200))
+
+    # every lookup creates a child, group is replaced between repeats
+    number = 20_000
+    times = []
+    for _ in range(REPEAT):
+        g = labelled_group()
+        labels = [{'method': 'GET', 'code': i} for i in range(number)]
+        it = iter(labels)
+        times.append(timeit.timeit(
+            lambda: g.with_labels(**next(it)), number=number))
+    miss = min(times) / number * 1e9
+    return {'hit ns': hit, 'miss ns': miss}
+
+
+def registry_with_series(count):
+    "Counters and histograms, count series in total"
+    registry = Registry()
+    requests = registry.counter(name='requests_total', help='Requests')
+    latency = registry.histogram(
+        name='latency_seconds', help='Latency', buckets=[0.1, 0.5, 1])
+    # histogram child gives 6 series
+    nhist = count // 2 // 6
+    for i in range(count - nhist * 6):
+        requests.with_labels(path=f'/items/{i}', code=200).inc(i)
+    for i in range(nhist):
+        latency.with_labels(path=f'/items/{i}').observe(i % 3 / 2)
+    return registry, requests
+
+
+@benchmark('expose')
+def bench_expose():
+    result = {}
+    for count in SERIES_COUNTS:
+        registry, requests = registry_with_series(count)
+
+        def expose():
+            return '\n'.join(registry.expose())
+
+        def render_one_changed():
+            requests.with_labels(path='/items/0', code=200).inc()
+            return registry.render()
+
+        expose_t = best_ns(expose, number=None)
+        registry.render()
+        render_t = best_ns(render_one_changed, number=None)
+
+        gc.collect()
+        tracemalloc.start()
+        expose()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        result[f'{count} series ms'] = expose_t / 1e6
+        result[f'{count} series render one changed ms'] = render_t / 1e6
+        result[f'{count} series peak KB'] = peak / 1e3
+    return result
+
+
+def registry_for_render(count):
+    "Integer counters, float gauges, histograms and summaries"
+    registry = Registry()
+    requests = registry.counter(name='requests_total', use_clock=False)
+    temperature = registry.gauge(name='temperature', use_clock=False)
+    latency = registry.histogram(
+        name='latency_seconds', buckets=[0.1, 0.25, 0.5, 1, 2.5])
+    size = registry.summary(name='size_bytes', buckets=[0.5, 0.9, 0.99])
+    vals = values()
+    for i in range(count // 4):
+        labels = {'path': f'/items/{i}'}
+        requests.with_labels(**labels).inc(i)
+        temperature.with_labels(**labels).set(vals[i % len(vals)] * 100)
+        latency.with_labels(**labels).observe(vals[i % len(vals)])
+        size.with_labels(**labels).observe(i % 1000)
+    return registry
+
+
+@benchmark('render throughput')
+def bench_render_throughput():
+    registry = registry_for_render(10_000)
+    lines = len(list(registry.expose()))
+    om_lines = ''.join(openmetrics.render_chunks(registry)).count('\n')
+
+    def render_all():
+        # every child is rendered again, as if all of them changed
+        for group in registry.groups():
+            group._render_cache.clear()
+        return registry.render()
+
+    return {
+        'expose lines/s': lines / best_ns(
+            lambda: list(registry.expose()), number=None) * 1e9,
+        'render all changed lines/s': lines / best_ns(
+            render_all, number=None) * 1e9,
+        'openmetrics lines/s': om_lines / best_ns(
+            lambda: list(openmetrics.render_chunks(registry)),
+            number=None) * 1e9,
+    }
+
+
+@benchmark('summary scrape')
+def bench_summary_scrape():
+    result = {}
+    vals = values()
+    for size in WINDOW_SIZES:
+        for name, kwargs in (
+            ('exact', {}),
+            ('age buckets', {'age_buckets': 5}),
+            ('ckms', {'estimator': ckms(0.01)}),
+        ):
+            s = Summary(buckets=[0.5, 0.9, 0.99], **kwargs)
+            s.observe_many(list(islice(cycle(vals), size)))
+            t = best_ns(lambda: list(s.sample_values()), number=None)
+            result[f'{size} {name} us'] = t / 1e3
+    return result
+
+
+def run(pattern=None):
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        print(f'{name}...', file=sys.stderr)
+        for metric, value in func().items():
+            results[f'{name}: {metric}'] = value
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'numpy': metrics.numpy is not None,
+    }
+
+
+def compare(results, baseline, threshold):
+    "Prints comparison table, returns names of regressed results"
+    regressed = []
+    print(f'{"benchmark":<50} {"baseline":>12} {"current":>12} {"ratio":>7}')
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<50} {"-":>12} {value:>12.1f}')
+            continue
+        ratio = value / base if base else 1
+        if name.endswith('/s') and value:
+            ratio = base / value
+        mark = ''
+        if ratio > threshold:
+            mark = ' worse'
+            regressed.append(name)
+        elif ratio < 1 / threshold:
+            mark = ' better'
+        print(f'{name:<50} {base:>12.1f} {value:>12.1f} {ratio:>7.2f}{mark}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run benchmark suite')
+    parser.add_argument('-k', dest='pattern', help='run matching benchmarks')
+    parser.add_argument('--save', action='store_true', help='save baseline')
+    parser.add_argument(
+        '--compare', action='store_true', help='compare with baseline')
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help='ratio to baseline considered a regression')
+    parser.add_argument('--baseline', default=BASELINE)
+    args = parser.parse_args()
+
+    results = run(args.pattern)
+    if args.compare:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['environment'] != environment():
+            print(
+                f'Baseline was saved in other environment: '
+                f'{saved["environment"]}', file=sys.stderr)
+        regressed = compare(results, saved['results'], args.threshold)
+        if regressed:
+            print(f'{len(regressed)} regressions', file=sys.stderr)
+            sys.exit(1)
+    else:
+        for name, value in results.items():
+            print(f'{name:<50} {value:>12.1f}')
+
+    if args.save:
+        if args.pattern and os.path.exists(args.baseline):
+            # partial run updates only its results
+            with open(args.baseline) as f:
+                results = {**json.load(f)['results'], **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(
+                {'environment': environment(), 'results': results},
+                f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from inspect import iscoroutinefunction
+from time import monotonic
+from typing import Callable
+
+from . import metrics
+from .sample import SampleKey, SampleValue
+
+# Metrics computed by callbacks when registry is exposed,
+# instead of being updated by application code.
+# Collector is a function or coroutine function returning families:
+#
+#   def collect_queues():
+#       family = gauge_family('queue_length')
+#       for name, queue in queues.items():
+#           family.add(len(queue), queue=name)
+#       return [family]
+#
+#   registry.register_collector(collect_queues)
+
+__all__ = (
+    'Collector', 'Family', 'Value',
+    'counter_family', 'gauge_family', 'histogram_family', 'summary_family',
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Value:
+    "Sample of counter or gauge family, lighter than Counter or Gauge"
+    __slots__ = ('value', 'timestamp', '_dirty')
+
+    def __init__(self, value: float, timestamp: int = None):
+        self.value = value
+        self.timestamp = timestamp
+        self._dirty = True
+
+    def sample_group(self, skey: SampleKey):
+        yield skey
+
+    def sample_values(self):
+        yield SampleValue(self.value, self.timestamp)
+
+
+@dataclass
+class Family(metrics.Group):
+    "Metric group filled by collector"
+
+    def add(self, value, **labels):
+        """
+        value is a number for counter and gauge families, or metric
+        instance holding samples (e.g. Histogram) for any family
+        """
+        if not hasattr(value, 'sample_values'):
+            value = Value(value)
+        k = self.key.with_labels(**labels)
+        if self._templates is None:
+            self._templates = self._make_templates(value)
+        self._items[k] = value
+
+
+def _family_factory(mcls):
+    def factory(
+        name: str,
+        *,
+        labels: dict = None,
+        help: str = None,
+    ) -> Family:
+        return Family(key=SampleKey(name, labels), mcls=mcls, help=help)
+    return factory
+
+
+counter_family = _family_factory(metrics.Counter)
+gauge_family = _family_factory(metrics.Gauge)
+histogram_family = _family_factory(metrics.Histogram)
+summary_family = _family_factory(metrics.Summary)
+
+
+@dataclass
+class Collector:
+    """
+    Collection callback registered in Registry with its latest result.
+    Sync collectors are called on exposition, async ones
+    by Registry.collect_async, exposition reuses their latest result.
+    """
+    func: Callable
+    # seconds async collector may run, it gives no samples if exceeded;
+    # failing collector gives no samples until next successful collection
+    timeout: float = None
+    # seconds result is reused for, instead of collecting again
+    ttl: float = None
+    is_async: bool = field(init=False)
+    _families: tuple = field(init=False, default=None)
+    _collected: float = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.is_async = iscoroutinefunction(self.func)
+        if self.timeout is not None and not self.is_async:
+            raise ValueError('Only async collectors support timeout')
+
+    def _fresh(self) -> bool:
+        return (
+            self._families is not None and self.ttl is not None
+            and monotonic() - self._collected < self.ttl)
+
+    def _store(self, families):
+        self._families = tuple(families)
+        self._collected = monotonic()
+        return self._families
+
+    def families(self):
+        "Families to expose, sync collector is called if needed"
+        if self.is_async or self._fresh():
+            return self._families or ()
+        try:
+            families = self.func()
+        except Exception:
+            # other metrics are still exposed, failure is not reused
+            logger.exception('Collector %r failed', self.func)
+            self._families = None
+            return ()
+        return self._store(families)
+
+    async def collect_async(self):
+        if not self.is_async or self._fresh():
+            return
+        try:
+            families = await asyncio.wait_for(self.func(), self.timeout)
+        except asyncio.TimeoutError:
+            # no samples until next collection, result is not reused
+            self._families = None
+        except Exception:
+            logger.exception('Collector %r failed', self.func)
+            self._families = None
+        else:
+            self._store(families)
+
+    def render_state(self):
+        "Same as Group.render_state for all families of collector"
+        if not self.is_async and not self._fresh():
+            return None
+        state = []
+        for family in self._families or ():
+            fstate = family.render_state()
+            if fstate is None:
+                return None
+            state.append(fstate)
+        return tuple(state)
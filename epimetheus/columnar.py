@@ -0,0 +1,115 @@
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Dict
+
+from . import metrics
+from .sample import SampleValue, clock_seconds
+
+# Compact storage for histogram groups with many label sets.
+# Bucket counts of all children live in one contiguous array,
+# row per child, instead of a list of boxed ints per child.
+
+__all__ = ('HistogramBlock', 'ColumnarHistogram', 'ColumnarHistogramGroup')
+
+
+class HistogramBlock:
+    def __init__(self, buckets):
+        self.buckets = metrics.to_sorted_tuple(buckets)
+        # buckets including +Inf
+        self.width = len(self.buckets) + 1
+        # rows x width bucket counts
+        self.counts = array('Q')
+        self.sums = array('d')
+        self.dirty = bytearray()
+        # creation unix time of every row
+        self.created = array('d')
+
+    def __len__(self):
+        return len(self.sums)
+
+    def add_row(self) -> int:
+        self.counts.frombytes(bytes(8 * self.width))
+        self.sums.append(0)
+        self.dirty.append(1)
+        self.created.append(clock_seconds())
+        return len(self.sums) - 1
+
+    def row(self, index):
+        base = index * self.width
+        return self.counts[base:base + self.width]
+
+
+class ColumnarHistogram:
+    "Histogram child referring to a row of HistogramBlock"
+    __slots__ = ('_block', '_row', '_base', 'buckets', '_exemplars')
+
+    TYPE = metrics.Histogram.TYPE
+    RESERVED_LABELS = metrics.Histogram.RESERVED_LABELS
+    CACHEABLE = True
+
+    def __init__(self, block: HistogramBlock, row: int):
+        self._block = block
+        self._row = row
+        self._base = row * block.width
+        self.buckets = block.buckets
+        self._exemplars = None
+
+    @property
+    def _created(self):
+        return self._block.created[self._row]
+
+    @property
+    def _dirty(self):
+        return self._block.dirty[self._row]
+
+    @_dirty.setter
+    def _dirty(self, value):
+        self._block.dirty[self._row] = value
+
+    def observe(self, value: float, exemplar: Dict[str, str] = None):
+        block = self._block
+        index = bisect_left(self.buckets, value)
+        block.counts[self._base + index] += 1
+        block.sums[self._row] += value
+        block.dirty[self._row] = 1
+        if exemplar is not None:
+            self._store_exemplar(index, exemplar, value)
+
+    _store_exemplar = metrics.Histogram._store_exemplar
+
+    observe_many = metrics.Histogram.observe_many
+    time = metrics.Histogram.time
+
+    def _add_counts(self, counts, vsum):
+        block = self._block
+        base = self._base
+        for index, c in enumerate(counts):
+            block.counts[base + index] += c
+        block.sums[self._row] += vsum
+        block.dirty[self._row] = 1
+
+    sample_group = metrics.Histogram.sample_group
+
+    def sample_values(self):
+        counts = self._block.row(self._row)
+        for v in counts:
+            yield SampleValue(v)
+        yield SampleValue(self._block.sums[self._row])
+        yield SampleValue(sum(counts))
+
+
+@dataclass
+class ColumnarHistogramGroup(metrics.Group):
+    mcls: type = ColumnarHistogram
+    _block: HistogramBlock = field(init=False, repr=False)
+
+    def __post_init__(self):
+        super().__post_init__()
+        # validates arguments same way as regular histogram does
+        h = metrics.Histogram(*self.args, **self.kwargs)
+        self._block = HistogramBlock(h.buckets)
+
+    def _create_item(self, k):
+        # rows of removed children are not reused
+        return ColumnarHistogram(self._block, self._block.add_row())
@@ -0,0 +1,236 @@
+import asyncio
+import zlib
+from dataclasses import dataclass
+from inspect import isawaitable
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+
+from . import openmetrics, protobuf
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Delivery of rendered registry to clients
+
+__all__ = (
+    'CONTENT_TYPE', 'ENCODINGS', 'Format', 'TEXT', 'OPENMETRICS', 'PROTOBUF',
+    'CompressedExposition', 'choose_encoding', 'choose_format', 'write_async',
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@dataclass(frozen=True)
+class Format:
+    content_type: str
+    # registry -> pieces of exposition, str or bytes if binary
+    chunks: Callable
+    binary: bool = False
+
+
+def _text_chunks(registry):
+    return registry.render_chunks()
+
+
+TEXT = Format(CONTENT_TYPE, _text_chunks)
+OPENMETRICS = Format(openmetrics.CONTENT_TYPE, openmetrics.render_chunks)
+PROTOBUF = Format(protobuf.CONTENT_TYPE, protobuf.encode_chunks, binary=True)
+
+# supported Content-Encoding values, most preferred first
+ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip', )
+
+
+def _compressobj(encoding: str, level: int = None):
+    if encoding == 'gzip':
+        return zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+            zlib.DEFLATED, 31)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level).compressobj()
+    raise ValueError(f'Unsupported encoding {encoding}')
+
+
+def _parse_accept(header: str):
+    "Yields (lowercased name, params, q) of Accept-like header items"
+    for item in header.split(','):
+        name, *params = item.split(';')
+        q = 1.0
+        pdict = {}
+        for param in params:
+            k, _, v = param.strip().partition('=')
+            k = k.lower()
+            if k == 'q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0
+            else:
+                pdict[k] = v.strip('"')
+        yield name.strip().lower(), pdict, q
+
+
+def choose_encoding(accept_encoding: str):
+    """
+    Best of supported encodings allowed by Accept-Encoding header,
+    None if response should stay uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    allowed = {name: q for name, _, q in _parse_accept(accept_encoding)}
+    best = None
+    for encoding in ENCODINGS:
+        q = allowed.get(encoding, allowed.get('*', 0))
+        if q > 0 and (best is None or q > best[1]):
+            best = encoding, q
+    return best and best[0]
+
+
+def _media_format(name: str, params: dict):
+    if name == 'application/vnd.google.protobuf':
+        if (
+            params.get('proto') == 'io.prometheus.client.MetricFamily'
+            and params.get('encoding') == 'delimited'
+        ):
+            return PROTOBUF
+    elif name == 'application/openmetrics-text':
+        return OPENMETRICS
+    elif name in ('text/plain', 'text/*', '*/*'):
+        return TEXT
+    return None
+
+
+def choose_format(accept: str, registry=None) -> Format:
+    """
+    Best of supported formats allowed by Accept header,
+    Prometheus text format if none matches.
+    Multiprocess registries are exposed in text format only.
+    """
+    if not accept or (
+        registry is not None and registry.multiprocess_dir is not None
+    ):
+        return TEXT
+    best = None
+    for name, params, q in _parse_accept(accept):
+        fmt = _media_format(name, params)
+        # on equal preference the first listed wins
+        if fmt is not None and q > 0 and (best is None or q > best[1]):
+            best = fmt, q
+    return best[0] if best else TEXT
+
+
+class CompressedExposition:
+    """
+    Compressed text of registry, compressed again only
+    when something has changed since previous call.
+    Text is compressed as it's rendered, piece by piece,
+    so the whole uncompressed text is never kept in memory.
+    Formats other than TEXT are rendered and compressed on every call.
+    """
+
+    def __init__(
+        self,
+        registry,
+        encoding: str = 'gzip',
+        level: int = None,
+        format: Format = TEXT,
+    ):
+        _compressobj(encoding, level)
+        self.registry = registry
+        self.encoding = encoding
+        self.level = level
+        self.format = format
+        self._state = None
+        self._payload = None
+        self._lock = Lock()
+
+    def payload(self) -> bytes:
+        with self._lock:
+            state = None
+            if self.format is TEXT:
+                state = self.registry.render_state()
+            if state is None or state != self._state:
+                self._payload = self._compress()
+                if self.format is TEXT:
+                    self._state = self.registry.render_state()
+            return self._payload
+
+    def _compress(self) -> bytes:
+        compressor = _compressobj(self.encoding, self.level)
+        parts = []
+        for chunk in _encoded_chunks(
+            self.format.chunks(self.registry), binary=self.format.binary,
+        ):
+            data = compressor.compress(chunk)
+            if data:
+                parts.append(data)
+        parts.append(compressor.flush())
+        return b''.join(parts)
+
+
+def _joined(parts, binary: bool) -> bytes:
+    if binary:
+        return b''.join(parts)
+    return ''.join(parts).encode('utf-8')
+
+
+def _encoded_chunks(
+    pieces, chunk_size: int = 64 * 1024, binary: bool = False,
+):
+    "Joins small pieces of exposition into encoded chunks of about chunk_size"
+    parts = []
+    size = 0
+    for piece in pieces:
+        parts.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield _joined(parts, binary)
+            parts = []
+            size = 0
+    if parts:
+        yield _joined(parts, binary)
+
+
+async def write_async(
+    registry,
+    stream,
+    *,
+    time_slice: float = 0.005,
+    chunk_size: int = 64 * 1024,
+    format: Format = TEXT,
+):
+    """
+    Renders registry directly into stream without blocking event loop
+    for longer than time_slice seconds at once.
+    stream.write receives encoded chunks of about chunk_size bytes,
+    it may be a coroutine (aiohttp StreamResponse)
+    or a plain method accompanied by drain (asyncio StreamWriter).
+    Async collectors of registry are run first.
+    """
+    await registry.collect_async()
+    deadline = perf_counter() + time_slice
+    parts = []
+    size = 0
+    for piece in format.chunks(registry):
+        parts.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            await _write(stream, _joined(parts, format.binary))
+            parts = []
+            size = 0
+        if perf_counter() >= deadline:
+            await asyncio.sleep(0)
+            deadline = perf_counter() + time_slice
+    if parts:
+        await _write(stream, _joined(parts, format.binary))
+
+
+async def _write(stream, data: bytes):
+    result = stream.write(data)
+    if isawaitable(result):
+        await result
+    elif hasattr(stream, 'drain'):
+        await stream.drain()
@@ -1,30 +1,116 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import deque
 from dataclasses import dataclass, field
-from math import ceil, floor
-from typing import List, Tuple
-
-from .sample import SampleKey, SampleValue, clock
+from functools import lru_cache
+from itertools import chain, count
+from math import ceil, floor, frexp
+from sys import intern
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from .sample import (
+    COARSE_CLOCK, LABEL_NAME_RE, SampleKey, SampleValue, clock, clock_seconds)
+from .timer import InProgress, Timer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Metrics should be optimized for fast receiving of data
 # And relatively rare reporting
 
-__all__ = ('Counter', 'Gauge', 'Histogram', 'Summary')
+__all__ = (
+    'Counter', 'Gauge', 'Histogram', 'NativeHistogram', 'Summary',
+    'DEFAULT_BUCKETS', 'linear_buckets', 'exponential_buckets',
+)
+
+# same as default buckets of official prometheus clients
+DEFAULT_BUCKETS = (
+    .005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 7.5, 10)
+
+
+def linear_buckets(start: float, width: float, count: int) -> Tuple[float]:
+    if count < 1:
+        raise ValueError('Bucket count must be positive')
+    return tuple(start + width * i for i in range(count))
+
+
+def exponential_buckets(
+    start: float, factor: float, count: int,
+) -> Tuple[float]:
+    if count < 1:
+        raise ValueError('Bucket count must be positive')
+    if start <= 0:
+        raise ValueError('Start of exponential buckets must be positive')
+    if factor <= 1:
+        raise ValueError('Factor of exponential buckets must be above 1')
+    return tuple(start * factor ** i for i in range(count))
+
+
+# how timestamps of counters and gauges are taken
+# exact: clock() on every update
+# coarse: COARSE_CLOCK value, refreshed in background
+# lazy: update only marks timestamp outdated, it's taken on exposition
+TIMESTAMP_MODES = ('exact', 'coarse', 'lazy')
+
+# OpenMetrics limit of exemplar label names and values length
+EXEMPLAR_MAX_LENGTH = 128
+
+
+def make_exemplar(labels: Dict[str, str], value: float):
+    "Exemplar as kept by metrics: (labels, observed value, unix time)"
+    labels = {k: str(v) for k, v in labels.items()}
+    for k in labels:
+        if LABEL_NAME_RE.fullmatch(k) is None:
+            raise ValueError('Invalid label name')
+    if sum(len(k) + len(v) for k, v in labels.items()) > EXEMPLAR_MAX_LENGTH:
+        raise ValueError(
+            f'Exemplar labels must not exceed {EXEMPLAR_MAX_LENGTH} chars')
+    return labels, value, clock_seconds()
 
 
 @dataclass
 class MetricWithTimestamp:
+    # rendered samples may be reused until next change
+    CACHEABLE = True
+    # label names children can not have, added to samples by metric
+    RESERVED_LABELS = frozenset()
+
     use_clock: bool = True
     reclock_if_changed: bool = False
+    # one of TIMESTAMP_MODES
+    timestamps: str = 'exact'
     _ts: float = field(init=False, default=None)
+    _ts_outdated: bool = field(init=False, default=False)
+    _dirty: bool = field(init=False, default=True)
 
     def __post_init__(self):
+        if self.timestamps not in TIMESTAMP_MODES:
+            raise ValueError(
+                f'Timestamp mode must be one of {TIMESTAMP_MODES}')
+        if self.use_clock and self.timestamps == 'coarse':
+            COARSE_CLOCK.start()
         self._update_ts(1)
 
     def _update_ts(self, vdiff):
         if not self.use_clock:
             return
         if (not self.reclock_if_changed) or vdiff:
+            if self.timestamps == 'exact':
+                self._ts = clock()
+            elif self.timestamps == 'coarse':
+                self._ts = COARSE_CLOCK.now
+            else:
+                self._ts_outdated = True
+
+    def _current_ts(self):
+        if self._ts_outdated:
+            self._ts_outdated = False
             self._ts = clock()
+        return self._ts
 
 
 @dataclass
@@ -32,17 +118,24 @@ class Counter(MetricWithTimestamp):
     TYPE = 'counter'
 
     _count: float = field(init=False, default=0)
+    # unix time in seconds, exposed as _created by OpenMetrics
+    _created: float = field(init=False, default_factory=clock_seconds)
+    # exemplar of the latest increment given one
+    _exemplar: tuple = field(init=False, default=None)
 
-    def inc(self, delta: float = 1):
+    def inc(self, delta: float = 1, exemplar: Dict[str, str] = None):
         assert delta >= 0
         self._count += delta
+        self._dirty = True
         self._update_ts(delta)
+        if exemplar is not None:
+            self._exemplar = make_exemplar(exemplar, delta)
 
     def sample_group(self, skey: SampleKey):
         yield skey
 
     def sample_values(self):
-        yield SampleValue(self._count, self._ts)
+        yield SampleValue(self._count, self._current_ts())
 
 
 @dataclass
@@ -53,65 +146,149 @@ class Gauge(MetricWithTimestamp):
 
     def inc(self, delta: float = 1):
         self._value += delta
+        self._dirty = True
         self._update_ts(delta)
 
     def dec(self, delta: float = 1):
         self._value -= delta
+        self._dirty = True
         self._update_ts(delta)
 
     def set(self, value: float):
         vdiff = value - self._value
         self._value = value
+        self._dirty = True
         self._update_ts(vdiff)
 
     def set_with_timestamp(self, value: float, ts: int):
         "For metrics like daily active users"
         self._value = value
         self._ts = ts
+        self._ts_outdated = False
+        self._dirty = True
 
     # TODO: set_to_current_time
 
+    def time(self) -> Timer:
+        "Sets gauge to duration of with-block or of decorated call"
+        return Timer(self.set)
+
+    def track_inprogress(self) -> InProgress:
+        "Counts running with-blocks or decorated calls"
+        return InProgress(self.inc, self.dec)
+
     def sample_group(self, skey: SampleKey):
         yield skey
 
     def sample_values(self):
-        yield SampleValue(self._value, self._ts)
+        yield SampleValue(self._value, self._current_ts())
 
 
 def to_sorted_tuple(x):
     return tuple(sorted(x))
 
 
+@lru_cache(maxsize=None)
+def _bound_labels(bounds: Tuple[float]) -> Tuple[str]:
+    """
+    le or quantile label values of bounds, computed once per layout.
+    Integral bounds look the same given as ints or floats, e.g. 1 and 1.0
+    """
+    labels = []
+    for b in bounds:
+        text = repr(float(b))
+        labels.append(text[:-2] if text.endswith('.0') else text)
+    return tuple(labels)
+
+
+def bucket_counts(buckets: Tuple[float], values: Iterable[float]):
+    """
+    Counts of values per bucket (last one is +Inf) and sum of values,
+    same as calling Histogram.observe for every value.
+    """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        counts = numpy.bincount(
+            numpy.searchsorted(buckets, values, side='left'),
+            minlength=len(buckets) + 1)
+        return counts.tolist(), float(values.sum())
+
+    if not hasattr(values, '__len__'):
+        values = list(values)
+    if len(values) <= len(buckets):
+        counts = [0] * (len(buckets) + 1)
+        for v in values:
+            counts[bisect_left(buckets, v)] += 1
+        return counts, sum(values)
+    if numpy is not None:
+        return bucket_counts(buckets, numpy.asarray(values, dtype='d'))
+
+    # walk bucket bounds over sorted values
+    values = sorted(values)
+    counts = []
+    prev = 0
+    for upper in buckets:
+        pos = bisect_right(values, upper)
+        counts.append(pos - prev)
+        prev = pos
+    counts.append(len(values) - prev)
+    return counts, sum(values)
+
+
 @dataclass
 class Histogram:
     TYPE = 'histogram'
     RESERVED_LABELS = frozenset(['le'])
+    CACHEABLE = True
 
-    buckets: Tuple[float]
+    buckets: Tuple[float] = DEFAULT_BUCKETS
+    # last item counts values above all buckets (+Inf)
     _bcounts: List[int] = field(init=False)
-    _inf_bcount: int = field(init=False, default=0)
     _sum: float = field(init=False, default=0)
     _count: int = field(init=False, default=0)
+    _dirty: bool = field(init=False, default=True)
+    _created: float = field(init=False, default_factory=clock_seconds)
+    # latest exemplar per bucket, allocated with the first one
+    _exemplars: list = field(init=False, default=None)
 
     def __post_init__(self):
         self.buckets = to_sorted_tuple(self.buckets)
-        self._bcounts = [0 for _ in self.buckets]
+        self._bcounts = [0 for _ in range(len(self.buckets) + 1)]
 
-    def observe(self, value: float):
-        # TODO: optimize, use bisect
-        for index, upper in enumerate(self.buckets):
-            if value <= upper:
-                self._bcounts[index] += 1
-                break
-        else:
-            self._inf_bcount += 1
+    def observe(self, value: float, exemplar: Dict[str, str] = None):
+        # first bucket where value <= upper bound
+        index = bisect_left(self.buckets, value)
+        self._bcounts[index] += 1
         self._sum += value
         self._count += 1
+        self._dirty = True
+        if exemplar is not None:
+            self._store_exemplar(index, exemplar, value)
+
+    def time(self) -> Timer:
+        "Observes duration of with-block or of every decorated call"
+        return Timer(self.observe)
+
+    def _store_exemplar(self, index: int, labels: Dict[str, str], value):
+        if self._exemplars is None:
+            self._exemplars = [None] * (len(self.buckets) + 1)
+        self._exemplars[index] = make_exemplar(labels, value)
+
+    def observe_many(self, values: Iterable[float]):
+        "Same as observe for each value, takes lists, arrays or numpy arrays"
+        self._add_counts(*bucket_counts(self.buckets, values))
+
+    def _add_counts(self, counts: List[int], vsum: float):
+        bcounts = self._bcounts
+        for index, c in enumerate(counts):
+            bcounts[index] += c
+        self._sum += vsum
+        self._count += sum(counts)
+        self._dirty = True
 
     def sample_group(self, skey: SampleKey):
         bkey = skey.with_suffix('_bucket')
-        for b in self.buckets:
-            yield bkey.with_labels(le=b)
+        for le in _bound_labels(self.buckets):
+            yield bkey.with_labels(le=le)
         yield bkey.with_labels(le='+Inf')
         yield skey.with_suffix('_sum')
         yield skey.with_suffix('_count')
@@ -119,7 +296,137 @@ class Histogram:
     def sample_values(self):
         for v in self._bcounts:
             yield SampleValue(v)
-        yield SampleValue(self._inf_bcount)
+        yield SampleValue(self._sum)
+        yield SampleValue(self._count)
+
+
+# resolutions of native histograms, bucket bounds grow by 2 ** 2 ** -schema
+NATIVE_SCHEMAS = range(-4, 9)
+# fractions of frexp at bucket bounds within a power of two, per schema >= 0
+_NATIVE_BOUNDS = {
+    schema: tuple(2 ** (i / 2 ** schema - 1) for i in range(2 ** schema))
+    for schema in range(9)}
+
+
+def native_bucket_index(value: float, schema: int) -> int:
+    """
+    Index of native histogram bucket holding positive value,
+    bucket i covers (base ** (i - 1), base ** i], base = 2 ** 2 ** -schema
+    """
+    if value - value != 0:
+        raise ValueError('Infinite and NaN values have no bucket')
+    frac, exp = frexp(value)
+    bounds = _NATIVE_BOUNDS[max(schema, 0)]
+    index = bisect_left(bounds, frac) + (exp - 1) * len(bounds)
+    if schema < 0:
+        # buckets of lower resolution are merged by 2 ** -schema
+        index = (index + (1 << -schema) - 1) >> -schema
+    return index
+
+
+@dataclass
+class NativeHistogram:
+    """
+    Sparse exponential histogram, buckets are defined by schema
+    and only non-empty ones are kept. When there are more than max_buckets
+    of them, schema is lowered, halving the resolution.
+    Buckets are exposed in protobuf format only,
+    text formats get count and sum of values.
+    """
+    TYPE = 'histogram'
+    RESERVED_LABELS = frozenset(['le'])
+    CACHEABLE = True
+    # no classic buckets, text formats expose only +Inf one
+    buckets = ()
+
+    schema: int = 3
+    max_buckets: int = 160
+    # values closer to zero go to zero bucket
+    zero_threshold: float = 2 ** -128
+    # bucket index -> count, for positive and negative values
+    _positive: dict = field(init=False, default_factory=dict)
+    _negative: dict = field(init=False, default_factory=dict)
+    _zero_count: int = field(init=False, default=0)
+    _sum: float = field(init=False, default=0)
+    _count: int = field(init=False, default=0)
+    _dirty: bool = field(init=False, default=True)
+    _created: float = field(init=False, default_factory=clock_seconds)
+
+    def __post_init__(self):
+        if self.schema not in NATIVE_SCHEMAS:
+            raise ValueError(
+                f'Schema must be in range {NATIVE_SCHEMAS.start}'
+                f'..{NATIVE_SCHEMAS.stop - 1}')
+        if self.max_buckets < 1:
+            raise ValueError('Bucket limit must be positive')
+        if self.zero_threshold < 0:
+            raise ValueError('Zero threshold must not be negative')
+
+    def observe(self, value: float, exemplar: Dict[str, str] = None):
+        # exemplars are accepted for compatibility with classic
+        # histograms and dropped, native buckets do not keep them
+        self._sum += value
+        self._count += 1
+        self._dirty = True
+        if value - value != 0:
+            # NaN and infinities have no bucket, inf - inf is nan,
+            # they are counted only in count and sum
+            return
+        if value > self.zero_threshold:
+            buckets = self._positive
+        elif value < -self.zero_threshold:
+            buckets = self._negative
+            value = -value
+        else:
+            self._zero_count += 1
+            return
+        index = native_bucket_index(value, self.schema)
+        c = buckets.get(index)
+        if c is not None:
+            buckets[index] = c + 1
+            return
+        buckets[index] = 1
+        if len(self._positive) + len(self._negative) > self.max_buckets:
+            self._reduce_resolution()
+
+    def observe_many(self, values: Iterable[float]):
+        "Same as observe for each value"
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            values = values.tolist()
+        for v in values:
+            self.observe(v)
+
+    def time(self) -> Timer:
+        "Observes duration of with-block or of every decorated call"
+        return Timer(self.observe)
+
+    def _reduce_resolution(self):
+        # every pair of adjacent buckets is merged into one
+        while (
+            len(self._positive) + len(self._negative) > self.max_buckets
+            and self.schema > NATIVE_SCHEMAS.start
+        ):
+            self.schema -= 1
+            for attr in ('_positive', '_negative'):
+                merged = {}
+                for index, c in getattr(self, attr).items():
+                    index = (index + 1) >> 1
+                    merged[index] = merged.get(index, 0) + c
+                setattr(self, attr, merged)
+
+    def buckets_snapshot(self):
+        "schema, zero bucket count, positive and negative bucket counts"
+        return (
+            self.schema, self._zero_count,
+            dict(self._positive), dict(self._negative))
+
+    def sample_group(self, skey: SampleKey):
+        yield skey.with_suffix('_bucket').with_labels(le='+Inf')
+        yield skey.with_suffix('_sum')
+        yield skey.with_suffix('_count')
+
+    def sample_values(self):
+        yield SampleValue(self._count)
         yield SampleValue(self._sum)
         yield SampleValue(self._count)
 
@@ -128,10 +435,26 @@ class Histogram:
 class Summary:
     TYPE = 'summary'
     RESERVED_LABELS = frozenset(['quantile'])
-
+    # output depends on time window, can't be reused
+    CACHEABLE = False
     buckets: Tuple[float]
     time_window: float = 3600
+    # factory of bounded memory quantile estimator, e.g. quantile.ckms()
+    # all samples of time window are kept if not set
+    estimator: Callable = None
+    # split time window into this many sub-windows, each expired as a whole
+    # defaults to 1 for estimators, exact per sample expiration otherwise
+    age_buckets: int = None
     _samples: deque = field(init=False, default_factory=deque)
+    _ages: deque = field(init=False, default=None)
+    _age_length: int = field(init=False, default=None)
+    _age_started: int = field(init=False, default=None)
+    # monotonic time of next sub-window rotation, observe compares
+    # it to cheap monotonic clock instead of computing passed sub-windows
+    _rotate_at: float = field(init=False, default=None)
+    _created: float = field(init=False, default_factory=clock_seconds)
+    # output is never cached, flag only tells group about updates
+    _dirty: bool = field(init=False, default=True)
 
     def __post_init__(self):
         for b in self.buckets:
@@ -139,50 +462,141 @@ class Summary:
                 raise ValueError('Quantiles must be in range 0..1')
         self.buckets = to_sorted_tuple(self.buckets)
 
+        if self.age_buckets is None and self.estimator is not None:
+            self.age_buckets = 1
+        if self.age_buckets is not None:
+            if self.age_buckets < 1:
+                raise ValueError('Age bucket count must be positive')
+            self._ages = deque(
+                self._new_age() for _ in range(self.age_buckets))
+            self._age_length = int(
+                self.time_window * 1000 / self.age_buckets)
+            self._age_started = clock()
+            self._rotate_at = monotonic() + self._age_length / 1000
+
+    def _new_age(self):
+        # estimator in every age receives all values since age start
+        # (like official Go client does), oldest one covers the time window
+        # without estimator every age holds only its own values
+        if self.estimator is None:
+            return array('d')
+        return self.estimator(self.buckets)
+
+    def _rotate(self):
+        now = clock()
+        passed = (now - self._age_started) // self._age_length
+        if passed > 0:
+            self._age_started += passed * self._age_length
+            for _ in range(min(passed, self.age_buckets)):
+                self._ages.popleft()
+                self._ages.append(self._new_age())
+        self._rotate_at = monotonic() + (
+            self._age_started + self._age_length - now) / 1000
+
     def _clean_old_samples(self):
         before = clock() - int(self.time_window * 1000)
         while self._samples and self._samples[0].timestamp <= before:
             self._samples.popleft()
 
     def observe(self, value: float):
-        self._samples.append(SampleValue.create(value, clock()))
-        self._clean_old_samples()
+        self._dirty = True
+        if self._ages is None:
+            self._samples.append(SampleValue.create(value, clock()))
+            self._clean_old_samples()
+            return
+
+        if monotonic() >= self._rotate_at:
+            self._rotate()
+        if self.estimator is None:
+            self._ages[-1].append(value)
+        else:
+            for sketch in self._ages:
+                sketch.insert(value)
+
+    def observe_many(self, values: Iterable[float]):
+        "Same as observe for each value, takes lists, arrays or numpy arrays"
+        self._dirty = True
+        if self._ages is None:
+            ts = clock()
+            self._samples.extend(SampleValue(v, ts) for v in values)
+            self._clean_old_samples()
+            return
+
+        self._rotate()
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            values = values.tolist()
+        if self.estimator is None:
+            self._ages[-1].extend(values)
+        else:
+            values = list(values)
+            for sketch in self._ages:
+                sketch.insert_many(values)
+
+    def time(self) -> Timer:
+        "Observes duration of with-block or of every decorated call"
+        return Timer(self.observe)
 
     def sample_group(self, skey: SampleKey):
-        for b in self.buckets:
-            yield skey.with_labels(quantile=b)
+        for q in _bound_labels(self.buckets):
+            yield skey.with_labels(quantile=q)
         yield skey.with_suffix('_sum')
         yield skey.with_suffix('_count')
 
-    def sample_values(self):
-        self._clean_old_samples()
-        if not self._samples:
-            return
-
+    def _exact_quantiles(self, values):
+        # values must be sorted
         quantiles = []
-        ss = list(sorted(self._samples, key=lambda s: s.value))
-        n = len(ss)
-        ss.append(ss[-1])
+        n = len(values)
+        values.append(values[-1])
 
         for qp in self.buckets:
             k = (n - 1) * qp
             f, c = floor(k), ceil(k)
             if f == c:
-                qval = ss[f].value
+                qval = values[f]
             else:
                 qval = (
-                    ss[f].value * (c - k)
+                    values[f] * (c - k)
                     +
-                    ss[c].value * (k - f)
+                    values[c] * (k - f)
                 )
             quantiles.append(qval)
+        return quantiles
 
-        for v in quantiles:
+    def sample_values(self):
+        if self._ages is None:
+            self._clean_old_samples()
+            values = [s.value for s in self._samples]
+        else:
+            self._rotate()
+            if self.estimator is not None:
+                sketch = self._ages[0]
+                if not sketch.count:
+                    return
+                for qp in self.buckets:
+                    yield SampleValue(sketch.query(qp))
+                yield SampleValue(sketch.sum)
+                yield SampleValue(sketch.count)
+                return
+            values = list(chain.from_iterable(self._ages))
+
+        if not values:
+            return
+        values.sort()
+        n = len(values)
+        total = sum(values)
+        for v in self._exact_quantiles(values):
             yield SampleValue(v)
-        yield SampleValue(sum(s.value for s in ss[:n]))
+        yield SampleValue(total)
         yield SampleValue(n)
 
 
+_render_versions = count()
+
+OVERFLOW_POLICIES = ('drop', 'fold')
+# label value of child collecting updates above series limit
+OVERFLOW_LABEL_VALUE = '__overflow__'
+
+
 @dataclass
 class Group:
     key: SampleKey
@@ -190,31 +604,362 @@ class Group:
     args: tuple = ()
     kwargs: dict = field(default_factory=dict)
     help: str = None
+    # at most this many children, updates of further label sets
+    # are either dropped or folded into a child with all label values
+    # set to OVERFLOW_LABEL_VALUE
+    max_series: int = None
+    overflow: str = 'drop'
+    # children not updated for this many seconds are removed on exposition
+    ttl: float = None
+    # label names of all children, declared up front;
+    # children are then looked up by values in this order, see labels
+    labelnames: Tuple[str, ...] = None
 
     _items: dict = field(init=False, default_factory=dict)
-    _rendered_keys: dict = field(init=False, default_factory=dict)
+    # rendered sample keys are derived from label set of child,
+    # sample names and extra labels (le, quantile) are shared by children:
+    # (keys for empty label set, (head, tail) around label set)
+    _templates: tuple = field(init=False, default=None, repr=False)
+    # raw label names and stringified values -> child,
+    # lets repeated lookups skip SampleKey construction
+    _fast_items: dict = field(init=False, default_factory=dict)
+    # rendered text of every child and of the whole group
+    _render_cache: dict = field(init=False, default_factory=dict)
+    _rendered_text: str = field(init=False, default=None)
+    # changes whenever rendered text of any child changes,
+    # unique across all groups
+    _render_version: int = field(
+        init=False, default_factory=lambda: next(_render_versions))
+    # taken only when creating children, lookups of existing are lock-free
+    _lock: Lock = field(
+        init=False, default_factory=Lock, repr=False, compare=False)
+    # monotonic time of latest update of every child, if ttl is set
+    _updated: dict = field(init=False, default_factory=dict, repr=False)
+    # detached child receiving updates dropped by series limit
+    _dropped: object = field(init=False, default=None, repr=False)
+    # stringified label values -> child, if labelnames are declared
+    _positional: dict = field(init=False, default_factory=dict, repr=False)
+    # (head, 'name="' fragments) of rendered keys of children
+    _key_parts: tuple = field(init=False, default=None, repr=False)
+
+    def __post_init__(self):
+        if self.max_series is not None and self.max_series < 1:
+            raise ValueError('Series limit must be positive')
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f'Overflow policy must be one of {OVERFLOW_POLICIES}')
+        if self.ttl is not None and self.ttl <= 0:
+            raise ValueError('TTL must be positive')
+        if self.labelnames is not None:
+            self._compile_labelnames()
+
+    def _compile_labelnames(self):
+        names = tuple(map(intern, self.labelnames))
+        if len(set(names)) != len(names):
+            raise ValueError('Label names must be unique')
+        self._check_reserved(names)
+        if not set(names).isdisjoint(self.key._items[::2]):
+            raise ValueError('Label names must differ from constant ones')
+        # validates names once, children skip it
+        SampleKey(self.key.name, dict.fromkeys(names, ''))
+        self.labelnames = names
+        # constant labels come first, same as in keys of with_labels
+        line = self.key.expose()
+        head = f'{line[:-1]},' if self.key._items else f'{line}{{'
+        self._key_parts = head, tuple(f'{name}="' for name in names)
+
+    def _check_reserved(self, names):
+        reserved = self.mcls.RESERVED_LABELS.intersection(names)
+        if reserved:
+            raise ValueError(
+                f'Label names {sorted(reserved)} are reserved '
+                f'by {self.mcls.TYPE}')
+
+    def _compiled_key(self, values: tuple) -> SampleKey:
+        "Key of child with given stringified values of labelnames"
+        values = tuple(map(intern, values))
+        items = list(self.key._items)
+        for name, value in zip(self.labelnames, values):
+            items.append(name)
+            items.append(value)
+        head, parts = self._key_parts
+        line = self.key.expose()
+        if parts:
+            line = head + ','.join(
+                f'{part}{SampleKey.expose_label_value(value)}"'
+                for part, value in zip(parts, values)) + '}'
+        return SampleKey._compiled(self.key.name, tuple(items), line)
+
+    def labels(self, *values):
+        """
+        Child by label values in order of declared labelnames,
+        same as with_labels, but without handling label names
+        """
+        values = tuple(map(str, values))
+        m = self._positional.get(values)
+        if m is not None:
+            return m
+        if self.labelnames is None:
+            raise ValueError('Label names of group are not declared')
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                f'Expected values of labels {self.labelnames}')
+        fk = (*self.labelnames, *values)
+        m = self._fast_items.get(fk)
+        if m is None:
+            m = self._child(
+                self._compiled_key(values), fk,
+                dict(zip(self.labelnames, values)))
+            if self._fast_items.get(fk) is not m:
+                # overflowing children aren't remembered
+                return m
+        self._positional[tuple(map(intern, values))] = m
+        return m
 
     def with_labels(self, **labels):
-        k = self.key.with_labels(**labels)
-        if k in self._items:
-            return self._items[k]
-        # TODO: RESERVED_LABELS
-        m = self.mcls(*self.args, **self.kwargs)
+        fk = (*labels, *map(str, labels.values()))
+        m = self._fast_items.get(fk)
+        if m is not None:
+            return m
+
+        if self.labelnames is None:
+            self._check_reserved(labels)
+            k = self.key.with_labels(**labels)
+        elif labels.keys() == set(self.labelnames):
+            k = self._compiled_key(tuple(
+                str(labels[name]) for name in self.labelnames))
+        else:
+            raise ValueError(f'Expected labels {self.labelnames}')
+        return self._child(k, fk, labels)
+
+    def _child(self, k, fk, labels):
+        "Existing or new child, fk is remembered for fast lookups"
+        with self._lock:
+            m = self._items.get(k)
+            if m is None:
+                if (
+                    self.max_series is not None
+                    and len(self._items) >= self.max_series
+                ):
+                    # not remembered in fast lookups,
+                    # those would grow without limit otherwise
+                    return self._overflow_item(labels)
+                m = self._add_item(k)
+            # same child may be reachable by differently ordered labels
+            self._fast_items[tuple(map(intern, fk))] = m
+        return m
+
+    def _add_item(self, k):
+        m = self._create_item(k)
+        if self._templates is None:
+            self._templates = self._make_templates(m)
         self._items[k] = m
-        self._rendered_keys[k] = tuple(rk.expose() for rk in m.sample_group(k))
+        if self.ttl is not None:
+            # creation is counted as update, child has no text to reuse yet
+            m._dirty = False
+            self._updated[k] = monotonic()
+        self._rendered_text = None
+        self._render_version = next(_render_versions)
         return m
 
+    def _overflow_item(self, labels):
+        if self.overflow == 'fold':
+            k = self.key.with_labels(
+                **{name: OVERFLOW_LABEL_VALUE for name in labels})
+            m = self._items.get(k)
+            # overflow child is allowed above the limit
+            return m if m is not None else self._add_item(k)
+        if self._dropped is None:
+            self._dropped = self._create_item(self.key)
+        return self._dropped
+
+    def _create_item(self, k):
+        return self.mcls(*self.args, **self.kwargs)
+
+    def remove(self, **labels):
+        "Removes child with given labels, if it exists"
+        k = self.key.with_labels(**labels)
+        with self._lock:
+            if k in self._items:
+                self._remove_items((k, ))
+
+    def clear(self):
+        "Removes all children"
+        with self._lock:
+            self._remove_items(tuple(self._items))
+
+    def _remove_items(self, keys):
+        # handles of removed children still work, but aren't exposed
+        removed = set()
+        for k in keys:
+            removed.add(id(self._items.pop(k)))
+            self._render_cache.pop(k, None)
+            self._updated.pop(k, None)
+        # replaced at once, lock-free lookups never see it half-updated
+        self._fast_items = {
+            fk: m for fk, m in self._fast_items.items()
+            if id(m) not in removed}
+        self._positional = {
+            values: m for values, m in self._positional.items()
+            if id(m) not in removed}
+        self._rendered_text = None
+        self._render_version = next(_render_versions)
+
+    def _expire(self):
+        "Removes children not updated for ttl seconds"
+        now = monotonic()
+        updated = self._updated
+        stale = []
+        changed = False
+        for k, m in tuple(self._items.items()):
+            if m._dirty:
+                # flag is consumed here, so rendered text
+                # of the child is dropped to be rendered again
+                m._dirty = False
+                self._render_cache.pop(k, None)
+                updated[k] = now
+                changed = True
+            elif now - updated.get(k, now) >= self.ttl:
+                stale.append(k)
+        if changed:
+            # render_state can't see consumed flags anymore
+            self._rendered_text = None
+            self._render_version = next(_render_versions)
+        if stale:
+            with self._lock:
+                self._remove_items([
+                    k for k in stale
+                    if k in self._items and not self._items[k]._dirty])
+
+    def items(self):
+        "Snapshot of (SampleKey, child) pairs"
+        if self.ttl is not None:
+            self._expire()
+        return tuple(self._items.items())
+
+    def inc_many(self, deltas):
+        """
+        Increments many children at once.
+        deltas is mapping or iterable of pairs of label tuple and delta,
+        e.g. {(('url', '/'), ('code', 200)): 3}
+        """
+        if isinstance(deltas, dict):
+            deltas = deltas.items()
+        for labels, delta in deltas:
+            self.with_labels(**dict(labels)).inc(delta)
+
+    def help_text(self) -> str:
+        """
+        Help without leading metric name, which text format
+        expects in help, for formats giving name on their own
+        """
+        name, sep, text = (self.help or '').partition(' ')
+        if self.help is not None and name == self.key.name:
+            return text
+        return self.help
+
     def expose_header(self):
         if self.help is not None:
             yield f'# HELP {self.help}'
         yield f'# TYPE {self.key.name} {self.mcls.TYPE}'
 
+    def _make_templates(self, m):
+        bare = []
+        parts = []
+        for rk in m.sample_group(SampleKey(self.key.name)):
+            line = rk.expose()
+            extra = line[len(rk.name) + 1:-1]
+            bare.append(line)
+            parts.append((f'{rk.name}{{', f',{extra}}}' if extra else '}'))
+        return tuple(bare), tuple(parts)
+
+    def _expose_item(self, k, m):
+        # label set without braces
+        lset = k.expose()[len(self.key.name) + 1:-1]
+        bare, parts = self._templates
+        # finite values without timestamps are formatted in place,
+        # inf - inf and nan - nan are nan
+        if not lset:
+            for rk, v in zip(bare, m.sample_values()):
+                value = v.value
+                if v.timestamp is None and value - value == 0:
+                    yield f'{rk} {value}'
+                else:
+                    yield f'{rk} {v.expose()}'
+            return
+        for (head, tail), v in zip(parts, m.sample_values()):
+            value = v.value
+            if v.timestamp is None and value - value == 0:
+                yield f'{head}{lset}{tail} {value}'
+            else:
+                yield f'{head}{lset}{tail} {v.expose()}'
+
     def expose(self):
         he = False
-        for k, m in self._items.items():
-            for rk, v in zip(self._rendered_keys[k], m.sample_values()):
+        # snapshot, children may be added by other threads meanwhile
+        for k, m in self.items():
+            for line in self._expose_item(k, m):
                 # expose header only if we have samples
                 if not he:
                     yield from self.expose_header()
                     he = True
-                yield f'{rk} {v.expose()}'
+                yield line
+
+    def _render_item(self, k, m, cacheable):
+        text = self._render_cache.get(k)
+        if text is None or not cacheable or m._dirty:
+            if cacheable:
+                m._dirty = False
+            text = self._render_cache[k] = ''.join(
+                line + '\n' for line in self._expose_item(k, m))
+            # text of the whole group is outdated
+            self._rendered_text = None
+            self._render_version = next(_render_versions)
+        return text
+
+    def render_state(self):
+        """
+        Stays the same while rendered text of the group doesn't change,
+        None if it may change on next render.
+        """
+        if not self.mcls.CACHEABLE:
+            return None
+        for m in tuple(self._items.values()):
+            if m._dirty:
+                return None
+        if self.ttl is not None:
+            # expired children are removed only by next render
+            now = monotonic()
+            updated = self._updated
+            for k in tuple(self._items):
+                if now - updated.get(k, now) >= self.ttl:
+                    return None
+        return self._render_version
+
+    def render_header(self) -> str:
+        return ''.join(line + '\n' for line in self.expose_header())
+
+    def render(self) -> str:
+        """
+        Same lines as expose() gives, each ending with newline.
+        Only children changed since previous call are rendered again.
+        """
+        cacheable = self.mcls.CACHEABLE
+        texts = [
+            self._render_item(k, m, cacheable) for k, m in self.items()]
+        if self._rendered_text is None:
+            body = ''.join(texts)
+            self._rendered_text = self.render_header() + body if body else ''
+        return self._rendered_text
+
+    def render_chunks(self):
+        "Same text as render() gives, yielded piece by piece"
+        cacheable = self.mcls.CACHEABLE
+        he = False
+        for k, m in self.items():
+            text = self._render_item(k, m, cacheable)
+            if text:
+                if not he:
+                    yield self.render_header()
+                    he = True
+                yield text
@@ -0,0 +1,363 @@
+import mmap
+import os
+import weakref
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from glob import glob
+from struct import Struct
+from typing import Dict, List
+
+from . import metrics
+from .sample import SampleKey, SampleValue
+
+# Aggregation of metrics across worker processes (gunicorn, uvicorn etc).
+# Every process writes its values into its own memory mapped file
+# inside a directory shared by all workers, updates don't involve any IPC.
+# Exposition in any of processes reads and merges all files.
+#
+# File name is "<kind>_<pid>.db", layout:
+#   uint32 used bytes, uint32 padding,
+#   entries of: uint32 key length, utf-8 key padded to 8 bytes, float64 value.
+# Key is metric family name and rendered sample line separated by NUL.
+
+__all__ = (
+    'GAUGE_MODES', 'MmapedValues', 'MultiprocessGroup',
+    'collect', 'combine', 'expose', 'mark_process_dead',
+)
+
+# how gauge values of different processes are combined
+# live: sum of values of running processes only
+GAUGE_MODES = ('sum', 'max', 'min', 'live')
+
+_HEADER = Struct('<II')
+_KEY_LEN = Struct('<I')
+_VALUE = Struct('<d')
+
+
+def _padded(n):
+    return n + (-n % 8)
+
+
+class MmapedValues:
+    INITIAL_SIZE = 1 << 16
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, 'a+b')
+        size = os.fstat(self._f.fileno()).st_size
+        if size == 0:
+            size = self.INITIAL_SIZE
+            self._f.truncate(size)
+        self._m = mmap.mmap(self._f.fileno(), size)
+        # key -> offset of its value
+        self._positions = {}
+        self._used = _HEADER.unpack_from(self._m, 0)[0]
+        if self._used == 0:
+            self._used = _HEADER.size
+            _HEADER.pack_into(self._m, 0, self._used, 0)
+        # file may be left by dead process with the same pid
+        for key, offset in self._read_entries(self._m, self._used):
+            self._positions[key] = offset
+
+    @staticmethod
+    def _read_entries(data, used):
+        pos = _HEADER.size
+        while pos < used:
+            (klen, ) = _KEY_LEN.unpack_from(data, pos)
+            kstart = pos + _KEY_LEN.size
+            key = bytes(data[kstart:kstart + klen]).decode('utf-8')
+            offset = _padded(kstart + klen)
+            yield key, offset
+            pos = offset + _VALUE.size
+
+    @classmethod
+    def read_file(cls, path: str):
+        "Yields (key, value) pairs, file may be written meanwhile"
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            return
+        used = _HEADER.unpack_from(data, 0)[0]
+        for key, offset in cls._read_entries(data, used):
+            yield key, _VALUE.unpack_from(data, offset)[0]
+
+    def allocate(self, key: str) -> int:
+        "Offset of value for the key, creating zero value if absent"
+        offset = self._positions.get(key)
+        if offset is not None:
+            return offset
+
+        encoded = key.encode('utf-8')
+        kstart = self._used + _KEY_LEN.size
+        offset = _padded(kstart + len(encoded))
+        end = offset + _VALUE.size
+        if end > len(self._m):
+            self._grow(end)
+        m = self._m
+        _KEY_LEN.pack_into(m, self._used, len(encoded))
+        m[kstart:kstart + len(encoded)] = encoded
+        _VALUE.pack_into(m, offset, 0.0)
+        # publish entry only after it's completely written
+        self._used = end
+        _HEADER.pack_into(m, 0, end, 0)
+        self._positions[key] = offset
+        return offset
+
+    def _grow(self, required):
+        size = len(self._m)
+        while size < required:
+            size *= 2
+        self._m.close()
+        self._f.truncate(size)
+        self._m = mmap.mmap(self._f.fileno(), size)
+
+    def read(self, offset: int) -> float:
+        return _VALUE.unpack_from(self._m, offset)[0]
+
+    def write(self, offset: int, value: float):
+        _VALUE.pack_into(self._m, offset, value)
+
+    def add(self, offset: int, delta: float):
+        m = self._m
+        _VALUE.pack_into(m, offset, _VALUE.unpack_from(m, offset)[0] + delta)
+
+    def close(self):
+        self._m.close()
+        self._f.close()
+
+
+# (directory, kind) -> values file of current process
+_files: Dict[tuple, MmapedValues] = {}
+# id -> group, to rebind children after fork
+_groups = weakref.WeakValueDictionary()
+
+
+def _values_file(path, kind):
+    f = _files.get((path, kind))
+    if f is None:
+        f = _files[path, kind] = MmapedValues(
+            os.path.join(path, f'{kind}_{os.getpid()}.db'))
+    return f
+
+
+def _after_fork():
+    # forked process must not write into files of its parent
+    _files.clear()
+    for group in list(_groups.values()):
+        group._rebind()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+@dataclass
+class MultiprocessCounter(metrics.Counter):
+    KIND = 'counter'
+
+    _values: MmapedValues = field(init=False, default=None, repr=False)
+    _offset: int = field(init=False, default=None)
+
+    def _bind(self, values: MmapedValues, keys: List[str]):
+        (key, ) = keys
+        self._values = values
+        self._offset = values.allocate(key)
+
+    def inc(self, delta: float = 1, exemplar: Dict[str, str] = None):
+        # exemplars are accepted and dropped, mmaped files have no room
+        # for them and formats carrying them are not served here
+        assert delta >= 0
+        self._values.add(self._offset, delta)
+        self._dirty = True
+
+    def sample_values(self):
+        yield SampleValue(self._values.read(self._offset))
+
+
+@dataclass
+class MultiprocessGauge(metrics.Gauge):
+    multiprocess_mode: str = 'sum'
+    _values: MmapedValues = field(init=False, default=None, repr=False)
+    _offset: int = field(init=False, default=None)
+
+    def __post_init__(self):
+        if self.multiprocess_mode not in GAUGE_MODES:
+            raise ValueError(f'Gauge mode must be one of {GAUGE_MODES}')
+        super().__post_init__()
+
+    @property
+    def KIND(self):
+        return f'gauge_{self.multiprocess_mode}'
+
+    def _bind(self, values: MmapedValues, keys: List[str]):
+        (key, ) = keys
+        self._values = values
+        self._offset = values.allocate(key)
+
+    def inc(self, delta: float = 1):
+        self._values.add(self._offset, delta)
+        self._dirty = True
+
+    def dec(self, delta: float = 1):
+        self._values.add(self._offset, -delta)
+        self._dirty = True
+
+    def set(self, value: float):
+        self._values.write(self._offset, value)
+        self._dirty = True
+
+    def set_with_timestamp(self, value: float, ts: int):
+        raise TypeError(
+            'Gauges in multiprocess mode have no timestamps, use set')
+
+    def sample_values(self):
+        yield SampleValue(self._values.read(self._offset))
+
+
+@dataclass
+class MultiprocessHistogram(metrics.Histogram):
+    KIND = 'histogram'
+
+    _values: MmapedValues = field(init=False, default=None, repr=False)
+    # buckets including +Inf, then sum and count
+    _offsets: List[int] = field(init=False, default=None)
+
+    def _bind(self, values: MmapedValues, keys: List[str]):
+        self._values = values
+        self._offsets = [values.allocate(k) for k in keys]
+
+    def observe(self, value: float, exemplar: Dict[str, str] = None):
+        # exemplars are dropped, see MultiprocessCounter.inc
+        values, offsets = self._values, self._offsets
+        values.add(offsets[bisect_left(self.buckets, value)], 1)
+        values.add(offsets[-2], value)
+        values.add(offsets[-1], 1)
+        self._dirty = True
+
+    def _add_counts(self, counts, vsum):
+        values, offsets = self._values, self._offsets
+        for offset, c in zip(offsets, counts):
+            if c:
+                values.add(offset, c)
+        values.add(offsets[-2], vsum)
+        values.add(offsets[-1], sum(counts))
+        self._dirty = True
+
+    def sample_values(self):
+        for offset in self._offsets:
+            yield SampleValue(self._values.read(offset))
+
+
+# plain metric class -> its multiprocess variant
+MULTIPROCESS_CLASSES = {
+    metrics.Counter: MultiprocessCounter,
+    metrics.Gauge: MultiprocessGauge,
+    metrics.Histogram: MultiprocessHistogram,
+}
+
+
+@dataclass
+class MultiprocessGroup(metrics.Group):
+    path: str = None
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.ttl is not None:
+            raise ValueError(
+                'TTL is not supported in multiprocess mode, '
+                'children can not be removed')
+        _groups[id(self)] = self
+
+    def _item_keys(self, k, m):
+        return [
+            f'{self.key.name}\0{rk.expose()}' for rk in m.sample_group(k)]
+
+    def _create_item(self, k):
+        m = super()._create_item(k)
+        m._bind(_values_file(self.path, m.KIND), self._item_keys(k, m))
+        return m
+
+    def _remove_items(self, keys):
+        # values stay in files of processes anyway
+        raise ValueError(
+            'Children can not be removed in multiprocess mode, '
+            'their values stay in files of all processes')
+
+    def _rebind(self):
+        with self._lock:
+            for k, m in self._items.items():
+                m._bind(
+                    _values_file(self.path, m.KIND), self._item_keys(k, m))
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def combine(mode: str, prev: float, value: float) -> float:
+    "Value of a sample given by two processes, mode is one of GAUGE_MODES"
+    if mode == 'max':
+        return max(prev, value)
+    if mode == 'min':
+        return min(prev, value)
+    return prev + value
+
+
+def collect(path: str):
+    """
+    Merged values of all processes:
+    {metric family name: (type, {sample line: value})}
+    """
+    result = {}
+    for fpath in sorted(glob(os.path.join(path, '*.db'))):
+        kind, _, pid = os.path.basename(fpath)[:-3].rpartition('_')
+        mtype, _, mode = kind.partition('_')
+        if mode == 'live' and not _is_alive(int(pid)):
+            continue
+        for key, value in MmapedValues.read_file(fpath):
+            name, _, line = key.partition('\0')
+            _, samples = result.setdefault(name, (mtype, {}))
+            prev = samples.get(line)
+            samples[line] = (
+                value if prev is None else combine(mode, prev, value))
+    return result
+
+
+def expose(path: str, helps: Dict[str, str] = None):
+    """
+    Exposition lines of all processes, in the same shape as Registry gives.
+    helps is metric family name -> help text, families are exposed
+    in its order, families unknown to current process go last.
+    """
+    helps = helps or {}
+    order = {name: i for i, name in enumerate(helps)}
+    families = sorted(
+        collect(path).items(),
+        key=lambda item: order.get(item[0], len(order)))
+    for name, (mtype, samples) in families:
+        if helps.get(name) is not None:
+            yield f'# HELP {helps[name]}'
+        yield f'# TYPE {name} {mtype}'
+        for line, value in samples.items():
+            yield f'{line} {SampleValue.expose_value(value)}'
+        yield ''
+
+
+def mark_process_dead(path: str, pid: int):
+    "Removes values of live gauges of finished process"
+    for fpath in glob(os.path.join(path, f'gauge_live_{pid}.db')):
+        os.remove(fpath)
+
+
+def create_group(path: str, key: SampleKey, mcls: type, **kwargs):
+    if mcls not in MULTIPROCESS_CLASSES:
+        raise ValueError(
+            f'{mcls.__name__} is not supported in multiprocess mode')
+    return MultiprocessGroup(
+        key=key, mcls=MULTIPROCESS_CLASSES[mcls], path=path, **kwargs)
@@ -0,0 +1,150 @@
+import math
+from functools import lru_cache
+
+from .sample import SampleKey
+
+# OpenMetrics 1.0 text format.
+# Unlike Prometheus text format it has counter families named without
+# _total suffix, _created samples, exemplars, cumulative histogram buckets,
+# timestamps in seconds and "# EOF" line in the end.
+
+__all__ = ('CONTENT_TYPE', 'format_value', 'render_chunks', 'render_group')
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def format_value(value) -> str:
+    if type(value) is float and value - value == 0:
+        # finite, inf - inf and nan - nan are nan
+        return str(value)
+    if isinstance(value, int):
+        return str(value)
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _head(lset: str) -> str:
+    "Label set of child opened for one more label"
+    return f'{lset[:-1]},' if lset else '{'
+
+
+@lru_cache(maxsize=None)
+def _bound_parts(name: str, bounds: tuple) -> tuple:
+    "Label fragments closing label sets, same for all children of group"
+    return tuple(f'{name}="{format_value(float(b))}"}}' for b in bounds)
+
+
+def _group_parts(mtype: str, m) -> tuple:
+    if mtype == 'histogram':
+        return _bound_parts('le', (*m.buckets, math.inf))
+    if mtype == 'summary':
+        return _bound_parts('quantile', m.buckets)
+    return ()
+
+
+def _suffix(timestamp=None, exemplar=None) -> str:
+    suffix = ''
+    if timestamp is not None:
+        # milliseconds to seconds
+        suffix = f' {format_value(timestamp / 1000)}'
+    if exemplar is not None:
+        labels, value, ts = exemplar
+        lset = SampleKey.expose_label_set(labels) or '{}'
+        suffix += f' # {lset} {format_value(value)} {format_value(ts)}'
+    return suffix
+
+
+def _created(family, lset, m):
+    created = getattr(m, '_created', None)
+    if created is not None:
+        yield f'{family}_created{lset} {format_value(created)}'
+
+
+def _counter_lines(family, lset, m, values, parts):
+    (v, ) = values
+    yield (
+        f'{family}_total{lset} {format_value(v.value)}'
+        + _suffix(v.timestamp, getattr(m, '_exemplar', None)))
+    yield from _created(family, lset, m)
+
+
+def _gauge_lines(family, lset, m, values, parts):
+    (v, ) = values
+    yield f'{family}{lset} {format_value(v.value)}' + _suffix(v.timestamp)
+
+
+def _histogram_lines(family, lset, m, values, parts):
+    exemplars = getattr(m, '_exemplars', None) or ()
+    head = f'{family}_bucket{_head(lset)}'
+    cumulative = 0
+    for index, le in enumerate(parts):
+        cumulative += values[index].value
+        exemplar = exemplars[index] if exemplars else None
+        yield (
+            f'{head}{le} {format_value(cumulative)}'
+            + _suffix(exemplar=exemplar))
+    yield f'{family}_count{lset} {format_value(values[-1].value)}'
+    yield f'{family}_sum{lset} {format_value(values[-2].value)}'
+    yield from _created(family, lset, m)
+
+
+def _summary_lines(family, lset, m, values, parts):
+    head = f'{family}{_head(lset)}'
+    for quantile, v in zip(parts, values):
+        yield f'{head}{quantile} {format_value(v.value)}'
+    yield f'{family}_count{lset} {format_value(values[-1].value)}'
+    yield f'{family}_sum{lset} {format_value(values[-2].value)}'
+    yield from _created(family, lset, m)
+
+
+_LINES = {
+    'counter': _counter_lines,
+    'gauge': _gauge_lines,
+    'histogram': _histogram_lines,
+    'summary': _summary_lines,
+}
+
+
+def render_group(group) -> str:
+    "OpenMetrics text of a metric group, empty if it has no samples"
+    mtype = group.mcls.TYPE
+    name = group.key.name
+    family = name
+    if mtype == 'counter' and name.endswith('_total'):
+        family = name[:-len('_total')]
+    render_lines = _LINES[mtype]
+    lines = []
+    # le or quantile fragments, formatted once for all children
+    parts = None
+    for k, m in group.items():
+        values = list(m.sample_values())
+        if values:
+            if parts is None:
+                parts = _group_parts(mtype, m)
+            # label set of child, without metric name
+            lset = k.expose()[len(name):]
+            lines.extend(render_lines(family, lset, m, values, parts))
+    if not lines:
+        return ''
+    header = ''
+    if group.help is not None:
+        help = SampleKey.expose_label_value(group.help_text())
+        header = f'# HELP {family} {help}\n'
+    header += f'# TYPE {family} {mtype}\n'
+    return header + ''.join(line + '\n' for line in lines)
+
+
+def render_chunks(registry):
+    "OpenMetrics text of registry, yielded group by group"
+    if registry.multiprocess_dir is not None:
+        raise ValueError('OpenMetrics is not supported in multiprocess mode')
+    for group in registry.groups():
+        text = render_group(group)
+        if text:
+            yield text
+    yield '# EOF\n'
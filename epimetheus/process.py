@@ -0,0 +1,149 @@
+import asyncio
+import gc
+import os
+from time import perf_counter
+
+from . import collector, metrics
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Process and interpreter metrics, opt-in:
+#
+#   registry.register_collector(ProcessCollector())
+#
+# Process metrics are read from procfs, so they're available on Linux only,
+# /proc/self/stat is read once per collection.
+
+__all__ = ('ProcessCollector', )
+
+PROC = '/proc'
+# garbage collection pauses, seconds
+GC_BUCKETS = metrics.exponential_buckets(0.0001, 4, 8)
+
+
+def _boot_time(proc):
+    with open(os.path.join(proc, 'stat'), 'rb') as f:
+        for line in f:
+            if line.startswith(b'btime '):
+                return float(line.split()[1])
+    return None
+
+
+class ProcessCollector:
+    """
+    Gives process_* metrics of official prometheus clients:
+    CPU time, memory, open and max file descriptors, start time,
+    python_gc_* metrics with pauses measured by gc.callbacks
+    and asyncio event loop lag if monitor_loop was called.
+    """
+
+    def __init__(self, proc: str = PROC):
+        self._proc = proc
+        self._stat_path = os.path.join(proc, 'self', 'stat')
+        self._fd_path = os.path.join(proc, 'self', 'fd')
+        self._procfs = os.path.exists(self._stat_path)
+        if self._procfs:
+            self._ticks = os.sysconf('SC_CLK_TCK')
+            self._page_size = os.sysconf('SC_PAGE_SIZE')
+            self._boot_time = _boot_time(proc)
+
+        self._gc_started = None
+        self._gc_pauses = tuple(
+            metrics.Histogram(buckets=GC_BUCKETS)
+            for _ in range(len(gc.get_stats())))
+        gc.callbacks.append(self._gc_callback)
+
+        self._loop_lag = None
+        self._loop_handle = None
+
+    def close(self):
+        "Stops measuring garbage collection and event loop lag"
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+        if self._loop_handle is not None:
+            self._loop_handle.cancel()
+            self._loop_handle = None
+
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self._gc_started = perf_counter()
+        elif self._gc_started is not None:
+            self._gc_pauses[info['generation']].observe(
+                perf_counter() - self._gc_started)
+            self._gc_started = None
+
+    def monitor_loop(
+        self,
+        loop: asyncio.AbstractEventLoop = None,
+        interval: float = 0.5,
+    ):
+        "Measures how late event loop runs callback scheduled every interval"
+        loop = loop or asyncio.get_running_loop()
+
+        def check(expected):
+            now = loop.time()
+            self._loop_lag = max(0.0, now - expected)
+            self._loop_handle = loop.call_at(
+                now + interval, check, now + interval)
+
+        check(loop.time())
+
+    def _process_families(self):
+        with open(self._stat_path, 'rb') as f:
+            stat = f.read()
+        # process name in parentheses may contain spaces
+        fields = stat[stat.rindex(b')') + 2:].split()
+        # fields are numbered from 3 in proc(5)
+        utime, stime = int(fields[11]), int(fields[12])
+        starttime, vsize, rss = (
+            int(fields[19]), int(fields[20]), int(fields[21]))
+
+        cpu = collector.counter_family('process_cpu_seconds_total')
+        cpu.add((utime + stime) / self._ticks)
+        yield cpu
+        vmem = collector.gauge_family('process_virtual_memory_bytes')
+        vmem.add(vsize)
+        yield vmem
+        rmem = collector.gauge_family('process_resident_memory_bytes')
+        rmem.add(rss * self._page_size)
+        yield rmem
+        if self._boot_time is not None:
+            start = collector.gauge_family('process_start_time_seconds')
+            start.add(self._boot_time + starttime / self._ticks)
+            yield start
+        fds = collector.gauge_family('process_open_fds')
+        fds.add(len(os.listdir(self._fd_path)))
+        yield fds
+        if resource is not None:
+            max_fds = collector.gauge_family('process_max_fds')
+            max_fds.add(resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+            yield max_fds
+
+    def _gc_families(self):
+        collections = collector.counter_family(
+            'python_gc_collections_total')
+        collected = collector.counter_family(
+            'python_gc_objects_collected_total')
+        uncollectable = collector.counter_family(
+            'python_gc_objects_uncollectable_total')
+        pauses = collector.histogram_family('python_gc_duration_seconds')
+        for generation, stats in enumerate(gc.get_stats()):
+            collections.add(stats['collections'], generation=generation)
+            collected.add(stats['collected'], generation=generation)
+            uncollectable.add(stats['uncollectable'], generation=generation)
+            pauses.add(self._gc_pauses[generation], generation=generation)
+        return collections, collected, uncollectable, pauses
+
+    def __call__(self):
+        families = []
+        if self._procfs:
+            families.extend(self._process_families())
+        families.extend(self._gc_families())
+        if self._loop_lag is not None:
+            lag = collector.gauge_family('python_asyncio_loop_lag_seconds')
+            lag.add(self._loop_lag)
+            families.append(lag)
+        return families
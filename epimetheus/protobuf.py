@@ -0,0 +1,213 @@
+from math import floor
+from struct import Struct
+from typing import Dict
+
+from .metrics import NativeHistogram
+# Prometheus protobuf exposition format: io.prometheus.client.MetricFamily
+# messages, each prefixed by varint of its length.
+# Only a handful of messages is needed, so they are encoded by hand
+# without protobuf runtime. Values are written as binary doubles,
+# no number formatting happens at all.
+
+__all__ = ('CONTENT_TYPE', 'encode_chunks', 'encode_group')
+
+CONTENT_TYPE = (
+    'application/vnd.google.protobuf; '
+    'proto=io.prometheus.client.MetricFamily; encoding=delimited')
+
+# MetricType enum values
+METRIC_TYPES = {'counter': 0, 'gauge': 1, 'summary': 2, 'histogram': 4}
+
+_DOUBLE = Struct('<d')
+
+# all field numbers used are below 16, so tags fit in one byte
+_VARINT, _FIXED64, _BYTES = 0, 1, 2
+
+
+def _varint(n: int) -> bytes:
+    if n < 0:
+        # int64 is encoded as its two's complement
+        n += 1 << 64
+    if n < 0x80:
+        return bytes((n, ))
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    # sint32 and sint64 are encoded as unsigned with sign in lowest bit
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def _uint(number: int, value: int) -> bytes:
+    return bytes((number << 3 | _VARINT, )) + _varint(value)
+
+
+def _double(number: int, value: float) -> bytes:
+    return bytes((number << 3 | _FIXED64, )) + _DOUBLE.pack(value)
+
+
+def _message(number: int, data: bytes) -> bytes:
+    return bytes((number << 3 | _BYTES, )) + _varint(len(data)) + data
+
+
+def _string(number: int, value: str) -> bytes:
+    return _message(number, value.encode('utf-8'))
+
+
+def _labels(labels: Dict[str, str]) -> bytes:
+    # repeated LabelPair, field 1 of both Metric and Exemplar
+    return b''.join(
+        _message(1, _string(1, k) + _string(2, v))
+        for k, v in labels.items())
+
+
+def _timestamp(ts: float) -> bytes:
+    # google.protobuf.Timestamp
+    seconds = floor(ts)
+    return _uint(1, seconds) + _uint(2, int((ts - seconds) * 1e9))
+
+
+def _exemplar(exemplar) -> bytes:
+    labels, value, ts = exemplar
+    return (
+        _labels(labels) + _double(2, value)
+        + _message(3, _timestamp(ts)))
+
+
+def _created(number: int, m) -> bytes:
+    created = getattr(m, '_created', None)
+    if created is None:
+        return b''
+    return _message(number, _timestamp(created))
+
+
+def _counter(m, values):
+    (v, ) = values
+    body = _double(1, v.value)
+    exemplar = getattr(m, '_exemplar', None)
+    if exemplar is not None:
+        body += _message(2, _exemplar(exemplar))
+    return _message(3, body + _created(3, m)), v.timestamp
+
+
+def _gauge(m, values):
+    (v, ) = values
+    return _message(2, _double(1, v.value)), v.timestamp
+
+
+def _spans(buckets: Dict[int, int]):
+    """
+    BucketSpan messages and deltas of counts for sparse buckets,
+    gaps up to 2 buckets are filled with zero counts rather than new span
+    """
+    spans = []
+    deltas = []
+    prev_index = prev_count = None
+    for index in sorted(buckets):
+        if prev_index is None or index - prev_index > 3:
+            offset = index if prev_index is None else index - prev_index - 1
+            spans.append([offset, 0])
+        else:
+            for _ in range(index - prev_index - 1):
+                deltas.append(-prev_count)
+                prev_count = 0
+                spans[-1][1] += 1
+        c = buckets[index]
+        deltas.append(c - (prev_count or 0))
+        spans[-1][1] += 1
+        prev_index, prev_count = index, c
+    return (
+        [_uint(1, _zigzag(offset)) + _uint(2, length)
+         for offset, length in spans],
+        b''.join(_varint(_zigzag(d)) for d in deltas))
+
+
+def _native(m) -> bytes:
+    schema, zero_count, positive, negative = m.buckets_snapshot()
+    body = [
+        _uint(5, _zigzag(schema)),
+        _double(6, m.zero_threshold),
+        _uint(7, zero_count)]
+    for span_field, delta_field, buckets in (
+        (9, 10, negative), (12, 13, positive),
+    ):
+        spans, deltas = _spans(buckets)
+        body.extend(_message(span_field, span) for span in spans)
+        if deltas:
+            # packed repeated sint64
+            body.append(_message(delta_field, deltas))
+    if not positive and not negative and not zero_count:
+        # empty span tells histogram is native, even without observations
+        body.append(_message(12, b''))
+    return b''.join(body)
+
+
+def _histogram(m, values):
+    body = [_uint(1, int(values[-1].value)), _double(2, values[-2].value)]
+    if isinstance(m, NativeHistogram):
+        body.append(_native(m))
+    exemplars = getattr(m, '_exemplars', None)
+    cumulative = 0
+    # +Inf bucket is implied by sample count
+    for index, upper in enumerate(m.buckets):
+        cumulative += values[index].value
+        bucket = _uint(1, int(cumulative)) + _double(2, upper)
+        if exemplars and exemplars[index] is not None:
+            bucket += _message(3, _exemplar(exemplars[index]))
+        body.append(_message(3, bucket))
+    body.append(_created(15, m))
+    return _message(7, b''.join(body)), None
+
+
+def _summary(m, values):
+    body = [_uint(1, int(values[-1].value)), _double(2, values[-2].value)]
+    for q, v in zip(m.buckets, values):
+        body.append(_message(3, _double(1, q) + _double(2, v.value)))
+    body.append(_created(4, m))
+    return _message(4, b''.join(body)), None
+
+
+_ENCODERS = {
+    'counter': _counter,
+    'gauge': _gauge,
+    'histogram': _histogram,
+    'summary': _summary,
+}
+
+
+def encode_group(group) -> bytes:
+    "Length delimited MetricFamily message, empty if group has no samples"
+    mtype = group.mcls.TYPE
+    encoder = _ENCODERS[mtype]
+    metrics = []
+    for k, m in group.items():
+        values = list(m.sample_values())
+        if not values:
+            continue
+        body, timestamp = encoder(m, values)
+        metric = _labels(k.labels) + body
+        if timestamp is not None:
+            metric += _uint(6, timestamp)
+        metrics.append(_message(4, metric))
+    if not metrics:
+        return b''
+    family = _string(1, group.key.name)
+    if group.help is not None:
+        family += _string(2, group.help_text())
+    family += _uint(3, METRIC_TYPES[mtype]) + b''.join(metrics)
+    return _varint(len(family)) + family
+
+
+def encode_chunks(registry):
+    "Protobuf exposition of registry, yielded group by group"
+    if registry.multiprocess_dir is not None:
+        raise ValueError('Protobuf is not supported in multiprocess mode')
+    for group in registry.groups():
+        data = encode_group(group)
+        if data:
+            yield data
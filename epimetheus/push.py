@@ -0,0 +1,340 @@
+import http.client
+import random
+from base64 import urlsafe_b64encode
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Dict
+from urllib.parse import quote, urlsplit
+
+from . import protobuf
+from .sample import SampleValue, clock
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# Pushing registry for jobs which can't be scraped:
+#
+#   exporter = PushGatewayExporter(registry, 'http://gateway:9091', 'backup')
+#   exporter.start()  # pushes every interval from background thread
+#   ...
+#   exporter.close()  # final push
+#
+# Only changes since the latest successful push are sent,
+# failed pushes are retried with exponential backoff.
+
+__all__ = (
+    'PushExporter', 'PushGatewayExporter', 'RemoteWriteExporter',
+    'snappy_compress',
+)
+
+
+def _literal(data: bytes) -> bytes:
+    # snappy literal element, length - 1 goes to tag or following bytes
+    n = len(data) - 1
+    if n < 60:
+        return bytes((n << 2, )) + data
+    size = (n.bit_length() + 7) // 8
+    return bytes(((59 + size) << 2, )) + n.to_bytes(size, 'little') + data
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """
+    Snappy block format, as remote write protocol requires.
+    Without python-snappy installed data is stored as literals,
+    receivers accept it, but it's not compressed at all.
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+    return protobuf._varint(len(data)) + b''.join(
+        _literal(data[pos:pos + 65536])
+        for pos in range(0, len(data), 65536))
+
+
+class PushExporter:
+    """
+    Pushes registry to HTTP endpoint every interval seconds
+    from a background thread, so threads updating metrics never wait
+    for network. HTTP connection is kept open between pushes.
+    After failed push next one is delayed twice as long,
+    up to max_backoff seconds. Subclasses define request payload.
+    """
+
+    def __init__(
+        self,
+        registry,
+        url: str,
+        *,
+        interval: float = 15,
+        timeout: float = 10,
+        max_backoff: float = 300,
+        headers: Dict[str, str] = None,
+    ):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('Push URL must be http or https one')
+        self.registry = registry
+        self.interval = interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.headers = headers or {}
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._base_path = parts.path.rstrip('/')
+        self._conn = None
+        # serializes pushes of background thread and of flush calls
+        self._lock = Lock()
+        self._failures = 0
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        "Starts pushing from background thread"
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = Thread(
+                target=self._run, name='epimetheus-push', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, push: bool = True):
+        "Stops background thread, pushing latest changes first"
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        if push:
+            self.push()
+        with self._lock:
+            self._disconnect()
+
+    def _delay(self) -> float:
+        if not self._failures:
+            return self.interval
+        delay = min(self.max_backoff, self.interval * 2 ** self._failures)
+        # pushers failed at once shouldn't retry at once
+        return delay * random.uniform(0.5, 1)
+
+    def _run(self):
+        while not self._stopped.wait(self._delay()):
+            self.push()
+
+    def push(self) -> bool:
+        """
+        Sends changes since latest successful push right away,
+        True if they were accepted (or there were none)
+        """
+        with self._lock:
+            request = self._request()
+            if request is None:
+                return True
+            method, path, body, headers, commit = request
+            try:
+                ok = self._send(method, path, body, headers)
+            except (OSError, http.client.HTTPException):
+                # connection is opened again on next push
+                self._disconnect()
+                ok = False
+            if ok:
+                commit()
+                self._failures = 0
+            else:
+                self._failures += 1
+            return ok
+
+    def _send(self, method, path, body, headers) -> bool:
+        if self._conn is None:
+            cls = (
+                http.client.HTTPSConnection if self._scheme == 'https'
+                else http.client.HTTPConnection)
+            self._conn = cls(self._netloc, timeout=self.timeout)
+        self._conn.request(
+            method, self._base_path + path, body,
+            {**self.headers, **headers})
+        response = self._conn.getresponse()
+        response.read()
+        if response.getheader('Connection', '').lower() == 'close':
+            self._disconnect()
+        return 200 <= response.status < 300
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request(self):
+        """
+        (method, path, body, headers, commit) of next push, None if there's
+        nothing to push, commit is called once push is accepted
+        """
+        raise NotImplementedError
+
+
+def _group_text(group) -> str:
+    "Text exposition of group without timestamps, Pushgateway rejects them"
+    lines = [
+        f'{rk.expose()} {SampleValue.expose_value(v.value)}\n'
+        for k, m in group.items()
+        for rk, v in zip(m.sample_group(k), m.sample_values())]
+    if not lines:
+        return ''
+    return group.render_header() + ''.join(lines)
+
+
+def _path_segment(name: str, value) -> str:
+    value = str(value)
+    if '/' in value or not value:
+        # pushgateway way to pass any value in path
+        encoded = urlsafe_b64encode(value.encode('utf-8')).decode()
+        return f'/{name}@base64/{encoded or "="}'
+    return f'/{name}/{quote(value, safe="")}'
+
+
+class PushGatewayExporter(PushExporter):
+    """
+    Pushes registry to Prometheus Pushgateway, grouped by job
+    and grouping labels. First push replaces the whole group (PUT),
+    following ones send only changed metric groups (POST),
+    those replace metrics of the same names on gateway.
+    """
+
+    def __init__(
+        self,
+        registry,
+        url: str,
+        job: str,
+        grouping: Dict[str, str] = None,
+        **options,
+    ):
+        super().__init__(registry, url, **options)
+        self._path = '/metrics' + _path_segment('job', job) + ''.join(
+            _path_segment(k, v) for k, v in (grouping or {}).items())
+        # group key -> text of latest successful push
+        self._pushed = None
+
+    def _request(self):
+        headers = {'Content-Type': 'text/plain; version=0.0.4'}
+        if self.registry.multiprocess_dir is not None:
+            # merged files of workers, no groups to compare
+            return (
+                'PUT', self._path, self.registry.render().encode('utf-8'),
+                headers, lambda: None)
+
+        texts = {g.key: _group_text(g) for g in self.registry.groups()}
+        pushed = self._pushed
+        if pushed is None or not pushed.keys() <= texts.keys():
+            # removed metrics remain on gateway unless group is replaced
+            method, changed = 'PUT', texts.values()
+        else:
+            method = 'POST'
+            changed = [
+                text for k, text in texts.items() if pushed.get(k) != text]
+            if not changed:
+                return None
+
+        def commit():
+            self._pushed = texts
+
+        body = '\n'.join(changed).encode('utf-8')
+        return method, self._path, body, headers, commit
+
+    def delete(self) -> bool:
+        "Removes pushed metrics of the group from gateway"
+        with self._lock:
+            try:
+                ok = self._send('DELETE', self._path, None, {})
+            except (OSError, http.client.HTTPException):
+                self._disconnect()
+                return False
+            if ok:
+                self._pushed = None
+            return ok
+
+
+def _write_series(registry):
+    "(sorted label pairs including __name__, value, timestamp) of samples"
+    now = clock()
+    for group in registry.groups():
+        cumulative = group.mcls.TYPE == 'histogram'
+        for k, m in group.items():
+            values = list(m.sample_values())
+            # remote write keeps Prometheus semantics,
+            # histogram buckets are cumulative there
+            buckets = len(m.buckets) + 1 if cumulative else 0
+            total = 0
+            for index, (rk, v) in enumerate(zip(m.sample_group(k), values)):
+                value = v.value
+                if index < buckets:
+                    total += value
+                    value = total
+                labels = tuple(sorted(
+                    (('__name__', rk.name), *(
+                        (name, str(lv)) for name, lv in rk.labels.items()))))
+                yield labels, value, v.timestamp or now
+
+
+def _encode_series(labels, value, ts) -> bytes:
+    # prometheus.TimeSeries of a single sample
+    body = b''.join(
+        protobuf._message(1, protobuf._string(1, name)
+                          + protobuf._string(2, lv))
+        for name, lv in labels)
+    sample = protobuf._double(1, value) + protobuf._uint(2, ts)
+    return protobuf._message(1, body + protobuf._message(2, sample))
+
+
+class RemoteWriteExporter(PushExporter):
+    """
+    Pushes samples by Prometheus remote write protocol 1.0
+    (snappy compressed protobuf WriteRequest).
+    Only samples changed since latest successful push are sent,
+    unchanged ones are repeated every resend_interval seconds
+    so receivers don't consider them stale.
+    """
+
+    def __init__(
+        self,
+        registry,
+        url: str,
+        *,
+        resend_interval: float = 60,
+        **options,
+    ):
+        if registry.multiprocess_dir is not None:
+            raise ValueError(
+                'Remote write is not supported in multiprocess mode')
+        super().__init__(registry, url, **options)
+        self.resend_interval = resend_interval
+        # labels -> (value, monotonic time) of latest successful push
+        self._pushed = {}
+
+    def _request(self):
+        now = monotonic()
+        pushed = self._pushed
+        current = {}
+        parts = []
+        for labels, value, ts in _write_series(self.registry):
+            prev = pushed.get(labels)
+            if (
+                prev is not None and prev[0] == value
+                and now - prev[1] < self.resend_interval
+            ):
+                current[labels] = prev
+                continue
+            current[labels] = value, now
+            parts.append(_encode_series(labels, value, ts))
+        if not parts:
+            return None
+
+        def commit():
+            # removed series are forgotten
+            self._pushed = current
+
+        headers = {
+            'Content-Type': 'application/x-protobuf',
+            'Content-Encoding': 'snappy',
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+        }
+        body = snappy_compress(b''.join(parts))
+        return 'POST', '', body, headers, commit
@@ -0,0 +1,170 @@
+from dataclasses import dataclass, field
+from math import ceil, floor, inf, nan
+from typing import Dict, List, Union
+
+# Quantile estimators for Summary
+# Memory depends on requested precision, not on number of observations
+
+__all__ = ('CKMS', 'ckms')
+
+
+@dataclass
+class CKMS:
+    """
+    Targeted quantiles stream from Cormode, Korn, Muthukrishnan, Srivastava
+    "Effective Computation of Biased Quantiles over Data Streams".
+    Same algorithm is used by official Go client.
+    """
+    # quantile -> allowed rank error, e.g. {0.99: 0.001}
+    targets: Dict[float, float]
+    buffer_size: int = 500
+
+    # sorted tuples of (value, width, delta), stored column-wise
+    _values: List[float] = field(init=False, default_factory=list)
+    _widths: List[int] = field(init=False, default_factory=list)
+    _deltas: List[int] = field(init=False, default_factory=list)
+    _buffer: List[float] = field(init=False, default_factory=list)
+    _n: int = field(init=False, default=0)
+    sum: float = field(init=False, default=0)
+    _min: float = field(init=False, default=inf)
+    _max: float = field(init=False, default=-inf)
+
+    def __post_init__(self):
+        for q, e in self.targets.items():
+            if not (0 <= q <= 1):
+                raise ValueError('Quantiles must be in range 0..1')
+            if not (0 < e < 1):
+                raise ValueError('Allowed error must be in range 0..1')
+        # 0 and 1 are answered from exact min and max
+        self._targets = tuple(
+            (q, e) for q, e in sorted(self.targets.items()) if 0 < q < 1)
+
+    @property
+    def count(self) -> int:
+        return self._n + len(self._buffer)
+
+    def insert(self, value: float):
+        self._buffer.append(value)
+        self.sum += value
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def insert_many(self, values: List[float]):
+        self._buffer.extend(values)
+        self.sum += sum(values)
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def query(self, q: float) -> float:
+        self._flush()
+        if not self._values:
+            return nan
+        if q <= 0:
+            return self._min
+        if q >= 1:
+            return self._max
+
+        n = self._n
+        r = ceil(q * n)
+        t = r + self._allowed_width(r, n) / 2
+        values, widths, deltas = self._values, self._widths, self._deltas
+        prev = values[0]
+        r = 0
+        # first tuple with max possible rank above t, answer is previous one
+        for i in range(1, len(values)):
+            r += widths[i - 1]
+            if r + widths[i] + deltas[i] > t:
+                return prev
+            prev = values[i]
+        return prev
+
+    def _allowed_width(self, r: float, n: int) -> float:
+        m = inf
+        for q, e in self._targets:
+            if q * n <= r:
+                f = 2 * e * r / q
+            else:
+                f = 2 * e * (n - r) / (1 - q)
+            if f < m:
+                m = f
+        return m
+
+    def _flush(self):
+        buf = self._buffer
+        if not buf:
+            return
+        buf.sort()
+        self._buffer = []
+        if buf[0] < self._min:
+            self._min = buf[0]
+        if buf[-1] > self._max:
+            self._max = buf[-1]
+
+        values, widths, deltas = self._values, self._widths, self._deltas
+        nv, nw, nd = [], [], []
+        total = len(values)
+        n = self._n
+        r = 0
+        i = 0
+        for v in buf:
+            while i < total and values[i] <= v:
+                nv.append(values[i])
+                nw.append(widths[i])
+                nd.append(deltas[i])
+                r += widths[i]
+                i += 1
+            if i == 0 or i == total:
+                delta = 0
+            else:
+                delta = max(0, floor(self._allowed_width(r, n)) - 1)
+            nv.append(v)
+            nw.append(1)
+            nd.append(delta)
+            n += 1
+            r += 1
+        nv.extend(values[i:])
+        nw.extend(widths[i:])
+        nd.extend(deltas[i:])
+
+        self._values, self._widths, self._deltas = nv, nw, nd
+        self._n = n
+        self._compress()
+
+    def _compress(self):
+        values, widths, deltas = self._values, self._widths, self._deltas
+        if len(values) < 2:
+            return
+        # merge tuples into their right neighbour while error allows
+        rv, rw, rd = [], [], []
+        xv, xw, xd = values[-1], widths[-1], deltas[-1]
+        r = self._n - 1 - xw
+        for i in range(len(values) - 2, -1, -1):
+            cw = widths[i]
+            if cw + xw + xd <= self._allowed_width(r, self._n):
+                xw += cw
+            else:
+                rv.append(xv)
+                rw.append(xw)
+                rd.append(xd)
+                xv, xw, xd = values[i], cw, deltas[i]
+            r -= cw
+        rv.append(xv)
+        rw.append(xw)
+        rd.append(xd)
+        rv.reverse()
+        rw.reverse()
+        rd.reverse()
+        self._values, self._widths, self._deltas = rv, rw, rd
+
+
+def ckms(error: Union[float, Dict[float, float]] = 0.01):
+    """
+    Estimator factory for Summary.
+    error is allowed rank error, either same for all quantiles
+    or a mapping of quantile to its error.
+    """
+    def factory(quantiles):
+        if isinstance(error, dict):
+            return CKMS({q: error[q] for q in quantiles})
+        return CKMS({q: error for q in quantiles})
+    return factory
@@ -1,11 +1,17 @@
+import asyncio
 from dataclasses import dataclass, field
 from typing import Dict
 
-from . import metrics
+from . import columnar, metrics, multiprocess, snapshot
+from .collector import Collector
 from .sample import SampleKey
+from .threadsafe import THREADSAFE_CLASSES
 
 __all__ = ('Registry', )
 
+# builder arguments passed to group rather than to metric class
+GROUP_OPTIONS = ('max_series', 'overflow', 'ttl')
+
 
 def _create_builder(mcls):
     def builder(
@@ -23,12 +29,7 @@ def _create_builder(mcls):
         # we do not check there equality of instances
         # TODO: may be we should?
 
-        group = metrics.Group(
-            key=key,
-            mcls=mcls,
-            kwargs=kwargs,
-            help=help,
-        )
+        group = self._create_group(key, mcls, kwargs, help)
         self.register(key, group)
         return group
     return builder
@@ -36,7 +37,55 @@ def _create_builder(mcls):
 
 @dataclass
 class Registry:
+    # metrics may be updated from multiple threads
+    threadsafe: bool = False
+    # directory shared by worker processes, see epimetheus.multiprocess
+    multiprocess_dir: str = None
     _groups: dict = field(init=False, default_factory=dict)
+    _collectors: list = field(init=False, default_factory=list)
+
+    def __post_init__(self):
+        if self.threadsafe and self.multiprocess_dir is not None:
+            raise ValueError(
+                'Multiprocess mode can not be combined with threadsafe one')
+
+    def _create_group(self, key, mcls, kwargs, help):
+        # series limits and expiration are options of group,
+        # not of its children
+        options = {
+            name: kwargs.pop(name) for name in GROUP_OPTIONS
+            if name in kwargs}
+        # supported by every kind of group
+        labelnames = kwargs.pop('labelnames', None)
+        # histograms with many label sets may keep bucket counts
+        # in a single array, see epimetheus.columnar
+        if kwargs.pop('columnar', False):
+            if mcls is not metrics.Histogram:
+                raise ValueError('Only histograms support columnar storage')
+            if self.threadsafe or self.multiprocess_dir is not None:
+                raise ValueError(
+                    'Columnar storage can not be used in threadsafe '
+                    'or multiprocess mode')
+            if options:
+                raise ValueError(
+                    'Columnar storage does not support series limits')
+            return columnar.ColumnarHistogramGroup(
+                key=key, kwargs=kwargs, help=help, labelnames=labelnames)
+        if self.multiprocess_dir is not None:
+            if options:
+                raise ValueError(
+                    'Series limits are not supported in multiprocess mode')
+            return multiprocess.create_group(
+                self.multiprocess_dir, key, mcls, kwargs=kwargs, help=help,
+                labelnames=labelnames)
+        # same metric definitions should work with and without
+        # multiprocess mode, so multiprocess options are just dropped
+        kwargs.pop('multiprocess_mode', None)
+        if self.threadsafe:
+            mcls = THREADSAFE_CLASSES[mcls]
+        return metrics.Group(
+            key=key, mcls=mcls, kwargs=kwargs, help=help,
+            labelnames=labelnames, **options)
 
     def get(self, key: SampleKey):
         return self._groups.get(key)
@@ -48,12 +97,111 @@ class Registry:
     def unregister(self, key):
         del self._groups[key]
 
+    def register_collector(
+        self,
+        func,
+        *,
+        timeout: float = None,
+        ttl: float = None,
+    ) -> Collector:
+        """
+        Registers function giving metric families on exposition,
+        see epimetheus.collector. Coroutine functions are run
+        concurrently by collect_async.
+        """
+        collector = Collector(func, timeout=timeout, ttl=ttl)
+        self._collectors.append(collector)
+        return collector
+
+    def unregister_collector(self, collector: Collector):
+        self._collectors.remove(collector)
+
+    async def collect_async(self):
+        "Runs async collectors, following expositions give their results"
+        # failing collector does not stop the others
+        await asyncio.gather(*(
+            c.collect_async() for c in tuple(self._collectors)
+            if c.is_async), return_exceptions=True)
+
+    def _collected(self):
+        families = []
+        for collector in tuple(self._collectors):
+            families.extend(collector.families())
+        return families
+
+    def groups(self):
+        """
+        Snapshot of registered metric groups in registration order,
+        followed by families given by collectors
+        """
+        return (*self._groups.values(), *self._collected())
+
+    def render_state(self):
+        """
+        Stays the same while rendered text of registry doesn't change,
+        None if it may change on next render.
+        """
+        if self.multiprocess_dir is not None:
+            return None
+        state = []
+        for exp in (*self._groups.values(), *self._collectors):
+            gstate = exp.render_state()
+            if gstate is None:
+                return None
+            state.append(gstate)
+        return tuple(state)
+
+    def snapshot(self) -> bytes:
+        """
+        Compact binary snapshot of counters, gauges and histograms,
+        see epimetheus.snapshot
+        """
+        return snapshot.dump(self)
+
+    def merge(self, data: bytes, *, gauges: str = 'sum'):
+        """
+        Adds up values of snapshot taken in other registry,
+        gauges are combined by one of snapshot.GAUGE_POLICIES
+        """
+        snapshot.merge(self, data, gauges)
+
     def expose(self):
-        for exp in self._groups.values():
+        if self.multiprocess_dir is not None:
+            yield from multiprocess.expose(self.multiprocess_dir, {
+                k.name: g.help for k, g in self._groups.items()})
+            groups = self._collected()
+        else:
+            groups = self.groups()
+        for exp in groups:
             yield from exp.expose()
             yield ''
 
+    def render(self) -> str:
+        """
+        Whole exposition as a single text,
+        same as expose() lines joined by newline with a trailing one.
+        Unchanged samples are reused from previous call.
+        """
+        if self.multiprocess_dir is not None:
+            return ''.join(line + '\n' for line in self.expose())
+        parts = []
+        for exp in self.groups():
+            parts.append(exp.render())
+            parts.append('\n')
+        return ''.join(parts)
+
+    def render_chunks(self):
+        "Same text as render() gives, yielded piece by piece"
+        if self.multiprocess_dir is not None:
+            for line in self.expose():
+                yield line + '\n'
+            return
+        for exp in self.groups():
+            yield from exp.render_chunks()
+            yield '\n'
+
     counter = _create_builder(metrics.Counter)
     gauge = _create_builder(metrics.Gauge)
     histogram = _create_builder(metrics.Histogram)
+    native_histogram = _create_builder(metrics.NativeHistogram)
     summary = _create_builder(metrics.Summary)
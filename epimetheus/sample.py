@@ -1,47 +1,96 @@
+import asyncio
 import math
+import os
 import re
 import time
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from itertools import chain
+from sys import intern
+from threading import Event, Lock, Thread
 from typing import Dict
 
-from sortedcontainers import SortedDict
-
-__all__ = ('SampleKey', 'SampleValue', 'clock')
+__all__ = (
+    'SampleKey', 'SampleValue', 'CoarseClock', 'COARSE_CLOCK',
+    'clock', 'clock_seconds',
+)
 METRIC_NAME_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
 LABEL_NAME_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
 
 
-@dataclass(eq=True, frozen=True)
 class SampleKey:
-    name: str = field(compare=False, repr=False)
-    labels: Dict[str, str] = field(default=None, compare=False, repr=False)
-    _line: str = field(init=False, compare=False, repr=True)
-    _cmp_line: str = field(init=False, compare=True, repr=False)
-
-    def __post_init__(self):
-        if METRIC_NAME_RE.fullmatch(self.name) is None:
+    """
+    Metric name with label set.
+    Label names and values are interned, so keys of many series
+    share the same string objects, and kept in a flat tuple
+    of name, value pairs instead of a dict.
+    Keys are equal if they have same labels in any order.
+    """
+    __slots__ = ('name', '_items', '_line', '_sorted', '_hash')
+
+    def __init__(self, name: str, labels: Dict[str, str] = None):
+        if METRIC_NAME_RE.fullmatch(name) is None:
             raise ValueError('Invalid sample name')
 
-        clab = {}
-        if self.labels is not None:
-            for k, v in self.labels.items():
-                v = str(v)
+        items = []
+        if labels is not None:
+            for k, v in labels.items():
                 if k.startswith('__'):
                     raise ValueError(
                         'Label names starting with __ '
                         'are reserved by Prometheus')
                 if LABEL_NAME_RE.fullmatch(k) is None:
                     raise ValueError('Invalid label name')
-                clab[k] = v
-        object.__setattr__(self, 'labels', clab)
+                items.append(intern(k))
+                items.append(intern(str(v)))
+        items = tuple(items)
+        lset = self.expose_label_set(dict(zip(items[::2], items[1::2])))
+        self._init(intern(name), items, f'{name}{lset}')
+
+    @classmethod
+    def _compiled(cls, name: str, items: tuple, line: str) -> 'SampleKey':
+        "Key of interned name and label items validated beforehand"
+        key = object.__new__(cls)
+        key._init(name, items, line)
+        return key
+
+    def _init(self, name: str, items: tuple, line: str):
+        set_ = object.__setattr__
+        set_(self, 'name', name)
+        set_(self, '_items', items)
+        set_(self, '_line', line)
+        # keys are hashed on every lookup of child, rendered text, etc.,
+        # so comparable form and hash are computed once;
+        # items sorted by label name are shared with _items
+        names = items[::2]
+        if list(names) != sorted(names):
+            items = tuple(chain.from_iterable(
+                sorted(zip(names, items[1::2]))))
+        set_(self, '_sorted', items)
+        set_(self, '_hash', hash((name, items)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        items = self._items
+        return dict(zip(items[::2], items[1::2]))
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return (
+            self._hash == other._hash and self.name == other.name
+            and self._sorted == other._sorted)
 
-        # TODO: need this difference?
-        object.__setattr__(
-            self, '_line',
-            f'{self.name}{self.expose_label_set(self.labels)}')
-        object.__setattr__(
-            self, '_cmp_line',
-            f'{self.name}{self.expose_label_set(SortedDict(self.labels))}')
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._line!r})'
+
+    def __reduce__(self):
+        return type(self), (self.name, self.labels)
 
     def with_suffix(self, suffix: str) -> 'SampleKey':
         return type(self)(
@@ -90,6 +139,10 @@ class SampleValue:
 
     @staticmethod
     def expose_value(value):
+        # finite values first, inf - inf and nan - nan are nan;
+        # integers, e.g. counts, are never converted to float
+        if value - value == 0:
+            return str(value)
         if value == math.inf:
             return 'Inf'
         elif value == -math.inf:
@@ -111,3 +164,86 @@ class SampleValue:
 
 def clock():
     return int(time.time() * 1000)
+
+
+def clock_seconds():
+    "Same as clock() in seconds, for timestamps exposed as float seconds"
+    return clock() / 1000
+
+
+class CoarseClock:
+    """
+    Same value as clock() gives, but refreshed only every interval seconds
+    by a daemon thread or by asyncio event loop, so reading it is
+    just an attribute access.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.now = clock()
+        self._thread = None
+        self._stopped = None
+        self._handle = None
+        self._loop = None
+        self._lock = Lock()
+
+    def tick(self):
+        self.now = clock()
+
+    def start(self):
+        "Starts refreshing thread, unless clock is refreshed already"
+        with self._lock:
+            if self._handle is not None and self._loop.is_closed():
+                # attached loop is gone, its callback never runs again
+                self._handle = None
+                self._loop = None
+            if self._thread is not None or self._handle is not None:
+                return
+            self.tick()
+            self._stopped = Event()
+            self._thread = Thread(
+                target=self._run, args=(self._stopped, ),
+                name='epimetheus-clock', daemon=True)
+            self._thread.start()
+
+    def _run(self, stopped):
+        while not stopped.wait(self.interval):
+            self.tick()
+
+    def attach(self, loop: asyncio.AbstractEventLoop = None):
+        "Refreshes clock by callbacks of event loop instead of thread"
+        self.stop()
+        loop = loop or asyncio.get_running_loop()
+
+        def tick():
+            # clock may be detached or attached to other loop meanwhile
+            if self._loop is loop:
+                self.tick()
+                self._handle = loop.call_later(self.interval, tick)
+
+        with self._lock:
+            self._loop = loop
+            tick()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._stopped.set()
+                self._thread = None
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            self._loop = None
+
+    def _after_fork(self):
+        # threads don't survive fork
+        self._lock = Lock()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+
+COARSE_CLOCK = CoarseClock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=COARSE_CLOCK._after_fork)
@@ -0,0 +1,335 @@
+import asyncio
+from functools import partial
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+
+from .exposition import (
+    OPENMETRICS, PROTOBUF, TEXT, CompressedExposition, Format, _compressobj,
+    _joined, choose_encoding, choose_format, write_async)
+from .collector import Collector
+from .registry import Registry
+
+# Standalone /metrics servers for applications without web framework:
+#
+#   server = start_http_server(registry, 9100)  # in background thread
+#   server = await start_server_async(registry, 9100)  # in event loop
+#
+# Both keep connections alive, negotiate format and compression
+# and reuse rendered payload for concurrent and repeated scrapes.
+
+__all__ = (
+    'MetricsEndpoint', 'MetricsHandler',
+    'start_http_server', 'start_server_async',
+)
+
+FORMAT_NAMES = {TEXT: 'text', OPENMETRICS: 'openmetrics', PROTOBUF: 'protobuf'}
+# idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 30
+# histogram buckets of scrape durations, seconds
+DURATION_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+
+class _SelfMetrics(Collector):
+    """
+    Scrape metrics of endpoints serving registry, kept in own threadsafe
+    registry and exposed as families of a collector of served one
+    """
+
+    def __init__(self):
+        self.registry = Registry(threadsafe=True)
+        self.duration = self.registry.histogram(
+            name='metrics_scrape_duration_seconds',
+            help='metrics_scrape_duration_seconds Time to respond '
+            'to scrape, including waiting for render',
+            buckets=DURATION_BUCKETS)
+        self.size = self.registry.gauge(
+            name='metrics_scrape_response_bytes',
+            help='metrics_scrape_response_bytes Size of latest '
+            'scrape response body',
+            use_clock=False)
+        super().__init__(self.registry.groups)
+
+    def render_state(self):
+        # every scrape updates them, so they must not invalidate
+        # cached payloads, they are refreshed with the rest of registry
+        return ()
+
+
+def _self_metrics(registry) -> _SelfMetrics:
+    # several endpoints may serve the same registry
+    for collector in registry._collectors:
+        if isinstance(collector, _SelfMetrics):
+            return collector
+    collector = _SelfMetrics()
+    registry._collectors.append(collector)
+    return collector
+
+
+class MetricsEndpoint:
+    """
+    Responses to scrapes of registry, shared by both servers.
+    Payload of every format and encoding is reused for ttl seconds,
+    scrapes arriving while it's rendered wait for the same render.
+    """
+
+    def __init__(
+        self,
+        registry,
+        *,
+        path: str = '/metrics',
+        ttl: float = 1.0,
+        self_metrics: bool = True,
+    ):
+        self.registry = registry
+        self.path = path
+        self.ttl = ttl
+        # (format, encoding) -> (payload, monotonic time of render)
+        self._cache = {}
+        # (format, encoding) -> lock taken by render in threads
+        self._locks = {}
+        # (format, encoding) -> task of render in event loop
+        self._pending = {}
+        # (format, encoding) -> CompressedExposition
+        self._compressed = {}
+        self._self_metrics = _self_metrics(registry) if self_metrics else None
+
+    def _fresh(self, key):
+        cached = self._cache.get(key)
+        if cached is not None and self.ttl and (
+            monotonic() - cached[1] < self.ttl
+        ):
+            return cached[0]
+        return None
+
+    def _store(self, key, payload: bytes) -> bytes:
+        self._cache[key] = payload, monotonic()
+        return payload
+
+    def _render(self, fmt: Format, encoding: str) -> bytes:
+        if encoding is None:
+            return _joined(fmt.chunks(self.registry), fmt.binary)
+        key = fmt, encoding
+        compressed = self._compressed.get(key)
+        if compressed is None:
+            # text isn't compressed again while registry is unchanged
+            compressed = self._compressed[key] = CompressedExposition(
+                self.registry, encoding, format=fmt)
+        return compressed.payload()
+
+    def payload(self, fmt: Format, encoding: str = None) -> bytes:
+        "Exposition in given format and encoding, reused if fresh"
+        key = fmt, encoding
+        # setdefault is atomic, spare lock of a lost race is dropped
+        with self._locks.setdefault(key, Lock()):
+            payload = self._fresh(key)
+            if payload is None:
+                payload = self._store(key, self._render(fmt, encoding))
+            return payload
+
+    async def _render_async(self, fmt: Format, encoding: str) -> bytes:
+        sink = _Sink(encoding)
+        # runs async collectors, doesn't block loop by big registries
+        await write_async(self.registry, sink, format=fmt)
+        return self._store((fmt, encoding), sink.getvalue())
+
+    async def payload_async(self, fmt: Format, encoding: str = None) -> bytes:
+        "Same as payload, but renders without blocking event loop"
+        key = fmt, encoding
+        payload = self._fresh(key)
+        if payload is not None:
+            return payload
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(
+                self._render_async(fmt, encoding))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # scrape giving up must not cancel render for others
+        return await asyncio.shield(pending)
+
+    def _negotiate(self, target, accept, accept_encoding):
+        if target.partition('?')[0] != self.path:
+            return None
+        return (
+            choose_format(accept, self.registry),
+            choose_encoding(accept_encoding))
+
+    def _response(self, fmt, encoding, payload, started):
+        headers = [
+            ('Content-Type', fmt.content_type),
+            ('Content-Length', str(len(payload))),
+            ('Vary', 'Accept, Accept-Encoding'),
+        ]
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        if self._self_metrics is not None:
+            fname = FORMAT_NAMES.get(fmt, 'other')
+            self._self_metrics.duration.with_labels(format=fname).observe(
+                perf_counter() - started)
+            self._self_metrics.size.with_labels(
+                format=fname, encoding=encoding or 'identity',
+            ).set(len(payload))
+        return HTTPStatus.OK, headers, payload
+
+    def respond(self, target: str, accept: str = None,
+                accept_encoding: str = None):
+        "(status, headers, body) of response to GET request"
+        started = perf_counter()
+        negotiated = self._negotiate(target, accept, accept_encoding)
+        if negotiated is None:
+            return _NOT_FOUND
+        fmt, encoding = negotiated
+        return self._response(
+            fmt, encoding, self.payload(fmt, encoding), started)
+
+    async def respond_async(self, target: str, accept: str = None,
+                            accept_encoding: str = None):
+        "Same as respond, for event loop"
+        started = perf_counter()
+        negotiated = self._negotiate(target, accept, accept_encoding)
+        if negotiated is None:
+            return _NOT_FOUND
+        fmt, encoding = negotiated
+        return self._response(
+            fmt, encoding, await self.payload_async(fmt, encoding), started)
+
+
+_NOT_FOUND = (
+    HTTPStatus.NOT_FOUND,
+    [('Content-Type', 'text/plain'), ('Content-Length', '10')],
+    b'Not Found\n')
+
+
+class _Sink:
+    "Stream for write_async collecting optionally compressed payload"
+
+    def __init__(self, encoding: str = None):
+        self._compressor = encoding and _compressobj(encoding)
+        self._parts = []
+
+    def write(self, data: bytes):
+        if self._compressor:
+            data = self._compressor.compress(data)
+        if data:
+            self._parts.append(data)
+
+    def getvalue(self) -> bytes:
+        if self._compressor:
+            self._parts.append(self._compressor.flush())
+        return b''.join(self._parts)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    "Request handler of http.server, endpoint is set by subclass"
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    endpoint: MetricsEndpoint = None
+
+    def do_GET(self):
+        status, headers, body = self.endpoint.respond(
+            self.path,
+            self.headers.get('Accept'),
+            self.headers.get('Accept-Encoding'))
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        # every scrape would be logged to stderr otherwise
+        pass
+
+
+def start_http_server(
+    registry, port: int, addr: str = '', **options,
+) -> ThreadingHTTPServer:
+    """
+    Serves registry from daemon threads, one per connection.
+    options are passed to MetricsEndpoint.
+    Stop with server.shutdown() and server.server_close().
+    """
+    handler = type('MetricsHandler', (MetricsHandler, ), {
+        'endpoint': MetricsEndpoint(registry, **options)})
+    server = ThreadingHTTPServer((addr, port), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def start_server_async(
+    registry, port: int, host: str = None, **options,
+) -> asyncio.AbstractServer:
+    """
+    Serves registry from running event loop.
+    options are passed to MetricsEndpoint.
+    """
+    endpoint = MetricsEndpoint(registry, **options)
+    return await asyncio.start_server(
+        partial(_serve_connection, endpoint), host, port)
+
+
+def _response_head(status, headers, keep_alive: bool) -> bytes:
+    lines = [f'HTTP/1.1 {status.value} {status.phrase}']
+    lines.extend(f'{name}: {value}' for name, value in headers)
+    if not keep_alive:
+        lines.append('Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def _serve_connection(endpoint, reader, writer):
+    "HTTP/1.x requests of a connection, served one after another"
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(
+                    reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+            except (
+                asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.TimeoutError, ConnectionError,
+            ):
+                return
+            request_line, *lines = head.decode('latin-1').split('\r\n')
+            headers = {}
+            for line in lines:
+                name, sep, value = line.partition(':')
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            try:
+                method, target, version = request_line.split()
+                # requests to metrics have no body, but it's skipped anyway
+                length = int(headers.get('content-length', 0))
+                if length:
+                    await reader.readexactly(length)
+            except (ValueError, asyncio.IncompleteReadError):
+                writer.write(_response_head(
+                    HTTPStatus.BAD_REQUEST, [('Content-Length', '0')], False))
+                return
+
+            connection = headers.get('connection', '').lower()
+            if version == 'HTTP/1.1':
+                keep_alive = connection != 'close'
+            else:
+                keep_alive = connection == 'keep-alive'
+            if method in ('GET', 'HEAD'):
+                status, rheaders, body = await endpoint.respond_async(
+                    target, headers.get('accept'),
+                    headers.get('accept-encoding'))
+            else:
+                status, rheaders, body = (
+                    HTTPStatus.METHOD_NOT_ALLOWED,
+                    [('Allow', 'GET, HEAD'), ('Content-Length', '0')], b'')
+            writer.write(_response_head(status, rheaders, keep_alive))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                return
+    except ConnectionError:
+        # client went away, nothing to respond to
+        pass
+    finally:
+        writer.close()
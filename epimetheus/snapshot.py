@@ -0,0 +1,275 @@
+import sys
+from array import array
+from struct import Struct
+
+from . import metrics
+from .multiprocess import combine
+from .sample import SampleKey
+
+# Binary snapshots of registry values, merged into other registries
+# without going through text exposition, e.g. to aggregate metrics
+# of forked workers or subinterpreters in one of them:
+#
+#   data = registry.snapshot()  # in worker
+#   aggregate.merge(data)  # in aggregating process
+#
+# Layout: header, then for every metric group
+#   group header, utf-8 name and help, float64 bucket bounds,
+#   uint16 label count per child, utf-8 label names and values
+#   of the group and of all its children separated by NUL,
+#   float64 rows of values per child.
+# Children are identified by their own label names followed by
+# label values, same tuples Group.with_labels looks children up by.
+# Rows are: counter delta; gauge value and its previous value;
+# histogram bucket count deltas (with +Inf), sum and count deltas.
+# Summaries and native histograms can't be merged and are skipped.
+
+__all__ = ('GAUGE_POLICIES', 'Snapshots', 'dump', 'load', 'merge')
+
+# how merged gauge values are combined with existing ones,
+# same as multiprocess GAUGE_MODES, "last" replaces existing value
+GAUGE_POLICIES = ('sum', 'max', 'min', 'last')
+
+_MAGIC = b'EPS1'
+_HEADER = Struct('<4sI')
+# type, name length, help length + 1 (0 if no help), group label count,
+# bucket count, child count, length of labels text
+_GROUP = Struct('<BHIHHII')
+_TYPES = ('counter', 'gauge', 'histogram')
+_TYPE_CODES = {t: i for i, t in enumerate(_TYPES)}
+_SWAP = sys.byteorder != 'little'
+
+
+def _width(mtype: str, nbuckets: int) -> int:
+    if mtype == 'histogram':
+        return nbuckets + 3
+    return 1 if mtype == 'counter' else 2
+
+
+def _mergeable(group) -> bool:
+    mcls = group.mcls
+    return mcls.TYPE in _TYPE_CODES and not issubclass(
+        mcls, metrics.NativeHistogram)
+
+
+def _values(m):
+    # direct reads of plain metrics are much cheaper than sample values
+    cls = type(m)
+    if cls is metrics.Counter:
+        return (m._count, )
+    if cls is metrics.Gauge:
+        return (m._value, )
+    if cls is metrics.Histogram:
+        return (*m._bcounts, m._sum, m._count)
+    return tuple(v.value for v in m.sample_values())
+
+
+def _little_endian(a: array) -> bytes:
+    if _SWAP:
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _encode_group(group, mtype, children) -> bytes:
+    "children are (child label names and values, row of values)"
+    name = group.key.name.encode('utf-8')
+    help = None if group.help is None else group.help.encode('utf-8')
+    buckets = ()
+    if mtype == 'histogram':
+        buckets = next(iter(group._items.values())).buckets
+    counts = array('H')
+    rows = array('d')
+    items = group.key._items
+    strings = [*items[::2], *items[1::2]]
+    for fk, row in children:
+        counts.append(len(fk) // 2)
+        strings.extend(fk)
+        rows.extend(row)
+    text = '\0'.join(strings)
+    if text.count('\0') != max(len(strings) - 1, 0):
+        raise ValueError('Labels containing NUL can not be snapshotted')
+    text = text.encode('utf-8')
+    return b''.join((
+        _GROUP.pack(
+            _TYPE_CODES[mtype], len(name),
+            0 if help is None else len(help) + 1, len(items) // 2,
+            len(buckets), len(counts), len(text)),
+        name, help or b'', _little_endian(array('d', buckets)),
+        _little_endian(counts), text, _little_endian(rows)))
+
+
+class Snapshots:
+    """
+    Consecutive snapshots of registry, each holding only changes since
+    the previous one. Merging all of them gives the same result
+    as merging a single full snapshot.
+    """
+
+    def __init__(self, registry):
+        if registry.multiprocess_dir is not None:
+            raise ValueError(
+                'Snapshots are not supported in multiprocess mode')
+        self.registry = registry
+        # group key -> {id of child: (child, its labels, previous values)}
+        self._previous = {}
+
+    def take(self) -> bytes:
+        parts = []
+        previous = {}
+        for gkey, group in tuple(self.registry._groups.items()):
+            if not _mergeable(group):
+                continue
+            mtype = group.mcls.TYPE
+            gprev = self._previous.get(gkey, {})
+            # id of child -> (child, its labels, values)
+            values = previous[gkey] = {}
+            # child labels follow labels of the group in its keys
+            skip = len(group.key._items)
+            children = []
+            for k, m in group.items():
+                row = _values(m)
+                prev = gprev.get(id(m))
+                # id may belong to a removed child
+                if prev is None or prev[0] is not m:
+                    items = k._items[skip:]
+                    fk = items[::2] + items[1::2]
+                    prev = None
+                else:
+                    _, fk, prev = prev
+                    if prev == row:
+                        values[id(m)] = m, fk, row
+                        continue
+                values[id(m)] = m, fk, row
+                if mtype == 'gauge':
+                    row = (row[0], 0 if prev is None else prev[0])
+                elif prev is not None and row[-1] >= prev[-1]:
+                    # counter or histogram is reset if it went down,
+                    # e.g. removed and created again
+                    row = [v - p for v, p in zip(row, prev)]
+                children.append((fk, row))
+            if children:
+                parts.append(_encode_group(group, mtype, children))
+        self._previous = previous
+        return _HEADER.pack(_MAGIC, len(parts)) + b''.join(parts)
+
+
+def dump(registry) -> bytes:
+    "Snapshot of all mergeable metrics of registry"
+    return Snapshots(registry).take()
+
+
+def _read_array(typecode, data, pos, count):
+    a = array(typecode)
+    end = pos + a.itemsize * count
+    a.frombytes(data[pos:end])
+    if _SWAP:
+        a.byteswap()
+    return a, end
+
+
+def load(data: bytes):
+    """
+    Yields (type, name, labels, help, buckets, children) of snapshot
+    groups, children are lists of (label names and values, row of values)
+    """
+    data = memoryview(data)
+    magic, ngroups = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError('Not a registry snapshot')
+    pos = _HEADER.size
+    for _ in range(ngroups):
+        (
+            code, name_len, help_len, nlabels, nbuckets, nchildren, text_len,
+        ) = _GROUP.unpack_from(data, pos)
+        pos += _GROUP.size
+        mtype = _TYPES[code]
+        name = bytes(data[pos:pos + name_len]).decode('utf-8')
+        pos += name_len
+        help = None
+        if help_len:
+            help = bytes(data[pos:pos + help_len - 1]).decode('utf-8')
+            pos += help_len - 1
+        buckets, pos = _read_array('d', data, pos, nbuckets)
+        counts, pos = _read_array('H', data, pos, nchildren)
+        strings = tuple(
+            bytes(data[pos:pos + text_len]).decode('utf-8').split('\0'))
+        pos += text_len
+        width = _width(mtype, nbuckets)
+        rows, pos = _read_array('d', data, pos, nchildren * width)
+        rows = rows.tolist()
+        labels = dict(zip(
+            strings[:nlabels], strings[nlabels:2 * nlabels]))
+        children = []
+        spos = 2 * nlabels
+        rpos = 0
+        for n in counts:
+            end = spos + 2 * n
+            children.append((strings[spos:end], rows[rpos:rpos + width]))
+            spos = end
+            rpos += width
+        yield (
+            mtype, name, labels, help, tuple(map(_number, buckets)),
+            children)
+
+
+def _number(value: float):
+    # values are stored as doubles, integers are exposed without ".0"
+    return int(value) if value.is_integer() else value
+
+
+def _target_group(registry, mtype, name, labels, help, buckets):
+    # groups of one name may differ by constant labels
+    group = registry.get(SampleKey(name, labels or None))
+    if group is None:
+        for k, other in tuple(registry._groups.items()):
+            if k.name == name and other.mcls.TYPE != mtype:
+                raise ValueError(f'Metric {name} has other type in registry')
+        kwargs = {'buckets': buckets} if mtype == 'histogram' else {}
+        group = getattr(registry, mtype)(
+            name=name, labels=labels or None, help=help, **kwargs)
+    elif group.mcls.TYPE != mtype or not _mergeable(group):
+        raise ValueError(f'Metric {name} has other type in registry')
+    return group
+
+
+def merge(registry, data: bytes, gauges: str = 'sum'):
+    """
+    Adds values of snapshot to registry, creating missing metrics.
+    Counters and histograms are added up, gauges are combined
+    according to one of GAUGE_POLICIES.
+    """
+    if gauges not in GAUGE_POLICIES:
+        raise ValueError(f'Gauge policy must be one of {GAUGE_POLICIES}')
+    for mtype, name, labels, help, buckets, children in load(data):
+        group = _target_group(registry, mtype, name, labels, help, buckets)
+        fast_items = group._fast_items
+        checked = False
+        for fk, row in children:
+            m = fast_items.get(fk)
+            created = False
+            if m is None:
+                # child may exist, looked up by other order of labels
+                count = len(group._items)
+                n = len(fk) // 2
+                m = group.with_labels(**dict(zip(fk[:n], fk[n:])))
+                created = len(group._items) > count
+            if mtype == 'counter':
+                if row[0]:
+                    m.inc(_number(row[0]))
+            elif mtype == 'gauge':
+                value, prev = map(_number, row)
+                if gauges == 'sum':
+                    m.inc(value - prev)
+                elif gauges == 'last' or created:
+                    # new child has no value to compare with
+                    m.set(value)
+                else:
+                    current = next(m.sample_values()).value
+                    m.set(combine(gauges, current, value))
+            else:
+                if not checked and tuple(m.buckets) != buckets:
+                    raise ValueError(
+                        f'Histogram {name} has other buckets in registry')
+                checked = True
+                m._add_counts(list(map(int, row[:-2])), _number(row[-2]))
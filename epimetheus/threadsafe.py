@@ -0,0 +1,154 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from threading import Lock, get_ident
+from typing import Dict
+
+from . import metrics
+from .sample import SampleValue
+
+# Metric variants safe to update from multiple threads,
+# including free-threaded CPython builds.
+# Counters and histograms keep a separate shard per thread,
+# so updates never wait for each other. Shards are summed up on exposition.
+# Thread idents are reused by Python, so number of shards is bounded
+# by number of simultaneously running threads.
+
+__all__ = (
+    'ShardedCounter', 'LockedGauge', 'ShardedHistogram',
+    'LockedNativeHistogram', 'LockedSummary',
+)
+
+
+@dataclass
+class ShardedCounter(metrics.Counter):
+    # thread ident -> [count], written only by owning thread
+    _shards: dict = field(init=False, default_factory=dict, repr=False)
+
+    def inc(self, delta: float = 1, exemplar: Dict[str, str] = None):
+        assert delta >= 0
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shards[get_ident()] = [0]
+        shard[0] += delta
+        self._dirty = True
+        self._update_ts(delta)
+        if exemplar is not None:
+            self._exemplar = metrics.make_exemplar(exemplar, delta)
+
+    def sample_values(self):
+        yield SampleValue(
+            sum(s[0] for s in tuple(self._shards.values())),
+            self._current_ts())
+
+
+@dataclass
+class LockedGauge(metrics.Gauge):
+    # gauge can be set, so it can't be split into shards
+    _lock: Lock = field(
+        init=False, default_factory=Lock, repr=False, compare=False)
+
+    def inc(self, delta: float = 1):
+        with self._lock:
+            super().inc(delta)
+
+    def dec(self, delta: float = 1):
+        with self._lock:
+            super().dec(delta)
+
+    def set(self, value: float):
+        with self._lock:
+            super().set(value)
+
+    def set_with_timestamp(self, value: float, ts: int):
+        with self._lock:
+            super().set_with_timestamp(value, ts)
+
+    def sample_values(self):
+        with self._lock:
+            values = list(super().sample_values())
+        yield from values
+
+
+@dataclass
+class ShardedHistogram(metrics.Histogram):
+    # thread ident -> bucket counts followed by sum of values
+    _shards: dict = field(init=False, default_factory=dict, repr=False)
+
+    def observe(self, value: float, exemplar: Dict[str, str] = None):
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shards[get_ident()] = [0] * len(self._bcounts) + [0]
+        index = bisect_left(self.buckets, value)
+        shard[index] += 1
+        shard[-1] += value
+        self._dirty = True
+        if exemplar is not None:
+            self._store_exemplar(index, exemplar, value)
+
+    def _add_counts(self, counts, vsum):
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shards[get_ident()] = [0] * len(self._bcounts) + [0]
+        for index, c in enumerate(counts):
+            shard[index] += c
+        shard[-1] += vsum
+        self._dirty = True
+
+    def sample_values(self):
+        shards = tuple(self._shards.values())
+        bcounts = [sum(c) for c in zip(*shards)] or self._bcounts + [0]
+        vsum = bcounts.pop()
+        for v in bcounts:
+            yield SampleValue(v)
+        yield SampleValue(vsum)
+        yield SampleValue(sum(bcounts))
+
+
+@dataclass
+class LockedNativeHistogram(metrics.NativeHistogram):
+    # lowering resolution rebuilds buckets, so shards would need
+    # to agree on schema, single lock is simpler
+    _lock: Lock = field(
+        init=False, default_factory=Lock, repr=False, compare=False)
+
+    def observe(self, value: float, exemplar: Dict[str, str] = None):
+        with self._lock:
+            super().observe(value)
+
+    def buckets_snapshot(self):
+        with self._lock:
+            return super().buckets_snapshot()
+
+    def sample_values(self):
+        with self._lock:
+            values = list(super().sample_values())
+        yield from values
+
+
+@dataclass
+class LockedSummary(metrics.Summary):
+    _lock: Lock = field(
+        init=False, default_factory=Lock, repr=False, compare=False)
+
+    def observe(self, value: float):
+        with self._lock:
+            super().observe(value)
+
+    def observe_many(self, values):
+        with self._lock:
+            super().observe_many(values)
+
+    def sample_values(self):
+        with self._lock:
+            values = list(super().sample_values())
+        yield from values
+
+
+# plain metric class -> its thread-safe variant
+THREADSAFE_CLASSES = {
+    metrics.Counter: ShardedCounter,
+    metrics.Gauge: LockedGauge,
+    metrics.Histogram: ShardedHistogram,
+    metrics.NativeHistogram: LockedNativeHistogram,
+    metrics.Summary: LockedSummary,
+}
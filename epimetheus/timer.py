@@ -0,0 +1,81 @@
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter_ns
+from typing import Callable
+
+# Helpers bound to a metric child once, usable as context managers
+# and as decorators of plain and async functions.
+# Durations are measured with perf_counter_ns and observed in seconds.
+
+__all__ = ('Timer', 'InProgress')
+
+
+class Timer:
+    "Passes duration of with-block or of every decorated call to observe"
+    __slots__ = ('_observe', '_start')
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._observe((perf_counter_ns() - self._start) / 1e9)
+
+    def __call__(self, func):
+        observe = self._observe
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def timed(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe((perf_counter_ns() - start) / 1e9)
+        else:
+            @wraps(func)
+            def timed(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    observe((perf_counter_ns() - start) / 1e9)
+        return timed
+
+
+class InProgress:
+    "Increments gauge while with-block or decorated call is running"
+    __slots__ = ('_inc', '_dec')
+
+    def __init__(self, inc: Callable[[], None], dec: Callable[[], None]):
+        self._inc = inc
+        self._dec = dec
+
+    def __enter__(self):
+        self._inc()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._dec()
+
+    def __call__(self, func):
+        inc, dec = self._inc, self._dec
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def tracked(*args, **kwargs):
+                inc()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    dec()
+        else:
+            @wraps(func)
+            def tracked(*args, **kwargs):
+                inc()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    dec()
+        return tracked
@@ -0,0 +1,180 @@
+import asyncio
+from datetime import timedelta
+from time import perf_counter
+
+import pytest
+from epimetheus.collector import (
+    counter_family, gauge_family, histogram_family)
+from epimetheus.metrics import Histogram
+from epimetheus.openmetrics import render_chunks
+from epimetheus.registry import Registry
+
+
+def queues():
+    family = gauge_family('queue_length', help='queue_length Queue length')
+    family.add(3, queue='a')
+    family.add(0, queue='b')
+    return [family]
+
+
+def test_sync_collector():
+    registry = Registry()
+    registry.counter(name='hits_total', use_clock=False).with_labels().inc()
+    registry.register_collector(queues)
+    assert list(registry.expose()) == [
+        '# TYPE hits_total counter',
+        'hits_total 1',
+        '',
+        '# HELP queue_length Queue length',
+        '# TYPE queue_length gauge',
+        'queue_length{queue="a"} 3',
+        'queue_length{queue="b"} 0',
+        '',
+    ]
+    assert registry.render() == '\n'.join(registry.expose()) + '\n'
+    assert ''.join(registry.render_chunks()) == registry.render()
+    assert 'queue_length{queue="a"} 3\n' in ''.join(render_chunks(registry))
+
+
+def test_family_of_metrics():
+    h = Histogram(buckets=[1])
+    h.observe(0.5)
+
+    def collect():
+        family = histogram_family('latency', labels={'app': 'x'})
+        family.add(h, url='/')
+        yield family
+
+    registry = Registry()
+    registry.register_collector(collect)
+    assert list(registry.expose()) == [
+        '# TYPE latency histogram',
+        'latency_bucket{app="x",url="/",le="1"} 1',
+        'latency_bucket{app="x",url="/",le="+Inf"} 0',
+        'latency_sum{app="x",url="/"} 0.5',
+        'latency_count{app="x",url="/"} 1',
+        '',
+    ]
+
+
+def probes_text(value):
+    return f'# TYPE probes_total counter\nprobes_total {value}\n\n'
+
+
+def test_ttl(freezer, mocker):
+    calls = mocker.Mock()
+
+    def collect():
+        calls()
+        family = counter_family('probes_total')
+        family.add(calls.call_count)
+        return [family]
+
+    registry = Registry()
+    collector = registry.register_collector(collect, ttl=60)
+    assert registry.render_state() is None
+    assert registry.render() == probes_text(1)
+    state = registry.render_state()
+    assert state is not None
+    freezer.tick(delta=timedelta(seconds=30))
+    assert registry.render() == probes_text(1)
+    assert registry.render_state() == state
+    assert calls.call_count == 1
+
+    freezer.tick(delta=timedelta(seconds=30))
+    assert registry.render_state() is None
+    assert registry.render() == probes_text(2)
+    assert calls.call_count == 2
+
+    registry.unregister_collector(collector)
+    assert registry.render() == ''
+
+
+def test_sync_collector_timeout():
+    with pytest.raises(ValueError):
+        Registry().register_collector(queues, timeout=1)
+
+
+def test_async_collectors():
+    async def slow_a():
+        await asyncio.sleep(0.05)
+        family = gauge_family('a')
+        family.add(1)
+        return [family]
+
+    async def slow_b():
+        await asyncio.sleep(0.05)
+        family = gauge_family('b')
+        family.add(2)
+        return [family]
+
+    async def stuck():
+        await asyncio.sleep(10)
+
+    registry = Registry()
+    registry.register_collector(slow_a, timeout=1)
+    registry.register_collector(slow_b)
+    registry.register_collector(stuck, timeout=0.05)
+    # not collected yet
+    assert registry.render() == ''
+
+    start = perf_counter()
+    asyncio.run(registry.collect_async())
+    # collectors ran concurrently
+    assert perf_counter() - start < 0.5
+    assert registry.render() == (
+        '# TYPE a gauge\na 1\n\n# TYPE b gauge\nb 2\n\n')
+    assert registry.render_state() is not None
+
+
+def test_async_collector_failures(caplog):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        family = gauge_family('flaky')
+        family.add(len(calls))
+        return [family]
+
+    async def broken():
+        raise RuntimeError('broken')
+
+    async def ok():
+        family = gauge_family('ok')
+        family.add(1)
+        return [family]
+
+    registry = Registry()
+    registry.register_collector(flaky, timeout=0.05, ttl=60)
+    registry.register_collector(broken, ttl=60)
+    registry.register_collector(ok)
+
+    asyncio.run(registry.collect_async())
+    # timed out and failed collectors give no samples
+    assert registry.render() == '# TYPE ok gauge\nok 1\n\n'
+    assert 'broken' in caplog.text
+    # timeout is not reused for ttl, collector runs again
+    asyncio.run(registry.collect_async())
+    assert registry.render() == (
+        '# TYPE flaky gauge\nflaky 2\n\n# TYPE ok gauge\nok 1\n\n')
+
+
+def test_sync_collector_failure(caplog):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('broken')
+        return queues()
+
+    registry = Registry()
+    registry.gauge(name='up', use_clock=False).with_labels().set(1)
+    registry.register_collector(flaky, ttl=60)
+    assert registry.render() == '# TYPE up gauge\nup 1\n\n'
+    assert 'broken' in caplog.text
+    # failure is not reused for ttl
+    assert 'queue_length' in registry.render()
+    assert len(calls) == 2
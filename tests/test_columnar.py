@@ -0,0 +1,88 @@
+import pytest
+from epimetheus.columnar import ColumnarHistogramGroup, HistogramBlock
+from epimetheus.registry import Registry
+from epimetheus.sample import SampleKey
+
+
+def test_block_rows():
+    block = HistogramBlock([2, 1])
+    assert block.buckets == (1, 2)
+    assert block.add_row() == 0
+    assert block.add_row() == 1
+    assert len(block) == 2
+    assert len(block.counts) == 6
+    assert list(block.row(1)) == [0, 0, 0]
+
+
+def test_same_output_as_histogram():
+    registry = Registry()
+    regular = registry.histogram(name='regular', buckets=[0.3, 0.6])
+    columnar = registry.histogram(
+        name='columnar', buckets=[0.3, 0.6], columnar=True)
+    assert isinstance(columnar, ColumnarHistogramGroup)
+
+    for labels in ({'x': 1}, {'x': 2}, {}):
+        for v in (0.5, 0.2, 0.11, -5, 26, 48, 0.6):
+            regular.with_labels(**labels).observe(v)
+            columnar.with_labels(**labels).observe(v)
+
+    def lines(group):
+        return [
+            line.replace('regular', 'columnar')
+            for line in group.expose()]
+
+    assert lines(columnar) == lines(regular)
+    assert columnar.render() == regular.render().replace(
+        'regular', 'columnar')
+
+
+def test_render_cache(mocker):
+    g = ColumnarHistogramGroup(key=SampleKey('h'), kwargs={'buckets': [1]})
+    a = g.with_labels(x='a')
+    b = g.with_labels(x='b')
+    g.render()
+
+    spy = mocker.spy(g, '_expose_item')
+    b.observe(3)
+    assert 'h_bucket{x="b",le="+Inf"} 1\n' in g.render()
+    assert spy.call_count == 1
+    assert not a._dirty
+
+
+def test_unsupported():
+    with pytest.raises(ValueError):
+        Registry().counter(name='c', columnar=True)
+    with pytest.raises(ValueError):
+        Registry(threadsafe=True).histogram(name='h', columnar=True)
+
+
+def test_observe_many():
+    g = ColumnarHistogramGroup(key=SampleKey('h'), kwargs={'buckets': [1]})
+    a = g.with_labels(x='a')
+    b = g.with_labels(x='b')
+    a.observe_many([0.5, 2, 3])
+    assert list(g.render().splitlines()) == [
+        '# TYPE h histogram',
+        'h_bucket{x="a",le="1"} 1',
+        'h_bucket{x="a",le="+Inf"} 2',
+        'h_sum{x="a"} 5.5',
+        'h_count{x="a"} 3',
+        'h_bucket{x="b",le="1"} 0',
+        'h_bucket{x="b",le="+Inf"} 0',
+        'h_sum{x="b"} 0.0',
+        'h_count{x="b"} 0',
+    ]
+    assert not b._dirty
+
+
+@pytest.mark.freeze_time('2020-01-01')
+def test_exemplars():
+    registry = Registry()
+    regular = registry.histogram(name='regular', buckets=[1])
+    columnar = registry.histogram(name='columnar', buckets=[1], columnar=True)
+    for h in (regular, columnar):
+        h.with_labels().observe(0.5, exemplar={'trace_id': 'x'})
+        h.with_labels().observe(2)
+    exemplars = columnar.with_labels()._exemplars
+    assert exemplars == regular.with_labels()._exemplars
+    assert exemplars[0] is not None
@@ -0,0 +1,204 @@
+import asyncio
+import zlib
+from datetime import timedelta
+
+import pytest
+from epimetheus.exposition import (
+    ENCODINGS, OPENMETRICS, PROTOBUF, TEXT, CompressedExposition,
+    choose_encoding, choose_format, write_async)
+from epimetheus.registry import Registry
+from epimetheus.sample import SampleKey
+
+
+def make_registry(series=100):
+    registry = Registry()
+    c = registry.counter(name='requests_total', use_clock=False)
+    h = registry.histogram(name='latency', buckets=[0.1, 1])
+    for i in range(series):
+        c.with_labels(url=f'/{i}').inc(i)
+        h.with_labels(url=f'/{i}').observe(i / 100)
+    return registry
+
+
+def decompress(encoding, data):
+    if encoding == 'gzip':
+        return zlib.decompress(data, 31)
+    import zstandard
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+class AsyncStream:
+    def __init__(self):
+        self.chunks = []
+
+    async def write(self, data):
+        self.chunks.append(data)
+
+
+class DrainedStream:
+    def __init__(self):
+        self.chunks = []
+        self.drained = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    async def drain(self):
+        self.drained += 1
+
+
+def test_write_async():
+    registry = make_registry()
+    stream = AsyncStream()
+    asyncio.run(write_async(registry, stream, chunk_size=1000))
+    assert len(stream.chunks) > 1
+    assert b''.join(stream.chunks).decode() == registry.render()
+
+
+def test_write_async_drain():
+    registry = make_registry()
+    stream = DrainedStream()
+    asyncio.run(write_async(registry, stream, chunk_size=1000))
+    assert stream.drained == len(stream.chunks) > 1
+    assert b''.join(stream.chunks).decode() == registry.render()
+
+
+def test_write_async_yields_to_loop():
+    registry = make_registry()
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0)
+
+    async def main():
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        before = len(ticks)
+        await write_async(registry, AsyncStream(), time_slice=0)
+        task.cancel()
+        return len(ticks) - before
+
+    # every rendered piece gave control back to the loop
+    assert asyncio.run(main()) > 100
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_compressed(encoding, mocker):
+    registry = make_registry()
+    compressed = CompressedExposition(registry, encoding)
+    payload = compressed.payload()
+    assert decompress(encoding, payload) == registry.render().encode()
+
+    spy = mocker.spy(registry, 'render_chunks')
+    assert compressed.payload() is payload
+    assert spy.call_count == 0
+
+    registry.get(SampleKey('requests_total')).with_labels(url='/1').inc()
+    payload = compressed.payload()
+    assert spy.call_count == 1
+    assert b'requests_total{url="/1"} 2\n' in decompress(encoding, payload)
+    assert compressed.payload() is payload
+
+
+def test_compressed_summary_is_not_cached():
+    registry = make_registry()
+    registry.summary(name='s', buckets=[0.5]).with_labels().observe(1)
+    compressed = CompressedExposition(registry)
+    assert compressed.payload() is not compressed.payload()
+
+
+def test_compressed_ttl_group():
+    registry = Registry()
+    c = registry.counter(name='jobs_total', use_clock=False, ttl=60)
+    c.with_labels().inc()
+    compressed = CompressedExposition(registry)
+    assert b'jobs_total 1\n' in decompress('gzip', compressed.payload())
+    c.with_labels().inc(5)
+    # other exposition consumes update flags of TTL group
+    list(registry.expose())
+    assert b'jobs_total 6\n' in decompress('gzip', compressed.payload())
+
+
+def test_compressed_ttl_expired(freezer):
+    registry = Registry()
+    c = registry.counter(name='jobs_total', use_clock=False, ttl=60)
+    c.with_labels(a='1').inc()
+    compressed = CompressedExposition(registry)
+    compressed.payload()
+    assert b'jobs_total{a="1"} 1\n' in decompress(
+        'gzip', compressed.payload())
+    freezer.tick(delta=timedelta(seconds=61))
+    assert b'jobs_total' not in decompress('gzip', compressed.payload())
+
+
+def test_compressed_unsupported():
+    with pytest.raises(ValueError):
+        CompressedExposition(Registry(), 'br')
+
+
+@pytest.mark.parametrize('header,result', (
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('deflate, gzip;q=1.0, *;q=0.5', 'gzip'),
+    ('gzip;q=0', None),
+    ('GZIP', 'gzip'),
+    ('*', ENCODINGS[0]),
+))
+def test_choose_encoding(header, result):
+    assert choose_encoding(header) == result
+
+
+def test_choose_zstd():
+    pytest.importorskip('zstandard')
+    assert choose_encoding('gzip, zstd') == 'zstd'
+    assert choose_encoding('gzip, zstd;q=0.5') == 'gzip'
+
+
+@pytest.mark.parametrize('header,result', (
+    (None, TEXT),
+    ('*/*', TEXT),
+    ('text/plain;version=0.0.4', TEXT),
+    ('application/json', TEXT),
+    (
+        'application/openmetrics-text;version=1.0.0,'
+        'application/openmetrics-text;version=0.0.1;q=0.75,'
+        'text/plain;version=0.0.4;q=0.5,*/*;q=0.1',
+        OPENMETRICS,
+    ),
+    (
+        'application/vnd.google.protobuf;'
+        'proto=io.prometheus.client.MetricFamily;encoding=delimited;q=0.7,'
+        'text/plain;version=0.0.4;q=0.3,*/*;q=0.2',
+        PROTOBUF,
+    ),
+    ('application/vnd.google.protobuf;encoding=text', TEXT),
+    ('application/openmetrics-text;q=0.2, text/plain', TEXT),
+))
+def test_choose_format(header, result):
+    assert choose_format(header) is result
+
+
+def test_choose_format_multiprocess(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    assert choose_format('application/openmetrics-text', registry) is TEXT
+
+
+def test_write_async_protobuf():
+    registry = make_registry()
+    stream = AsyncStream()
+    asyncio.run(write_async(
+        registry, stream, chunk_size=1000, format=PROTOBUF))
+    assert b''.join(stream.chunks) == b''.join(
+        PROTOBUF.chunks(registry))
+
+
+def test_compressed_openmetrics():
+    registry = make_registry()
+    compressed = CompressedExposition(registry, format=OPENMETRICS)
+    text = decompress('gzip', compressed.payload()).decode()
+    assert text.endswith('# EOF\n')
+    assert 'requests_created{url="/1"}' in text
@@ -1,7 +1,13 @@
+from array import array
 from datetime import timedelta
 
-from epimetheus.metrics import Counter, Gauge, Group, Histogram, Summary
-from epimetheus.sample import SampleKey
+import pytest
+from epimetheus import metrics
+from epimetheus.metrics import (
+    DEFAULT_BUCKETS, Counter, Gauge, Group, Histogram, NativeHistogram,
+    Summary, exponential_buckets, linear_buckets, native_bucket_index)
+from epimetheus.quantile import ckms
+from epimetheus.sample import SampleKey, SampleValue
 
 
 def test_counter(frozen_sample_time):
@@ -147,6 +153,180 @@ def test_histogram():
     ]
 
 
+def test_histogram_bucket_bounds():
+    h = Histogram(buckets=[1, 2, 3])
+    for v in (0, 1, 1.5, 2, 3, 3.01):
+        h.observe(v)
+    assert h._bcounts == [2, 2, 1, 1]
+
+
+def test_bound_labels():
+    # int and float bounds give same labels
+    h = Group(key=SampleKey('h'), mcls=Histogram, kwargs={
+        'buckets': [0.5, 1.0, 2, 1e20]})
+    h.with_labels().observe(1)
+    assert [line.split()[0] for line in h.expose()][1:5] == [
+        'h_bucket{le="0.5"}', 'h_bucket{le="1"}', 'h_bucket{le="2"}',
+        'h_bucket{le="1e+20"}']
+    s = Group(key=SampleKey('s'), mcls=Summary, kwargs={
+        'buckets': [0.5, 1.0]})
+    s.with_labels().observe(1)
+    assert [line.split()[0] for line in s.expose()][1:3] == [
+        's{quantile="0.5"}', 's{quantile="1"}']
+
+
+def test_histogram_default_buckets():
+    h = Histogram()
+    assert h.buckets == DEFAULT_BUCKETS
+    assert len(h._bcounts) == len(DEFAULT_BUCKETS) + 1
+
+
+def test_bucket_generators():
+    assert linear_buckets(1, 2, 4) == (1, 3, 5, 7)
+    assert exponential_buckets(1, 2, 4) == (1, 2, 4, 8)
+    with pytest.raises(ValueError):
+        linear_buckets(1, 2, 0)
+    with pytest.raises(ValueError):
+        exponential_buckets(0, 2, 3)
+    with pytest.raises(ValueError):
+        exponential_buckets(1, 1, 3)
+
+
+@pytest.fixture(params=['numpy', 'pure'])
+def numpy_or_pure(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr('epimetheus.metrics.numpy', None)
+
+
+@pytest.mark.usefixtures('numpy_or_pure')
+def test_histogram_observe_many():
+    values = [0.5, 0.2, 0.11, -5, 26, 48, 0.3, 0.6, 0.61]
+    a = Histogram(buckets=[0.3, 0.6])
+    b = Histogram(buckets=[0.3, 0.6])
+    for v in values:
+        a.observe(v)
+    b.observe_many(values)
+    b.observe_many(iter([]))
+    assert b._bcounts == a._bcounts == [4, 2, 3]
+    assert b._count == a._count
+    assert abs(b._sum - a._sum) < 1e-9
+
+
+def test_histogram_observe_many_arrays():
+    numpy = pytest.importorskip('numpy')
+    h = Histogram(buckets=[1, 2])
+    h.observe_many(numpy.array([0.5, 1.5, 2.5, 3]))
+    h.observe_many(array('d', [1, 2]))
+    assert h._bcounts == [2, 2, 2]
+    assert h._sum == 10.5
+
+
+@pytest.mark.parametrize('schema', (3, 1, 0, -1, -4))
+def test_native_bucket_index(schema):
+    base = 2 ** 2 ** -schema
+    for v in (1e-6, 0.3, 1, 1.01, 2, 3, 4, 5, 123.4, 2 ** 20):
+        index = native_bucket_index(v, schema)
+        assert base ** (index - 1) < v <= base ** index * (1 + 1e-12)
+    if schema >= 0:
+        # powers of two are upper bounds of buckets
+        assert native_bucket_index(2, schema) == 2 ** schema
+
+
+def test_native_histogram():
+    g = Group(
+        key=SampleKey('name'),
+        mcls=NativeHistogram,
+        kwargs={'schema': 0},
+    )
+    h = g.with_labels()
+    for v in (0.5, 1, 1.5, 3, 0, -2, float('nan')):
+        h.observe(v)
+    assert h._positive == {-1: 1, 0: 1, 1: 1, 2: 1}
+    assert h._negative == {1: 1}
+    assert h._zero_count == 1
+    assert h._count == 7
+
+    # buckets are exposed in protobuf format only
+    h = g.with_labels(a='b')
+    h.observe(2)
+    assert list(g.expose()) == [
+        '# TYPE name histogram',
+        'name_bucket{le="+Inf"} 7',
+        'name_sum Nan',
+        'name_count 7',
+        'name_bucket{a="b",le="+Inf"} 1',
+        'name_sum{a="b"} 2',
+        'name_count{a="b"} 1',
+    ]
+
+
+def test_native_histogram_infinities():
+    h = NativeHistogram(schema=3)
+    h.observe(float('inf'))
+    h.observe(float('-inf'))
+    h.observe(1)
+    # only finite values get buckets
+    assert h.buckets_snapshot() == (3, 0, {0: 1}, {})
+    assert h._count == 3
+    with pytest.raises(ValueError):
+        native_bucket_index(float('inf'), 3)
+
+
+def test_native_histogram_exemplar_ignored():
+    h = NativeHistogram(schema=0)
+    h.observe(1, exemplar={'trace_id': 'x'})
+    assert h.buckets_snapshot() == (0, 0, {0: 1}, {})
+
+
+def test_native_histogram_resolution():
+    h = NativeHistogram(schema=2, max_buckets=4)
+    for v in (1, 1.1, 1.3, 1.6, 1.9):
+        h.observe(v)
+    assert h.schema == 1
+    assert h._positive == {0: 1, 1: 2, 2: 2}
+    h.observe(100)
+    assert h.schema == 1
+    h.observe(1000)
+    assert h.schema == 0
+    assert h._positive == {0: 1, 1: 4, 7: 1, 10: 1}
+    assert h._count == 7
+
+    for v in range(1, 100):
+        h.observe(2 ** v)
+    # can't go below lowest resolution
+    assert h.schema == -4
+    assert sum(h._positive.values()) == h._count
+
+
+@pytest.mark.parametrize('kwargs', (
+    {'schema': 9},
+    {'schema': -5},
+    {'max_buckets': 0},
+    {'zero_threshold': -1},
+))
+def test_native_histogram_invalid(kwargs):
+    with pytest.raises(ValueError):
+        NativeHistogram(**kwargs)
+
+
+@pytest.mark.usefixtures('numpy_or_pure')
+@pytest.mark.parametrize('kwargs', (
+    {},
+    {'age_buckets': 2},
+    {'estimator': ckms(0.01)},
+))
+def test_summary_observe_many(kwargs):
+    values = [20, 30, 50, 10]
+    a = Summary(buckets=[0, 0.5, 1], **kwargs)
+    b = Summary(buckets=[0, 0.5, 1], **kwargs)
+    for v in values:
+        a.observe(v)
+    b.observe_many(values)
+    assert list(b.sample_values()) == list(a.sample_values())
+
+
 def test_summary(freezer):
     g = Group(
         key=SampleKey('name'),
@@ -200,6 +380,124 @@ def test_summary(freezer):
     assert list(g.expose()) == []
 
 
+def test_summary_estimator(freezer):
+    g = Group(
+        key=SampleKey('name'),
+        mcls=Summary,
+        kwargs={
+            'buckets': [0, 0.5, 1],
+            'time_window': 60,
+            'estimator': ckms(0.01),
+        },
+    )
+    s = g.with_labels()
+
+    assert list(g.expose()) == []
+
+    for v in (20, 30, 50):
+        s.observe(v)
+    assert list(g.expose()) == [
+        '# TYPE name summary',
+        'name{quantile="0"} 20',
+        'name{quantile="0.5"} 30',
+        'name{quantile="1"} 50',
+        'name_sum 100',
+        'name_count 3',
+    ]
+
+    freezer.tick(delta=timedelta(seconds=30))
+    s.observe(10)
+    assert list(g.expose())[-1] == 'name_count 4'
+
+    # sketch is restarted when window passes
+    freezer.tick(delta=timedelta(seconds=30))
+    assert list(g.expose()) == []
+
+
+def test_summary_age_buckets(freezer):
+    g = Group(
+        key=SampleKey('name'),
+        mcls=Summary,
+        kwargs={'buckets': [0.5], 'time_window': 60, 'age_buckets': 3},
+    )
+    s = g.with_labels()
+
+    s.observe(20)  # age 0..20
+    freezer.tick(delta=timedelta(seconds=20))
+    list(g.expose())
+    s.observe(30)  # age 20..40
+    freezer.tick(delta=timedelta(seconds=20))
+    list(g.expose())
+    s.observe(50)  # age 40..60
+    assert list(g.expose()) == [
+        '# TYPE name summary',
+        'name{quantile="0.5"} 30.0',
+        'name_sum 100.0',
+        'name_count 3',
+    ]
+
+    # whole oldest age is dropped
+    freezer.tick(delta=timedelta(seconds=25))
+    assert list(g.expose()) == [
+        '# TYPE name summary',
+        'name{quantile="0.5"} 40.0',
+        'name_sum 80.0',
+        'name_count 2',
+    ]
+
+    freezer.tick(delta=timedelta(seconds=300))
+    assert list(g.expose()) == []
+
+
+def test_summary_age_buckets_estimator(freezer):
+    g = Group(
+        key=SampleKey('name'),
+        mcls=Summary,
+        kwargs={
+            'buckets': [0.5],
+            'time_window': 60,
+            'age_buckets': 2,
+            'estimator': ckms(0.01),
+        },
+    )
+    s = g.with_labels()
+
+    s.observe(10)
+    freezer.tick(delta=timedelta(seconds=30))
+    list(g.expose())
+    s.observe(20)
+    s.observe(30)
+    assert list(g.expose())[-2:] == ['name_sum 60', 'name_count 3']
+
+    freezer.tick(delta=timedelta(seconds=30))
+    assert list(g.expose()) == [
+        '# TYPE name summary',
+        'name{quantile="0.5"} 20',
+        'name_sum 50',
+        'name_count 2',
+    ]
+
+
+def test_summary_age_buckets_skip_clock(mocker):
+    s = Summary(buckets=[0.5], age_buckets=4)
+    clock = mocker.patch('epimetheus.metrics.clock', return_value=0)
+    for v in range(1000):
+        s.observe(v)
+    # observe compares monotonic time with next rotation deadline
+    assert clock.call_count == 0
+
+
+def test_summary_age_buckets_unscraped(freezer):
+    s = Summary(buckets=[0.5], time_window=60, age_buckets=3)
+    s.observe(1)
+    # no observations nor scrapes for longer than time window
+    freezer.tick(delta=timedelta(seconds=90))
+    s.observe(2)
+    freezer.tick(delta=timedelta(seconds=5))
+    s.observe(3)
+    assert [v.value for v in s.sample_values()] == [2.5, 5, 2]
+
+
 def test_group_caching():
     g = Group(
         key=SampleKey('name'),
@@ -210,6 +508,235 @@ def test_group_caching():
     assert g.with_labels() is not g.with_labels(lol=3)
 
 
+def test_group_fast_lookup(mocker):
+    g = Group(
+        key=SampleKey('name'),
+        mcls=Counter,
+    )
+    c = g.with_labels(a=1, b='x')
+    assert g.with_labels(b='x', a=1) is c
+    assert g.with_labels(a='1', b='x') is c
+    assert g.with_labels(a=1.0, b='x') is not c
+    assert len(g._items) == 2
+
+    spy = mocker.spy(SampleKey, 'with_labels')
+    assert g.with_labels(a=1, b='x') is c
+    assert g.with_labels(b='x', a=1) is c
+    assert spy.call_count == 0
+
+
+def test_group_inc_many():
+    g = Group(
+        key=SampleKey('name'),
+        mcls=Counter,
+        kwargs={'use_clock': False},
+    )
+    g.inc_many({
+        (('url', '/'), ('code', 200)): 3,
+        (('url', '/'), ('code', 404)): 1,
+    })
+    g.inc_many([((('url', '/'), ('code', 200)), 2)])
+    assert list(g.expose()) == [
+        '# TYPE name counter',
+        'name{url="/",code="200"} 5',
+        'name{url="/",code="404"} 1',
+    ]
+
+
+@pytest.mark.parametrize('help, text', (
+    ('name Some help', 'Some help'),
+    ('Some help', 'Some help'),
+    ('name', ''),
+    ('names help', 'names help'),
+    (None, None),
+))
+def test_group_help_text(help, text):
+    g = Group(key=SampleKey('name'), mcls=Counter, help=help)
+    assert g.help_text() == text
+
+
+def test_group_constant_labels():
+    g = Group(
+        key=SampleKey('name', {'app': 'x'}),
+        mcls=Histogram,
+        kwargs={'buckets': [1]},
+    )
+    g.with_labels().observe(1)
+    g.with_labels(url='/').observe(2)
+    assert list(g.expose())[1:] == [
+        'name_bucket{app="x",le="1"} 1',
+        'name_bucket{app="x",le="+Inf"} 0',
+        'name_sum{app="x"} 1',
+        'name_count{app="x"} 1',
+        'name_bucket{app="x",url="/",le="1"} 0',
+        'name_bucket{app="x",url="/",le="+Inf"} 1',
+        'name_sum{app="x",url="/"} 2',
+        'name_count{app="x",url="/"} 1',
+    ]
+
+
+def counter_group(**kwargs):
+    return Group(
+        key=SampleKey('name'),
+        mcls=Counter,
+        kwargs={'use_clock': False},
+        **kwargs,
+    )
+
+
+def test_group_max_series_drop():
+    g = counter_group(max_series=2)
+    g.with_labels(url='/a').inc()
+    g.with_labels(url='/b').inc()
+    g.with_labels(url='/c').inc()
+    g.with_labels(url='/d').inc()
+    assert g.with_labels(url='/c') is g.with_labels(url='/d')
+    assert list(g.expose()) == [
+        '# TYPE name counter',
+        'name{url="/a"} 1',
+        'name{url="/b"} 1',
+    ]
+    assert len(g._fast_items) == 2
+
+
+def test_group_max_series_fold():
+    g = counter_group(max_series=1, overflow='fold')
+    g.with_labels(url='/a', code=200).inc()
+    g.with_labels(url='/b', code=200).inc()
+    g.with_labels(url='/c', code=404).inc(2)
+    assert list(g.expose()) == [
+        '# TYPE name counter',
+        'name{url="/a",code="200"} 1',
+        'name{url="__overflow__",code="__overflow__"} 3',
+    ]
+
+
+@pytest.mark.parametrize('kwargs', (
+    {'max_series': 0},
+    {'overflow': 'other'},
+    {'ttl': 0},
+))
+def test_group_invalid_limits(kwargs):
+    with pytest.raises(ValueError):
+        counter_group(**kwargs)
+
+
+def test_group_remove():
+    g = counter_group()
+    a = g.with_labels(url='/a')
+    g.with_labels(url='/b').inc()
+    a.inc()
+    assert g.render() == (
+        '# TYPE name counter\nname{url="/a"} 1\nname{url="/b"} 1\n')
+
+    g.remove(url='/a')
+    g.remove(url='/none')
+    assert g.render() == '# TYPE name counter\nname{url="/b"} 1\n'
+    assert len(g._fast_items) == 1
+    assert g.with_labels(url='/a') is not a
+
+    g.clear()
+    assert g.render() == ''
+    assert not g._fast_items and not g._render_cache
+
+
+def test_group_ttl(freezer):
+    g = counter_group(ttl=60)
+    a = g.with_labels(url='/a')
+    b = g.with_labels(url='/b')
+    freezer.tick(delta=timedelta(seconds=40))
+    a.inc()
+    assert len(list(g.expose())) == 3
+    freezer.tick(delta=timedelta(seconds=30))
+    # b was never updated
+    assert list(g.expose()) == ['# TYPE name counter', 'name{url="/a"} 1']
+    b.inc()
+    assert g.with_labels(url='/b') is not b
+    freezer.tick(delta=timedelta(seconds=50))
+    a.inc()
+    assert g.render() == (
+        '# TYPE name counter\nname{url="/a"} 2\nname{url="/b"} 0\n')
+    freezer.tick(delta=timedelta(seconds=15))
+    assert g.render() == '# TYPE name counter\nname{url="/a"} 2\n'
+
+
+def test_group_labelnames(mocker):
+    g = Group(
+        key=SampleKey('name', {'app': 'x'}),
+        mcls=Counter,
+        kwargs={'use_clock': False},
+        labelnames=('url', 'code'),
+    )
+    c = g.labels('/', 200)
+    assert g.labels('/', '200') is c
+    assert g.with_labels(code=200, url='/') is c
+    g.with_labels(code=404, url='/').inc(2)
+    c.inc()
+
+    spy = mocker.spy(SampleKey, '__init__')
+    assert g.labels('/', 404) is g.with_labels(url='/', code=404)
+    g.labels('/"a"', 500).inc()
+    assert spy.call_count == 0
+    assert list(g.expose()) == [
+        '# TYPE name counter',
+        'name{app="x",url="/",code="200"} 1',
+        'name{app="x",url="/",code="404"} 2',
+        'name{app="x",url="/\\"a\\"",code="500"} 1',
+    ]
+    # compiled keys are equal to regular ones
+    assert g._items[SampleKey(
+        'name', {'code': 500, 'app': 'x', 'url': '/"a"'})]._count == 1
+
+    g.remove(url='/', code=200)
+    assert g.labels('/', 200) is not c
+    with pytest.raises(ValueError):
+        g.labels('/')
+    with pytest.raises(ValueError):
+        g.with_labels(url='/')
+    with pytest.raises(ValueError):
+        g.with_labels(url='/', code=200, method='GET')
+
+
+def test_group_labelnames_overflow():
+    g = counter_group(max_series=1, labelnames=('url', ))
+    g.labels('/a').inc()
+    g.labels('/b').inc()
+    g.labels('/b').inc()
+    assert list(g.expose()) == ['# TYPE name counter', 'name{url="/a"} 1']
+    assert len(g._positional) == 1
+
+
+def test_group_without_labelnames():
+    g = counter_group(labelnames=())
+    assert g.labels() is g.with_labels()
+    g.labels().inc()
+    assert list(g.expose()) == ['# TYPE name counter', 'name 1']
+    with pytest.raises(ValueError):
+        counter_group().labels('/')
+
+
+@pytest.mark.parametrize('mcls, labelnames', (
+    (Counter, ('url', 'url')),
+    (Counter, ('app', )),
+    (Counter, ('__name', )),
+    (Counter, ('1st', )),
+    (Histogram, ('le', )),
+    (Summary, ('url', 'quantile')),
+))
+def test_group_invalid_labelnames(mcls, labelnames):
+    with pytest.raises(ValueError):
+        Group(
+            key=SampleKey('name', {'app': 'x'}), mcls=mcls,
+            labelnames=labelnames)
+
+
+def test_group_reserved_labels():
+    g = Group(key=SampleKey('name'), mcls=Histogram)
+    with pytest.raises(ValueError):
+        g.with_labels(le='1')
+    assert not g._items
+
+
 def test_counter_without_clock():
     g = Group(
         key=SampleKey('name'),
@@ -301,3 +828,59 @@ def test_gauge_set_with_timestamp():
         '# TYPE name gauge',
         'name 3 5000',
     ]
+
+
+def test_exemplars(frozen_sample_time):
+    c = Counter(use_clock=False)
+    c.inc(2, exemplar={'trace_id': 'abc'})
+    c.inc()
+    assert c._exemplar == ({'trace_id': 'abc'}, 2, frozen_sample_time / 1000)
+    assert c._created == frozen_sample_time / 1000
+
+    h = Histogram(buckets=[1, 2])
+    h.observe(0.5)
+    assert h._exemplars is None
+    h.observe(1.5, exemplar={'id': 1})
+    assert h._exemplars == [
+        None, ({'id': '1'}, 1.5, frozen_sample_time / 1000), None]
+
+    with pytest.raises(ValueError):
+        c.inc(exemplar={'trace_id': 'x' * 121})
+    with pytest.raises(ValueError):
+        c.inc(exemplar={'trace id': 'x'})
+
+
+def test_lazy_timestamps(ts_freezer, mocker):
+    c = Counter(timestamps='lazy')
+    ts_freezer.tick(delta=timedelta(seconds=10))
+    clock = mocker.spy(metrics, 'clock')
+    c.inc()
+    c.inc()
+    assert clock.call_count == 0
+    assert list(c.sample_values()) == [SampleValue(2, ts_freezer.get_ts())]
+    ts_freezer.tick(delta=timedelta(seconds=10))
+    # not changed since previous exposition
+    assert list(c.sample_values()) == [
+        SampleValue(2, ts_freezer.get_ts() - 10000)]
+    assert clock.call_count == 1
+
+    g = Gauge(timestamps='lazy')
+    g.set(3)
+    g.set_with_timestamp(4, 5000)
+    assert list(g.sample_values()) == [SampleValue(4, 5000)]
+
+
+def test_coarse_timestamps(mocker):
+    start = mocker.patch.object(metrics.COARSE_CLOCK, 'start')
+    mocker.patch.object(metrics.COARSE_CLOCK, 'now', 12345)
+    clock = mocker.spy(metrics, 'clock')
+    g = Gauge(timestamps='coarse')
+    g.set(3)
+    assert start.call_count == 1
+    assert clock.call_count == 0
+    assert list(g.sample_values()) == [SampleValue(3, 12345)]
+
+
+def test_invalid_timestamps():
+    with pytest.raises(ValueError):
+        Counter(timestamps='other')
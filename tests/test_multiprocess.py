@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+
+import pytest
+from epimetheus.multiprocess import MmapedValues, collect, mark_process_dead
+from epimetheus.registry import Registry
+
+
+def _define(registry):
+    return (
+        registry.counter(name='requests_total', help='requests_total Total'),
+        registry.gauge(name='workers', multiprocess_mode='sum'),
+        registry.gauge(name='peak', multiprocess_mode='max'),
+        registry.histogram(name='latency', buckets=[1]),
+    )
+
+
+def _worker(path, n):
+    c, workers, peak, h = _define(Registry(multiprocess_dir=path))
+    c.with_labels(code=200).inc(n)
+    workers.with_labels().inc()
+    peak.with_labels().set(n)
+    h.with_labels().observe(n / 2)
+
+
+def test_workers_are_merged(tmp_path):
+    path = str(tmp_path)
+    registry = Registry(multiprocess_dir=path)
+    _define(registry)
+
+    ctx = multiprocessing.get_context('fork')
+    for n in (1, 2, 3):
+        p = ctx.Process(target=_worker, args=(path, n))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+
+    assert list(registry.expose()) == [
+        '# HELP requests_total Total',
+        '# TYPE requests_total counter',
+        'requests_total{code="200"} 6.0',
+        '',
+        '# TYPE workers gauge',
+        'workers 3.0',
+        '',
+        '# TYPE peak gauge',
+        'peak 3.0',
+        '',
+        '# TYPE latency histogram',
+        'latency_bucket{le="1"} 2.0',
+        'latency_bucket{le="+Inf"} 1.0',
+        'latency_sum 3.0',
+        'latency_count 3.0',
+        '',
+    ]
+    assert registry.render() == '\n'.join(registry.expose()) + '\n'
+
+
+def test_forked_child_uses_own_file(tmp_path):
+    path = str(tmp_path)
+    registry = Registry(multiprocess_dir=path)
+    c = registry.counter(name='c').with_labels()
+    c.inc(5)
+
+    pid = os.fork()
+    if pid == 0:
+        c.inc()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert sorted(os.listdir(path)) == sorted([
+        f'counter_{os.getpid()}.db', f'counter_{pid}.db'])
+    assert next(c.sample_values()).value == 5
+    assert collect(path) == {'c': ('counter', {'c': 6})}
+
+
+def test_gauge_modes(tmp_path):
+    path = str(tmp_path)
+    dead_pid = 2 ** 22 + 1
+    for kind in ('gauge_sum', 'gauge_max', 'gauge_min', 'gauge_live'):
+        for pid, value in ((os.getpid(), 2), (dead_pid, 5)):
+            f = MmapedValues(os.path.join(path, f'{kind}_{pid}.db'))
+            f.write(f.allocate(f'{kind}\0{kind}'), value)
+            f.close()
+
+    assert {k: v[k] for k, (_, v) in collect(path).items()} == {
+        'gauge_sum': 7,
+        'gauge_max': 5,
+        'gauge_min': 2,
+        'gauge_live': 2,
+    }
+
+    mark_process_dead(path, os.getpid())
+    assert 'gauge_live' not in collect(path)
+
+
+def test_values_file_reopen_and_grow(tmp_path):
+    fpath = str(tmp_path / 'counter_1.db')
+    f = MmapedValues(fpath)
+    offsets = [f.allocate(f'key{i}' * 20) for i in range(2000)]
+    for i, offset in enumerate(offsets):
+        f.add(offset, i)
+    f.close()
+
+    f = MmapedValues(fpath)
+    assert f.allocate('key5' * 20) == offsets[5]
+    assert f.read(offsets[5]) == 5
+    assert len(list(MmapedValues.read_file(fpath))) == 2000
+
+
+def test_unsupported(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        registry.summary(name='s', buckets=[0.5])
+    with pytest.raises(ValueError):
+        Registry(multiprocess_dir=str(tmp_path), threadsafe=True)
+    with pytest.raises(ValueError):
+        registry.gauge(name='g', multiprocess_mode='avg').with_labels()
+    with pytest.raises(ValueError):
+        registry.gauge(name='t', ttl=60)
+    g = registry.gauge(name='g2')
+    with pytest.raises(TypeError):
+        g.with_labels().set_with_timestamp(1, 1000)
+    with pytest.raises(ValueError):
+        g.remove()
+    with pytest.raises(ValueError):
+        g.clear()
+
+
+def test_mode_ignored_without_multiprocess():
+    Registry().gauge(name='g', multiprocess_mode='max').with_labels()
+
+
+def test_histogram_observe_many(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    h = registry.histogram(name='h', buckets=[1]).with_labels()
+    h.observe_many([0.5, 2, 3])
+    assert [v.value for v in h.sample_values()] == [1, 2, 5.5, 3]
+
+
+def test_exemplars_ignored(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    c = registry.counter(name='c').with_labels()
+    c.inc(2, exemplar={'trace_id': 'x'})
+    h = registry.histogram(name='h', buckets=[1]).with_labels()
+    h.observe(0.5, exemplar={'trace_id': 'x'})
+    assert [v.value for v in c.sample_values()] == [2]
+    assert [v.value for v in h.sample_values()] == [1, 0, 0.5, 1]
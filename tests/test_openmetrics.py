@@ -0,0 +1,77 @@
+import pytest
+from epimetheus.openmetrics import format_value, render_chunks
+from epimetheus.registry import Registry
+
+
+@pytest.mark.freeze_time('2020-01-01')
+def test_render():
+    registry = Registry()
+    c = registry.counter(
+        name='requests_total', help='requests_total Total "requests"',
+        use_clock=False)
+    c.with_labels(url='/').inc(2, exemplar={'trace_id': 'abc'})
+    h = registry.histogram(name='latency', buckets=[0.1, 1])
+    h.with_labels().observe(0.05, exemplar={'trace_id': 'x'})
+    h.with_labels().observe(3)
+    registry.gauge(name='temp').with_labels().set(1.5)
+    registry.summary(name='size', buckets=[0.5])
+
+    assert ''.join(render_chunks(registry)) == '\n'.join((
+        '# HELP requests Total \\"requests\\"',
+        '# TYPE requests counter',
+        'requests_total{url="/"} 2 # {trace_id="abc"} 2 1577836800.0',
+        'requests_created{url="/"} 1577836800.0',
+        '# TYPE latency histogram',
+        'latency_bucket{le="0.1"} 1 # {trace_id="x"} 0.05 1577836800.0',
+        'latency_bucket{le="1.0"} 1',
+        'latency_bucket{le="+Inf"} 2',
+        'latency_count 2',
+        'latency_sum 3.05',
+        'latency_created 1577836800.0',
+        '# TYPE temp gauge',
+        'temp 1.5 1577836800.0',
+        '# EOF',
+        '',
+    ))
+
+
+@pytest.mark.freeze_time('2020-01-01')
+def test_render_summary():
+    registry = Registry()
+    s = registry.summary(name='size', buckets=[0.5, 1])
+    s.with_labels(a='x').observe(3)
+    assert ''.join(render_chunks(registry)) == '\n'.join((
+        '# TYPE size summary',
+        'size{a="x",quantile="0.5"} 3',
+        'size{a="x",quantile="1.0"} 3',
+        'size_count{a="x"} 1',
+        'size_sum{a="x"} 3',
+        'size_created{a="x"} 1577836800.0',
+        '# EOF',
+        '',
+    ))
+
+
+def test_counter_without_total_suffix():
+    registry = Registry()
+    registry.counter(name='hits', use_clock=False).with_labels().inc()
+    text = ''.join(render_chunks(registry))
+    assert '# TYPE hits counter\nhits_total 1\n' in text
+
+
+@pytest.mark.parametrize('value,result', (
+    (1, '1'),
+    (1.0, '1.0'),
+    (0.25, '0.25'),
+    (float('inf'), '+Inf'),
+    (float('-inf'), '-Inf'),
+    (float('nan'), 'NaN'),
+))
+def test_format_value(value, result):
+    assert format_value(value) == result
+
+
+def test_multiprocess(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        list(render_chunks(registry))
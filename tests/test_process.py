@@ -0,0 +1,87 @@
+import asyncio
+import gc
+
+import pytest
+from epimetheus.process import ProcessCollector
+from epimetheus.registry import Registry
+
+STAT = (
+    b'123 (my (odd) name) S 1 123 123 0 -1 4194304 82 0 0 0 '
+    b'250 150 0 0 20 0 1 0 5000 2703360 307 18446744073709551615 0\n')
+
+
+@pytest.fixture
+def proc(tmp_path):
+    (tmp_path / 'self' / 'fd').mkdir(parents=True)
+    for fd in range(3):
+        (tmp_path / 'self' / 'fd' / str(fd)).touch()
+    (tmp_path / 'self' / 'stat').write_bytes(STAT)
+    (tmp_path / 'stat').write_bytes(b'cpu  1 2 3\nbtime 1000000\n')
+    return tmp_path
+
+
+@pytest.fixture
+def process_collector(proc, mocker):
+    sysconf = {'SC_CLK_TCK': 100, 'SC_PAGE_SIZE': 4096}
+    mocker.patch('os.sysconf', side_effect=sysconf.__getitem__)
+    c = ProcessCollector(proc=str(proc))
+    yield c
+    c.close()
+
+
+def lines(c):
+    registry = Registry()
+    registry.register_collector(c)
+    return list(registry.expose())
+
+
+def test_process_metrics(process_collector):
+    result = lines(process_collector)
+    for line in (
+        'process_cpu_seconds_total 4.0',
+        'process_virtual_memory_bytes 2703360',
+        f'process_resident_memory_bytes {307 * 4096}',
+        'process_start_time_seconds 1000050.0',
+        'process_open_fds 3',
+    ):
+        assert line in result
+    assert any(line.startswith('process_max_fds ') for line in result)
+
+
+def test_gc_metrics(process_collector):
+    gc.collect()
+    result = lines(process_collector)
+    assert any(
+        line.startswith('python_gc_collections_total{generation="2"} ')
+        for line in result)
+    count = next(
+        line for line in result
+        if line.startswith('python_gc_duration_seconds_count{generation="2"}'))
+    assert int(count.split()[-1]) >= 1
+
+    process_collector.close()
+    assert process_collector._gc_callback not in gc.callbacks
+
+
+def test_without_procfs(tmp_path):
+    c = ProcessCollector(proc=str(tmp_path))
+    try:
+        result = lines(c)
+    finally:
+        c.close()
+    assert not any(line.startswith('process_') for line in result)
+    assert '# TYPE python_gc_collections_total counter' in result
+
+
+def test_loop_lag(process_collector):
+    async def main():
+        process_collector.monitor_loop(interval=0.01)
+        await asyncio.sleep(0.05)
+        process_collector.close()
+
+    asyncio.run(main())
+    result = lines(process_collector)
+    (lag, ) = [
+        line for line in result
+        if line.startswith('python_asyncio_loop_lag_seconds ')]
+    assert float(lag.split()[1]) >= 0
@@ -0,0 +1,164 @@
+import struct
+
+import pytest
+from epimetheus.protobuf import encode_chunks
+from epimetheus.registry import Registry
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        shift += 7
+        if b < 0x80:
+            return result, pos
+
+
+def parse(data):
+    "Message as {field number: [values]}, nested messages stay bytes"
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        tag, pos = read_varint(data, pos)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            (value, ) = struct.unpack_from('<d', data, pos)
+            pos += 8
+        else:
+            size, pos = read_varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def families(registry):
+    data = b''.join(encode_chunks(registry))
+    result = []
+    pos = 0
+    while pos < len(data):
+        size, pos = read_varint(data, pos)
+        result.append(parse(data[pos:pos + size]))
+        pos += size
+    return result
+
+
+def labels(metric):
+    return {
+        parse(p)[1][0].decode(): parse(p)[2][0].decode()
+        for p in metric.get(1, [])}
+
+
+@pytest.mark.freeze_time('2020-01-01')
+def test_counter():
+    registry = Registry()
+    c = registry.counter(name='requests_total', help='requests_total Total')
+    c.with_labels(url='/').inc(2, exemplar={'trace_id': 'abc'})
+
+    (family, ) = families(registry)
+    assert family[1] == [b'requests_total']
+    assert family[2] == [b'Total']
+    assert family[3] == [0]
+    (metric, ) = map(parse, family[4])
+    assert labels(metric) == {'url': '/'}
+    assert metric[6] == [1577836800000]
+    counter = parse(metric[3][0])
+    assert counter[1] == [2]
+    exemplar = parse(counter[2][0])
+    assert labels(exemplar) == {'trace_id': 'abc'}
+    assert exemplar[2] == [2]
+    assert parse(counter[3][0]) == {1: [1577836800], 2: [0]}
+
+
+def test_gauge():
+    registry = Registry()
+    registry.gauge(name='temp', use_clock=False).with_labels().set(-1.5)
+    (family, ) = families(registry)
+    assert family[3] == [1]
+    (metric, ) = map(parse, family[4])
+    assert 6 not in metric
+    assert parse(metric[2][0]) == {1: [-1.5]}
+
+
+def test_histogram():
+    registry = Registry()
+    h = registry.histogram(name='latency', buckets=[0.1, 1])
+    for v in (0.05, 0.5, 3):
+        h.with_labels().observe(v)
+
+    (family, ) = families(registry)
+    assert family[3] == [4]
+    (metric, ) = map(parse, family[4])
+    histogram = parse(metric[7][0])
+    assert histogram[1] == [3]
+    assert histogram[2] == [3.55]
+    # cumulative, +Inf bucket is implied
+    assert [parse(b) for b in histogram[3]] == [
+        {1: [1], 2: [0.1]},
+        {1: [2], 2: [1]},
+    ]
+    assert 15 in histogram
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def packed(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(unzigzag(value))
+    return values
+
+
+def test_native_histogram():
+    registry = Registry()
+    h = registry.native_histogram(name='latency', schema=0)
+    registry.native_histogram(name='empty').with_labels()
+    # buckets 1, 2, 3, 7 and 8, gap of 3 starts a new span
+    for v in (1.5, 3, 3, 5, 100, 200, -1, 0):
+        h.with_labels().observe(v)
+
+    latency, empty = families(registry)
+    histogram = parse(parse(latency[4][0])[7][0])
+    assert histogram[1] == [8]
+    # no classic buckets
+    assert 3 not in histogram
+    assert unzigzag(histogram[5][0]) == 0
+    assert histogram[7] == [1]
+    assert [parse(s) for s in histogram[12]] == [
+        {1: [2], 2: [3]},
+        {1: [6], 2: [2]},
+    ]
+    assert packed(histogram[13][0]) == [1, 1, -1, 0, 0]
+    # field 8 is zero_count_float
+    assert 8 not in histogram
+    assert [parse(s) for s in histogram[9]] == [{1: [0], 2: [1]}]
+    assert packed(histogram[10][0]) == [1]
+
+    # no observations, but histogram is still marked as native
+    histogram = parse(parse(empty[4][0])[7][0])
+    assert unzigzag(histogram[5][0]) == 3
+    assert histogram[12] == [b'']
+    assert 13 not in histogram
+
+
+def test_summary():
+    registry = Registry()
+    s = registry.summary(name='size', buckets=[0.5])
+    registry.summary(name='empty', buckets=[0.5])
+    s.with_labels().observe(3)
+
+    (family, ) = families(registry)
+    assert family[3] == [2]
+    (metric, ) = map(parse, family[4])
+    summary = parse(metric[4][0])
+    assert summary[1] == [1]
+    assert summary[2] == [3]
+    assert parse(summary[3][0]) == {1: [0.5], 2: [3]}
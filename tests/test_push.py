@@ -0,0 +1,218 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+from epimetheus import push
+from epimetheus.push import (
+    PushGatewayExporter, RemoteWriteExporter, snappy_compress)
+from epimetheus.registry import Registry
+
+from test_protobuf import parse, read_varint
+
+
+class Stub(ThreadingHTTPServer):
+    "Records requests, responds with status of the next item in statuses"
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        self.connections = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length', 0))
+                stub.requests.append(
+                    (self.command, self.path, dict(self.headers),
+                     self.rfile.read(length)))
+                stub.connections.add(self.client_address)
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_PUT = do_POST = do_DELETE = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+@pytest.fixture
+def stub():
+    server = Stub()
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_registry():
+    registry = Registry()
+    c = registry.counter(name='jobs_total')
+    g = registry.gauge(name='last_run')
+    c.with_labels(kind='a').inc()
+    g.with_labels().set(10)
+    return registry, c, g
+
+
+def test_pushgateway_deltas(stub):
+    registry, c, g = make_registry()
+    exporter = PushGatewayExporter(
+        registry, stub.url + '/base', 'backup',
+        grouping={'instance': 'db/1', 'zone': 'east'})
+
+    assert exporter.push()
+    assert exporter.push()
+    g.with_labels().set(11)
+    assert exporter.push()
+    exporter.close(push=False)
+
+    (put, post) = stub.requests
+    assert put[0] == 'PUT'
+    assert put[1] == (
+        '/base/metrics/job/backup/instance@base64/ZGIvMQ==/zone/east')
+    assert b'jobs_total{kind="a"} 1\n' in put[3]
+    assert b'last_run 10\n' in put[3]
+    # only changed group, others stay on gateway
+    assert post[0] == 'POST'
+    assert b'last_run 11\n' in post[3]
+    assert b'jobs_total' not in post[3]
+    # connection is reused
+    assert len(stub.connections) == 1
+
+
+def test_pushgateway_retries(stub):
+    registry, c, g = make_registry()
+    exporter = PushGatewayExporter(registry, stub.url, 'backup', interval=1)
+    stub.statuses = [500]
+    assert not exporter.push()
+    assert 1 <= exporter._delay() <= 2
+    # failed push is repeated as a whole
+    assert exporter.push()
+    assert exporter._delay() == 1
+    assert [r[0] for r in stub.requests] == ['PUT', 'PUT']
+
+    registry.unregister(g.key)
+    assert exporter.push()
+    assert stub.requests[-1][0] == 'PUT'
+    assert b'last_run' not in stub.requests[-1][3]
+
+    assert exporter.delete()
+    assert stub.requests[-1][:2] == ('DELETE', '/metrics/job/backup')
+
+
+def test_push_unreachable():
+    registry, c, g = make_registry()
+    exporter = PushGatewayExporter(
+        registry, 'http://127.0.0.1:1', 'backup', interval=1, timeout=1)
+    assert not exporter.push()
+    assert not exporter.push()
+    assert exporter._failures == 2
+    assert 2 <= exporter._delay() <= 4
+
+
+def test_background_push(stub):
+    registry, c, g = make_registry()
+    exporter = PushGatewayExporter(
+        registry, stub.url, 'backup', interval=0.01).start()
+    for _ in range(100):
+        if stub.requests:
+            break
+        exporter._stopped.wait(0.01)
+    c.with_labels(kind='a').inc()
+    exporter.close()
+    assert stub.requests[0][0] == 'PUT'
+    assert b'jobs_total{kind="a"} 2\n' in stub.requests[-1][3]
+
+
+def snappy_decompress(data):
+    "Decoder of literal elements only, enough for fallback encoder"
+    size, pos = read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        assert tag & 3 == 0
+        n = tag >> 2
+        pos += 1
+        if n >= 60:
+            extra = n - 59
+            n = int.from_bytes(data[pos:pos + extra], 'little')
+            pos += extra
+        out += data[pos:pos + n + 1]
+        pos += n + 1
+    assert len(out) == size
+    return bytes(out)
+
+
+@pytest.mark.parametrize('size', (0, 1, 60, 61, 300, 70000, 200000))
+def test_snappy_literals(monkeypatch, size):
+    monkeypatch.setattr(push, 'snappy', None)
+    data = bytes(i % 251 for i in range(size))
+    assert snappy_decompress(snappy_compress(data)) == data
+
+
+def write_request(body):
+    series = []
+    for ts in parse(snappy_decompress(body)).get(1, []):
+        ts = parse(ts)
+        labels = {
+            parse(p)[1][0].decode(): parse(p)[2][0].decode() for p in ts[1]}
+        (sample, ) = map(parse, ts[2])
+        series.append((labels, sample[1][0], sample[2][0]))
+    return series
+
+
+def test_remote_write(stub, monkeypatch):
+    monkeypatch.setattr(push, 'snappy', None)
+    registry, c, g = make_registry()
+    h = registry.histogram(name='latency', buckets=[1])
+    h.with_labels().observe(0.5)
+    h.with_labels().observe(2)
+    exporter = RemoteWriteExporter(registry, stub.url + '/api/v1/write')
+
+    assert exporter.push()
+    method, path, headers, body = stub.requests[0]
+    assert (method, path) == ('POST', '/api/v1/write')
+    assert headers['Content-Encoding'] == 'snappy'
+    assert headers['Content-Type'] == 'application/x-protobuf'
+    series = {
+        tuple(sorted(labels.items())): value
+        for labels, value, ts in write_request(body)}
+    assert series == {
+        (('__name__', 'jobs_total'), ('kind', 'a')): 1,
+        (('__name__', 'last_run'), ): 10,
+        # cumulative buckets
+        (('__name__', 'latency_bucket'), ('le', '1')): 1,
+        (('__name__', 'latency_bucket'), ('le', '+Inf')): 2,
+        (('__name__', 'latency_sum'), ): 2.5,
+        (('__name__', 'latency_count'), ): 2,
+    }
+    assert all(ts > 0 for _, _, ts in write_request(body))
+
+    # only changed samples
+    assert exporter.push()
+    assert len(stub.requests) == 1
+    c.with_labels(kind='a').inc()
+    assert exporter.push()
+    (labels, value, ts), = write_request(stub.requests[1][3])
+    assert labels == {'__name__': 'jobs_total', 'kind': 'a'}
+    assert value == 2
+
+    # unchanged ones are repeated from time to time
+    exporter.resend_interval = 0
+    assert exporter.push()
+    assert len(write_request(stub.requests[2][3])) == 6
+
+
+def test_invalid_url():
+    registry, c, g = make_registry()
+    with pytest.raises(ValueError):
+        RemoteWriteExporter(registry, 'ftp://example.com')
@@ -0,0 +1,51 @@
+import random
+from bisect import bisect_left
+
+import pytest
+from epimetheus.quantile import CKMS, ckms
+
+
+@pytest.mark.parametrize('dist', ('uniform', 'exponential'))
+def test_ckms_error_bounds(dist):
+    rnd = random.Random(42)
+    if dist == 'uniform':
+        values = [rnd.random() for _ in range(50000)]
+    else:
+        values = [rnd.expovariate(1) for _ in range(50000)]
+    targets = {0.5: 0.01, 0.9: 0.005, 0.99: 0.001}
+
+    s = CKMS(targets)
+    for v in values:
+        s.insert(v)
+    assert s.count == len(values)
+
+    values.sort()
+    for q, e in targets.items():
+        rank = bisect_left(values, s.query(q)) / len(values)
+        assert abs(rank - q) <= e
+    assert s.query(0) == values[0]
+    assert s.query(1) == values[-1]
+    # memory is bounded by precision, not by observation count
+    assert len(s._values) < 500
+
+
+def test_ckms_small():
+    s = CKMS({0.5: 0.01})
+    for v in (3, 1, 2):
+        s.insert(v)
+    assert s.query(0.5) == 2
+    assert s.query(0) == 1
+    assert s.query(1) == 3
+
+
+def test_ckms_validation():
+    with pytest.raises(ValueError):
+        CKMS({1.5: 0.01})
+    with pytest.raises(ValueError):
+        CKMS({0.5: 0})
+
+
+def test_ckms_factory():
+    assert ckms(0.05)((0.5, 0.9)).targets == {0.5: 0.05, 0.9: 0.05}
+    assert ckms({0.5: 0.05, 0.9: 0.01})((0.5, 0.9)).targets == \
+        {0.5: 0.05, 0.9: 0.01}
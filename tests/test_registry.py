@@ -1,3 +1,4 @@
+import pytest
 from epimetheus.registry import Registry
 
 
@@ -26,3 +27,59 @@ def test_all_at_once(frozen_sample_time):
         + f'{frozen_sample_time}',
         '',
     ]
+
+
+def test_render(frozen_sample_time, mocker):
+    registry = Registry()
+
+    c = registry.counter(name='requests_total', use_clock=False)
+    h = registry.histogram(name='latency', buckets=[1])
+    s = registry.summary(name='output', buckets=[0.5])
+    registry.gauge(name='empty')
+
+    c.with_labels(code=200).inc()
+    h.with_labels().observe(0.5)
+    s.with_labels().observe(3)
+
+    text = registry.render()
+    assert text == '\n'.join(registry.expose()) + '\n'
+    assert registry.render() == text
+
+    c200 = c.with_labels(code=200)
+    counter_spy = mocker.spy(c200, 'sample_values')
+    histogram_spy = mocker.spy(h.with_labels(), 'sample_values')
+
+    c200.inc()
+    c.with_labels(code=500).inc()
+    text = registry.render()
+    assert text == '\n'.join(registry.expose()) + '\n'
+    assert 'requests_total{code="200"} 2\n' in text
+    assert 'requests_total{code="500"} 1\n' in text
+    # unchanged histogram is taken from cache
+    assert counter_spy.call_count == 2
+    assert histogram_spy.call_count == 1
+
+
+def test_group_options(tmp_path):
+    registry = Registry()
+    c = registry.counter(name='c', max_series=10, overflow='fold', ttl=60)
+    assert (c.max_series, c.overflow, c.ttl) == (10, 'fold', 60)
+    with pytest.raises(ValueError):
+        registry.histogram(name='h', columnar=True, max_series=10)
+    with pytest.raises(ValueError):
+        Registry(multiprocess_dir=str(tmp_path)).counter(name='c', ttl=60)
+
+
+def test_labelnames(tmp_path):
+    for registry in (Registry(), Registry(threadsafe=True)):
+        c = registry.counter(name='c', labelnames=('url', ), use_clock=False)
+        c.labels('/').inc()
+        assert list(registry.expose()) == [
+            '# TYPE c counter', 'c{url="/"} 1', '']
+    h = Registry().histogram(
+        name='h', buckets=[1], columnar=True, labelnames=('url', ))
+    assert h.labels('/') is h.with_labels(url='/')
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    c = registry.counter(name='c', labelnames=('url', ))
+    c.labels('/').inc()
+    assert 'c{url="/"} 1.0' in list(registry.expose())
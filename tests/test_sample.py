@@ -1,7 +1,9 @@
+import asyncio
 import math
+import time
 
 import pytest
-from epimetheus.sample import SampleKey, SampleValue
+from epimetheus.sample import CoarseClock, SampleKey, SampleValue
 
 
 class TestExposeOutput:
@@ -31,6 +33,9 @@ class TestExposeOutput:
         (0, '0'),
         (1, '1'),
         (0.1, '0.1'),
+        (3.0, '3.0'),
+        (10 ** 20, '100000000000000000000'),
+        (-2.5e-7, '-2.5e-07'),
         (math.inf, 'Inf'),
         (-math.inf, '-Inf'),
         (math.nan, 'Nan'),
@@ -106,8 +111,105 @@ class TestSampleKey:
         hash(SampleKey(name='name'))
         hash(SampleKey(name='name', labels={'x': 3}))
 
+    def test_equality_any_order(self):
+        a = SampleKey('name', {'a': 1, 'b': 'x'})
+        b = SampleKey('name', {'b': 'x', 'a': '1'})
+        assert a == b
+        assert hash(a) == hash(b)
+        assert a.expose() == 'name{a="1",b="x"}'
+        assert b.expose() == 'name{b="x",a="1"}'
+        assert a != SampleKey('name', {'a': 1})
+        assert a != SampleKey('other', {'a': 1, 'b': 'x'})
+        assert SampleKey('name') == SampleKey('name', {})
+
+    def test_interned(self):
+        a = SampleKey('name', {'path': '/'.join(['', 'x'])})
+        b = SampleKey('name', {'path': '/'.join(['', 'x'])})
+        assert a.labels['path'] is b.labels['path']
+
+    def test_immutable(self):
+        k = SampleKey('name', {'a': 1})
+        with pytest.raises(AttributeError):
+            k.name = 'other'
+        assert not hasattr(k, '__dict__')
+
+    def test_derived(self):
+        k = SampleKey('name', {'a': 1})
+        assert k.labels == {'a': '1'}
+        assert k.with_suffix('_sum').expose() == 'name_sum{a="1"}'
+        assert k.with_labels(b=2).expose() == 'name{a="1",b="2"}'
+        assert repr(k) == """SampleKey('name{a="1"}')"""
+
     def test_label_order(self):
         k = SampleKey(name='name', labels={'k': 1, 'a': 2})
         assert k.expose() == 'name{k="1",a="2"}'
         kb = k.with_labels(b=3)
         assert kb.expose() == 'name{k="1",a="2",b="3"}'
+
+    def test_precomputed_hash(self, mocker):
+        k = SampleKey('name', {'a': 1, 'b': 2})
+        # sorted labels aren't copied
+        assert k._sorted is k._items
+        spy = mocker.spy(SampleKey, '_init')
+        assert {k: 1}[SampleKey('name', {'b': 2, 'a': 1})] == 1
+        assert spy.call_count == 1
+
+
+def test_coarse_clock(mocker):
+    clock = mocker.patch('epimetheus.sample.clock', return_value=1000)
+    coarse = CoarseClock(interval=0.001)
+    assert coarse.now == 1000
+    clock.return_value = 2000
+    assert coarse.now == 1000
+    coarse.tick()
+    assert coarse.now == 2000
+
+    clock.return_value = 3000
+    coarse.start()
+    coarse.start()
+    try:
+        for _ in range(1000):
+            if coarse.now == 3000:
+                break
+            time.sleep(0.001)
+        assert coarse.now == 3000
+    finally:
+        coarse.stop()
+    assert coarse._thread is None
+
+
+def test_coarse_clock_attach(mocker):
+    clock = mocker.patch('epimetheus.sample.clock', return_value=1000)
+    coarse = CoarseClock(interval=0.001)
+
+    async def main():
+        coarse.attach()
+        clock.return_value = 2000
+        await asyncio.sleep(0.01)
+        coarse.stop()
+
+    asyncio.run(main())
+    assert coarse.now == 2000
+    assert coarse._handle is None
+
+
+def test_coarse_clock_after_loop(mocker):
+    clock = mocker.patch('epimetheus.sample.clock', return_value=1000)
+    coarse = CoarseClock(interval=0.001)
+
+    async def main():
+        coarse.attach()
+
+    asyncio.run(main())
+    clock.return_value = 2000
+    # closed loop doesn't refresh clock, thread takes over
+    coarse.start()
+    try:
+        assert coarse._thread is not None
+        for _ in range(1000):
+            if coarse.now == 2000:
+                break
+            time.sleep(0.001)
+        assert coarse.now == 2000
+    finally:
+        coarse.stop()
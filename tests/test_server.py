@@ -0,0 +1,198 @@
+import asyncio
+import gzip
+import http.client
+from threading import Barrier, Thread
+
+import pytest
+from epimetheus.exposition import PROTOBUF, TEXT, CompressedExposition
+from epimetheus.registry import Registry
+from epimetheus.sample import SampleKey
+from epimetheus.server import (
+    MetricsEndpoint, start_http_server, start_server_async)
+
+
+def make_registry():
+    registry = Registry()
+    c = registry.counter(name='requests_total', use_clock=False)
+    c.with_labels(url='/').inc(3)
+    return registry
+
+
+@pytest.fixture
+def http_server():
+    registry = make_registry()
+    srv = start_http_server(registry, 0, '127.0.0.1')
+    yield registry, srv.server_address[1]
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_threaded_keepalive(http_server):
+    registry, port = http_server
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/metrics')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.getheader('Content-Type') == TEXT.content_type
+    assert b'requests_total{url="/"} 3\n' in response.read()
+
+    # same connection, compressed
+    sock = conn.sock
+    conn.request('GET', '/metrics', headers={'Accept-Encoding': 'gzip'})
+    response = conn.getresponse()
+    assert conn.sock is sock
+    assert response.getheader('Content-Encoding') == 'gzip'
+    assert b'requests_total{url="/"} 3\n' in gzip.decompress(response.read())
+
+    conn.request('HEAD', '/metrics')
+    response = conn.getresponse()
+    assert response.read() == b''
+    assert int(response.getheader('Content-Length')) > 0
+
+    conn.request('GET', '/other')
+    response = conn.getresponse()
+    assert response.status == 404
+    response.read()
+    conn.close()
+
+
+def test_threaded_self_metrics():
+    registry = make_registry()
+    srv = start_http_server(registry, 0, '127.0.0.1', ttl=0)
+    port = srv.server_address[1]
+    for _ in range(2):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        conn.request('GET', '/metrics', headers={
+            'Accept': PROTOBUF.content_type})
+        body = conn.getresponse().read()
+        conn.close()
+    srv.shutdown()
+    srv.server_close()
+    self_metrics = srv.RequestHandlerClass.endpoint._self_metrics
+    # kept apart from served registry, in threadsafe one
+    assert self_metrics.registry.threadsafe
+    assert registry.get(SampleKey('metrics_scrape_duration_seconds')) is None
+    duration = self_metrics.duration.with_labels(format='protobuf')
+    # counts of threads are merged on exposition
+    assert list(duration.sample_values())[-1].value == 2
+    size = self_metrics.size.with_labels(
+        format='protobuf', encoding='identity')
+    assert next(size.sample_values()).value == len(body)
+    assert 'metrics_scrape_response_bytes{' in registry.render()
+
+
+def test_self_metrics_keep_payload(mocker):
+    registry = make_registry()
+    endpoint = MetricsEndpoint(registry, ttl=0)
+    MetricsEndpoint(registry, ttl=0)
+    assert len(registry._collectors) == 1
+    compress = mocker.spy(CompressedExposition, '_compress')
+    for _ in range(3):
+        endpoint.respond('/metrics', accept_encoding='gzip')
+    # scrape metrics don't make served registry look changed
+    assert compress.call_count == 1
+
+
+def test_payload_ttl(mocker):
+    registry = make_registry()
+    endpoint = MetricsEndpoint(registry, ttl=10, self_metrics=False)
+    render = mocker.spy(endpoint, '_render')
+    first = endpoint.payload(TEXT)
+    registry.get(SampleKey('requests_total')).with_labels(url='/').inc()
+    assert endpoint.payload(TEXT) is first
+    assert render.call_count == 1
+
+    endpoint.ttl = 0
+    assert b'requests_total{url="/"} 4' in endpoint.payload(TEXT)
+    assert render.call_count == 2
+
+
+def test_payload_coalesces_threads(mocker):
+    registry = make_registry()
+    endpoint = MetricsEndpoint(registry, self_metrics=False)
+    barrier = Barrier(8)
+    render = mocker.spy(endpoint, '_render')
+    results = []
+
+    def scrape():
+        barrier.wait()
+        results.append(endpoint.payload(TEXT, 'gzip'))
+
+    threads = [Thread(target=scrape) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert render.call_count == 1
+    assert len(set(map(id, results))) == 1
+
+
+def test_payload_coalesces_tasks(mocker):
+    registry = make_registry()
+    endpoint = MetricsEndpoint(registry, ttl=0, self_metrics=False)
+    render = mocker.spy(endpoint, '_render_async')
+
+    async def main():
+        return await asyncio.gather(*(
+            endpoint.payload_async(TEXT) for _ in range(8)))
+
+    results = asyncio.run(main())
+    assert render.call_count == 1
+    assert results[0] == registry.render().encode()
+    assert len(set(results)) == 1
+
+
+async def request(reader, writer, head):
+    writer.write(head.encode())
+    status = await reader.readline()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.lower()] = value.strip()
+    body = b''
+    if 'HEAD' not in head:
+        body = await reader.readexactly(int(headers['content-length']))
+    return status.decode().strip(), headers, body
+
+
+def test_async_server():
+    registry = make_registry()
+
+    async def main():
+        srv = await start_server_async(registry, 0, '127.0.0.1')
+        port = srv.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        results = [await request(reader, writer, (
+            'GET /metrics HTTP/1.1\r\nHost: x\r\n'
+            'Accept-Encoding: gzip\r\n\r\n'))]
+        # same connection, closed by server after response
+        results.append(await request(
+            reader, writer,
+            'GET /metrics?x=1 HTTP/1.1\r\nConnection: close\r\n\r\n'))
+        results.append(await reader.read())
+        writer.close()
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        results.append(await request(
+            reader, writer, 'POST /metrics HTTP/1.1\r\n\r\n'))
+        results.append(await request(
+            reader, writer, 'GET /other HTTP/1.0\r\n\r\n'))
+        writer.close()
+        srv.close()
+        await srv.wait_closed()
+        return results
+
+    gzipped, plain, eof, post, missing = asyncio.run(main())
+    assert gzipped[0] == 'HTTP/1.1 200 OK'
+    assert gzipped[1]['content-encoding'] == 'gzip'
+    assert b'requests_total{url="/"} 3\n' in gzip.decompress(gzipped[2])
+    assert plain[1]['connection'] == 'close'
+    assert plain[1]['content-type'] == TEXT.content_type
+    assert b'requests_total{url="/"} 3\n' in plain[2]
+    assert eof == b''
+    assert post[0] == 'HTTP/1.1 405 Method Not Allowed'
+    assert missing[0] == 'HTTP/1.1 404 Not Found'
+    assert missing[1]['connection'] == 'close'
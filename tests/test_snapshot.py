@@ -0,0 +1,151 @@
+import pytest
+from epimetheus.registry import Registry
+from epimetheus.snapshot import Snapshots, load
+
+
+def make_registry():
+    registry = Registry()
+    c = registry.counter(
+        name='requests_total', labels={'app': 'web'},
+        help='requests_total Total', use_clock=False)
+    g = registry.gauge(name='queue', use_clock=False)
+    h = registry.histogram(name='latency', buckets=[0.1, 1])
+    return registry, c, g, h
+
+
+def lines(registry):
+    "Exposed lines without timestamps, merged metrics use clock"
+    return [
+        line if line.startswith('#') else ' '.join(line.split()[:2])
+        for line in registry.expose()]
+
+
+def test_roundtrip():
+    source, c, g, h = make_registry()
+    c.with_labels(code=200, path='/').inc(3)
+    c.with_labels(code=500, path='/').inc(0.5)
+    g.with_labels().set(7)
+    h.with_labels().observe(0.5)
+    h.with_labels().observe(2)
+    source.summary(name='rtt', buckets=[0.5]).with_labels().observe(1)
+
+    target = Registry()
+    target.merge(source.snapshot())
+    # summaries are skipped
+    expected = lines(source)
+    assert lines(target) == expected[:expected.index('# TYPE rtt summary')]
+
+
+def test_deltas():
+    source, c, g, h = make_registry()
+    snapshots = Snapshots(source)
+    full = Registry()
+    merged = Registry()
+
+    c.with_labels(code=200).inc()
+    g.with_labels().set(1)
+    h.with_labels().observe(0.05)
+    merged.merge(snapshots.take())
+    # nothing changed
+    unchanged = snapshots.take()
+    assert list(load(unchanged)) == []
+    c.with_labels(code=200).inc(2)
+    c.with_labels(code=404).inc()
+    g.with_labels().set(3)
+    h.with_labels().observe(5)
+    delta = snapshots.take()
+    assert [name for _, name, *_ in load(delta)] == [
+        'requests_total', 'queue', 'latency']
+    (_, _, _, _, _, children), *_ = load(delta)
+    assert children == [(('code', '200'), [2.0]), (('code', '404'), [1.0])]
+    merged.merge(delta)
+
+    full.merge(source.snapshot())
+    assert lines(merged) == lines(full)
+
+
+def test_same_name_groups():
+    source = Registry()
+    for dc, value in (('a', 1), ('b', 5)):
+        source.counter(
+            name='x', labels={'dc': dc}, use_clock=False,
+        ).with_labels().inc(value)
+    target = Registry()
+    target.counter(name='x', labels={'dc': 'b'}, use_clock=False)
+    target.merge(source.snapshot())
+    assert lines(target) == [
+        '# TYPE x counter', 'x{dc="b"} 5', '',
+        '# TYPE x counter', 'x{dc="a"} 1', '']
+
+
+def test_counter_reset():
+    source, c, g, h = make_registry()
+    snapshots = Snapshots(source)
+    c.with_labels().inc(5)
+    target = Registry()
+    target.merge(snapshots.take())
+    source.unregister(c.key)
+    c = source.counter(name='requests_total', labels={'app': 'web'})
+    c.with_labels().inc(2)
+    target.merge(snapshots.take())
+    assert 'requests_total{app="web"} 7' in lines(target)
+
+
+@pytest.mark.parametrize('policy, value', [
+    ('sum', 15), ('max', 10), ('min', 5), ('last', 10),
+])
+def test_gauge_policies(policy, value):
+    target = Registry()
+    target.gauge(name='queue', use_clock=False).with_labels().set(5)
+    source = Registry()
+    source.gauge(name='queue', use_clock=False).with_labels().set(10)
+    target.merge(source.snapshot(), gauges=policy)
+    assert f'queue {value}' in list(target.expose())
+
+
+@pytest.mark.parametrize('policy', ('min', 'max'))
+@pytest.mark.parametrize('value', (5, -5))
+def test_gauge_policies_new_child(policy, value):
+    source = Registry()
+    source.gauge(name='queue', use_clock=False).with_labels().set(value)
+    target = Registry()
+    target.merge(source.snapshot(), gauges=policy)
+    assert f'queue {value}' in lines(target)
+
+
+def test_gauge_deltas_sum():
+    source, c, g, h = make_registry()
+    snapshots = Snapshots(source)
+    target = Registry()
+    g.with_labels().set(3)
+    target.merge(snapshots.take())
+    g.with_labels().set(1)
+    target.merge(snapshots.take())
+    assert 'queue 1' in lines(target)
+
+
+def test_merge_errors():
+    source, c, g, h = make_registry()
+    c.with_labels().inc()
+    h.with_labels().observe(1)
+
+    target = Registry()
+    target.gauge(name='requests_total')
+    with pytest.raises(ValueError):
+        target.merge(source.snapshot())
+
+    target = Registry()
+    target.histogram(name='latency', buckets=[1]).with_labels().observe(1)
+    with pytest.raises(ValueError):
+        target.merge(source.snapshot())
+
+    with pytest.raises(ValueError):
+        Registry().merge(source.snapshot(), gauges='avg')
+    with pytest.raises(ValueError):
+        Registry().merge(b'nope' + bytes(4))
+
+
+def test_multiprocess_unsupported(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        registry.snapshot()
@@ -0,0 +1,126 @@
+from threading import Barrier, Thread
+
+from epimetheus.metrics import Counter, Group
+from epimetheus.registry import Registry
+from epimetheus.sample import SampleKey
+from epimetheus.threadsafe import (
+    LockedGauge, LockedNativeHistogram, LockedSummary, ShardedCounter,
+    ShardedHistogram)
+
+THREADS = 8
+ITERATIONS = 5000
+
+
+def run_threads(fn):
+    barrier = Barrier(THREADS)
+
+    def target():
+        barrier.wait()
+        for _ in range(ITERATIONS):
+            fn()
+
+    threads = [Thread(target=target) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_registry_classes():
+    registry = Registry(threadsafe=True)
+    assert registry.counter(name='c').mcls is ShardedCounter
+    assert registry.gauge(name='g').mcls is LockedGauge
+    assert registry.histogram(name='h').mcls is ShardedHistogram
+    assert registry.summary(name='s', buckets=[0.5]).mcls is LockedSummary
+    assert registry.native_histogram(name='n').mcls is LockedNativeHistogram
+
+
+def test_counter():
+    registry = Registry(threadsafe=True)
+    c = registry.counter(name='c', use_clock=False).with_labels()
+    run_threads(c.inc)
+    assert list(registry.expose()) == [
+        '# TYPE c counter',
+        f'c {THREADS * ITERATIONS}',
+        '',
+    ]
+
+
+def test_gauge():
+    registry = Registry(threadsafe=True)
+    g = registry.gauge(name='g', use_clock=False).with_labels()
+    run_threads(lambda: g.inc(2))
+    run_threads(g.dec)
+    assert list(registry.expose()) == [
+        '# TYPE g gauge',
+        f'g {THREADS * ITERATIONS}',
+        '',
+    ]
+
+
+def test_histogram():
+    registry = Registry(threadsafe=True)
+    h = registry.histogram(name='h', buckets=[1]).with_labels()
+    assert list(registry.expose())[1:-1] == [
+        'h_bucket{le="1"} 0',
+        'h_bucket{le="+Inf"} 0',
+        'h_sum 0',
+        'h_count 0',
+    ]
+    run_threads(lambda: h.observe(2))
+    total = THREADS * ITERATIONS
+    assert list(registry.expose())[1:-1] == [
+        'h_bucket{le="1"} 0',
+        f'h_bucket{{le="+Inf"}} {total}',
+        f'h_sum {total * 2}',
+        f'h_count {total}',
+    ]
+
+
+def test_summary():
+    registry = Registry(threadsafe=True)
+    s = registry.summary(name='s', buckets=[0.5]).with_labels()
+    run_threads(lambda: s.observe(1))
+    assert list(registry.expose())[-2] == f's_count {THREADS * ITERATIONS}'
+
+
+def test_native_histogram():
+    registry = Registry(threadsafe=True)
+    h = registry.native_histogram(name='n', max_buckets=4).with_labels()
+    values = iter(range(THREADS * ITERATIONS))
+    run_threads(lambda: h.observe(next(values) + 1))
+    schema, zero_count, positive, negative = h.buckets_snapshot()
+    assert len(positive) <= 4
+    assert sum(positive.values()) == THREADS * ITERATIONS
+
+
+def test_concurrent_child_creation():
+    g = Group(key=SampleKey('name'), mcls=Counter)
+    seen = []
+    run_threads(lambda: seen.append(g.with_labels(x=len(seen) % 3)))
+    assert len(g._items) == 3
+    assert len(set(map(id, seen))) == 3
+
+
+def test_histogram_observe_many():
+    registry = Registry(threadsafe=True)
+    h = registry.histogram(name='h', buckets=[1]).with_labels()
+    run_threads(lambda: h.observe_many([0.5, 2]))
+    total = THREADS * ITERATIONS
+    assert list(registry.expose())[1:-1] == [
+        f'h_bucket{{le="1"}} {total}',
+        f'h_bucket{{le="+Inf"}} {total}',
+        f'h_sum {total * 2.5}',
+        f'h_count {total * 2}',
+    ]
+
+
+def test_exemplars():
+    registry = Registry(threadsafe=True)
+    c = registry.counter(name='c').with_labels()
+    c.inc(exemplar={'id': 'a'})
+    assert c._exemplar[:2] == ({'id': 'a'}, 1)
+    h = registry.histogram(name='h', buckets=[1]).with_labels()
+    h.observe(2, exemplar={'id': 'b'})
+    assert h._exemplars[0] is None
+    assert h._exemplars[1][:2] == ({'id': 'b'}, 2)
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from epimetheus.metrics import Gauge, Histogram, Summary
+
+
+@pytest.fixture
+def ns_clock(mocker):
+    "perf_counter_ns advancing by 0.25s on every call"
+    ticks = iter(range(0, 10 ** 12, 250_000_000))
+    return mocker.patch(
+        'epimetheus.timer.perf_counter_ns', side_effect=lambda: next(ticks))
+
+
+def test_context_manager(ns_clock):
+    h = Histogram(buckets=[0.1, 0.5])
+    with h.time():
+        pass
+    assert h._bcounts == [0, 1, 0]
+    assert h._sum == 0.25
+
+
+def test_context_manager_exception(ns_clock):
+    s = Summary(buckets=[0.5])
+    with pytest.raises(ZeroDivisionError):
+        with s.time():
+            1 / 0
+    assert [v.value for v in s.sample_values()] == [0.25, 0.25, 1]
+
+
+def test_decorator(ns_clock):
+    h = Histogram(buckets=[0.1, 0.5])
+
+    @h.time()
+    def work(x):
+        "docstring"
+        return x * 2
+
+    assert work(2) == 4
+    assert work(3) == 6
+    assert work.__doc__ == 'docstring'
+    assert h._count == 2
+    assert h._sum == 0.5
+
+
+def test_async_decorator(ns_clock):
+    g = Gauge(use_clock=False)
+
+    @g.time()
+    async def work():
+        await asyncio.sleep(0)
+        return 1
+
+    assert asyncio.run(work()) == 1
+    assert g._value == 0.25
+
+
+def test_track_inprogress():
+    g = Gauge(use_clock=False)
+    with g.track_inprogress():
+        with g.track_inprogress():
+            assert g._value == 2
+    assert g._value == 0
+
+    @g.track_inprogress()
+    async def work():
+        assert g._value == 1
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        asyncio.run(work())
+    assert g._value == 0
+
+    @g.track_inprogress()
+    def sync_work():
+        return g._value
+
+    assert sync_work() == 1